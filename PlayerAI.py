@@ -1,12 +1,35 @@
+import os
+import time
+import weakref
+from functools import partial
+from collections import deque
 from enum import Enum
 from PythonClientAPI.libs.Game.Enums import *
 from PythonClientAPI.libs.Game.MapOutOfBoundsException import *
-import time
+import numpy as np
+import instrument
+from distances import (DistanceEngine, DistanceTable, build_distance_table, table_memory, table_build_time,
+                       TABLE_MEMORY_BUDGET, UNREACHABLE, D_INDEX, DIRECTIONS)
+from grid import Grid, opposite
+from bitboard import BitBoards
+from snapshot import Snapshot, SHIELDS, LASERS, TELEPORTS
+from lookahead import Lookahead, STAY, FORWARD
+import spacetime
+import mapcache
+import sharedmaps
+from warmup import WarmUp
+from replay import ReplayWriter
+from turrets import TurretTracker
+from danger import DangerSchedule
+from bullets import BulletGrid, NO_BULLET
+from forecast import Forecaster
 
 d_perp = {Direction.UP : [Direction.LEFT, Direction.RIGHT],
           Direction.DOWN : [Direction.LEFT, Direction.RIGHT],
           Direction.LEFT : [Direction.UP, Direction.DOWN],
           Direction.RIGHT : [Direction.UP, Direction.DOWN]}
+# perpendicular facings as grid indices, in the same order as d_perp
+f_perp = {d : [D_INDEX[p] for p in ps] for d, ps in d_perp.items()}
 d_opp =  {Direction.UP : Direction.DOWN,
           Direction.DOWN : Direction.UP,
           Direction.LEFT : Direction.RIGHT,
@@ -15,6 +38,16 @@ tp_index_to_move = {0:Move.TELEPORT_0, 1:Move.TELEPORT_1,
                     2:Move.TELEPORT_2, 3:Move.TELEPORT_3, 
                     4:Move.TELEPORT_4, 5:Move.TELEPORT_5}
 
+# share of the time budget held back for the work after the distance search
+DEADLINE_RESERVE = 0.2
+# lookahead search time per turn without a time budget, and the least worth starting with
+LOOKAHEAD_BUDGET = 0.02
+LOOKAHEAD_MIN_TIME = 0.002
+face_moves = {Direction.UP : Move.FACE_UP,
+              Direction.DOWN : Move.FACE_DOWN,
+              Direction.LEFT : Move.FACE_LEFT,
+              Direction.RIGHT : Move.FACE_RIGHT}
+
 
 class Slay(Enum):
     ''' States in turret slaying mode. '''
@@ -26,22 +59,109 @@ class Slay(Enum):
 
 
 def print_debug(*arg):
-    ''' Prints in debug mode and does nothing in production. '''
-    # print(*arg)
-    return
- 
+    ''' Prints in debug mode (see instrument.enable) and does nothing in production. '''
+    if instrument.DEBUG:
+        instrument.debug(*arg)
+
+
+# PlayerAI attributes carried_refs passes on as they are
+CARRIED = ('slay_base_dead', 'turret_to_slay', 'slay_stage', 'preparing_slay_mode', 'learn_opp_defense',
+           'opp_shield_tp', 'opp_isnt_defensive_vs_laser', 'learn_opp_offense', 'opp_lasers',
+           'opp_is_aggro_vs_shield', 'mexican_standoff_turns', 'route_dest', 'route_version')
+
+
+def carried_state_of(refs):
+    '''
+    PlayerAI.carried_state from what carried_refs took.  Turrets go by
+    their index in gameboard.turrets.  Per-map tables and per-turn caches
+    are left out, they get rebuilt; see restore_state.  So are the slay
+    squares, only which turrets' squares are gone is kept, and turret
+    fire offsets are only listed when not 0.
+    '''
+    if refs is None:
+        return None
+    snap = refs['snapshot']
+    index = {key : i for i, key in enumerate(zip(snap.turret_x.tolist(), snap.turret_y.tolist()))}
+    version, slay_dropped, alive, offsets = refs['turrets']
+    turret = refs['turret_to_slay']
+    mode = refs['preparing_slay_mode']
+    route = refs['route']
+    return dict(
+        slay_base_dead=refs['slay_base_dead'],
+        slay_dropped=sorted(index[key] for key in slay_dropped),
+        turret_to_slay=None if turret is None else index[(turret.x, turret.y)],
+        slay_stage=refs['slay_stage'].name,
+        preparing_slay_mode=None if mode is None else mode.name,
+        learn_opp_defense=refs['learn_opp_defense'],
+        opp_shield_tp=int(refs['opp_shield_tp']),
+        opp_isnt_defensive_vs_laser=refs['opp_isnt_defensive_vs_laser'],
+        learn_opp_offense=refs['learn_opp_offense'],
+        opp_lasers=int(refs['opp_lasers']),
+        opp_is_aggro_vs_shield=refs['opp_is_aggro_vs_shield'],
+        mexican_standoff_turns=refs['mexican_standoff_turns'],
+        route=None if route is None else [[x, y, D_INDEX[d]] for (x, y, d) in route],
+        route_dest=refs['route_dest'] and list(refs['route_dest']),
+        route_version=refs['route_version'],
+        turrets_dead=np.nonzero(~alive)[0].tolist(),
+        turrets_version=version,
+        turret_offsets=[[index[key], offset] for key, offset in offsets])
+
 
 class PlayerAI:
-    def __init__(self):
-        ''' Initializes internal state without doing any real work since gameboard is not passed in. '''
-        self.walls = None
-        self.dist = None
+    def __init__(self, use_dist_table=True, time_budget=None, lookahead=False,
+                 map_cache=os.environ.get('TURRETSLAYER_MAP_CACHE'), warm_up=None,
+                 record=os.environ.get('TURRETSLAYER_RECORD'), shared_maps=None,
+                 shared_memory=bool(os.environ.get('TURRETSLAYER_SHARED_MEMORY'))):
+        ''' 
+        Initializes internal state without doing any real work since gameboard is not passed in.
+        use_dist_table precomputes all-pairs distances on the first turn when the map is small enough
+            (in memory, and to build within a turn).
+        time_budget (seconds) turns on deadline mode, see decide_move.
+        lookahead lets a short search (see lookahead.py) second-guess the move towards the destination.
+        map_cache is a directory to keep per-map tables in between matches (see mapcache.py), None for no cache.
+        warm_up builds the distance table (and writes the map cache) in the background, see adopt_warm_tables;
+            None (the default) only does when the table would take longer than a turn to build.
+        record is a directory to write a replay of the match to (see replay.py), None to not record.
+        shared_maps is a dict other PlayerAIs of the process share their map tables through (see batch.py).
+        shared_memory shares the map tables with PlayerAIs of other processes (see sharedmaps.py).
+        '''
+        self.grid = None # Grid of the fixed walls and turrets
+        self.walls = None # flat bytearray, self.walls[x*self.h + y] is 1 on walls and turrets
+        self.bits = None # BitBoards of the map, for whole-map set operations
+        self.engine = None # DistanceEngine over the fixed walls
+        self.use_dist_table = use_dist_table
+        self.dist_table = None # all-pairs DistanceTable, None if disabled or map too large
+        self.dist = None # (w,h) array of turns from player to each square
+        self.arrive = None # (w,h) bitmask of final orientations along shortest paths
+        self.dist_field = None
+        self.route = None # states (x, y, Direction) still ahead on the planned path, see shortest_path
+        self.route_dest = None
+        self.route_version = None # turret tracker version the route was planned with
+        self.wall_ray = None # direction:[[steps to the first wall or turret from (x,y)]]
         self.h = None
         self.w = None
-        self.turret_slay_sq = {} # (x,y):turret dictionary
-        self.last_turret_slay_sq = None
-
-        self.bullet_incoming = False
+        self.turret_slay_sq = {} # (x,y):[turrets that can be slain from it], in turret order
+        self.slay_bits = 0 # BitBoards mask of the turret_slay_sq squares
+        self.slay_base_dead = [] # indices of the turrets already dead when the slay squares were worked out
+        self.slay_dropped = set() # (x,y) of the turrets whose slay squares were dropped since
+        self.turret_tracker = TurretTracker()
+        self.carried_turrets = None # (version, slay_dropped, alive, offsets) copied by carried_refs
+        self.danger = None # DangerSchedule of turret fire
+        self.long_range_slay = False # untested, also slay from beyond turret range on large maps
+        # heuristics, see tournament.py for trying other values
+        self.slay_sq_bonus = 1 # a slay square beats a powerup when turret_d + slay_sq_bonus < pu_d
+        self.standoff_turns = 2 # turns spent shooting at an opponent right in front before stepping aside
+        self.min_slay_cooldown = 2 # turrets with a shorter cooldown are never slain
+        self.adjacent_slay_cooldown = 2 # and up to this cooldown only from the corners next to them
+        self.escape_rank = 1 # run_for_the_hills goes to the closest teleport location but this many, if there are enough
+
+        self.snapshot = None # Snapshot of the gameboard and players taken at the start of the turn
+        self.turret_squares = None # set of (x,y) with a turret, dead or alive
+        self.bullet_grid = None # BulletGrid of this turn's bullets
+        self.bullet_bits = None # this turn's bullets as one bitboard per travel direction
+        self.forecaster = None
+        self.forecast = None # Forecast of bullets and turret fire over the next few turns
+        self.forecast_key = None
         self.turret_to_slay = None
         self.preparing_slay_mode = None # Move indicating what to do before ready for turret slaying
         self.slay_stage = Slay.PREMOVE
@@ -54,9 +174,24 @@ class PlayerAI:
         self.opp_lasers = 0
         self.opp_is_aggro_vs_shield = False
 
-        self.live_turret_num = 0
         self.mexican_standoff_turns = 0
-        pass
+
+        self.time_budget = time_budget
+        self.use_lookahead = lookahead
+        self.lookahead = None # Lookahead for the map, when use_lookahead
+        self.spacetime = None # SpaceTime search timed around turret fire
+        self.deadline = None # perf_counter() time this turn's move is due, None without a budget
+        self.map_cache = mapcache.MapCache(map_cache) if map_cache else None
+        self.map_key = None # fingerprint of this map in the cache
+        self.map_tables = {} # name:array of the cacheable tables while setting up a new map
+        self.map_tables_new = False # some of map_tables were built rather than loaded
+        self.warm_up = WarmUp() if warm_up else None
+        self.auto_warm_up = warm_up is None
+        self.record_dir = record
+        self.recorder = None # ReplayWriter of this match
+        self.shared_maps = shared_maps # fingerprint:mapcache.SharedMap
+        self.shared_memory = shared_memory
+        self.prefetched_dist = None # (x, y, direction, dist) for this turn's calc_distances, see batch.py
 
 
     def get_move(self, gameboard, player, opponent):
@@ -83,32 +218,183 @@ class PlayerAI:
         - Only use powerup when either you or opponent is in danger (against turrets can efficiently kill with just bullets)
         - Teleport as last resort
         '''
+        instrument.start_turn(gameboard.current_turn)
+        if self.time_budget is not None:
+            self.deadline = time.perf_counter() + self.time_budget
+        try:
+            if not self.record_dir:
+                return self.decide_move(gameboard, player, opponent)
+            # the state from before the move, made into carried_state on the writer thread
+            carried = partial(carried_state_of, self.carried_refs())
+            start = time.perf_counter()
+            move = self.decide_move(gameboard, player, opponent)
+            self.record_turn(gameboard, move, carried, time.perf_counter() - start)
+            return move
+        finally:
+            instrument.end_turn()
+
+
+    def record_turn(self, gameboard, move, carried, spent):
+        '''
+        Hands this turn's snapshot and move to the replay writer, which
+        does the rest in the background.  If writing fails the move still
+        goes out: recording stops for the match (printed in debug mode).
+        '''
+        try:
+            if self.recorder is None:
+                os.makedirs(self.record_dir, exist_ok=True)
+                name = '{}-{}-{}.replay'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid(), time.perf_counter_ns())
+                self.recorder = ReplayWriter(os.path.join(self.record_dir, name), gameboard, self.snapshot)
+                # a PlayerAI dropped without close still finishes its replay
+                weakref.finalize(self, self.recorder.close)
+            self.recorder.record(self.snapshot, move, carried, spent)
+        except Exception as e:
+            print_debug('replay recording stopped: {!r}'.format(e))
+            self.record_dir = None
+            self.recorder = None
+
+
+    def close(self):
+        ''' The match is over: finishes writing the replay, if recording. '''
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+
+    def carried_state(self):
+        '''
+        What decisions carry over from one turn to the next (the slay
+        state machine, what was learnt about the opponent, the planned
+        route, turret bookkeeping) as plain JSON-able values, or None
+        before the first turn.  See carried_state_of and restore_state.
+        '''
+        return carried_state_of(self.carried_refs())
+
+
+    def carried_refs(self):
+        '''
+        What carried_state is made from, cheap enough to take before every
+        recorded move: mostly references, with copies only of what the
+        move changes in place.  The route is popped from, so it's copied;
+        the turret bookkeeping only changes along with the turret version,
+        so it's copied once per version.
+        '''
+        if self.walls is None:
+            return None
+        tracker = self.turret_tracker
+        if self.carried_turrets is None or self.carried_turrets[0] != tracker.version:
+            self.carried_turrets = (tracker.version, frozenset(self.slay_dropped), tracker.alive.copy(),
+                                    [(key, timing[2]) for key, timing in self.danger.timing.items() if timing[2]])
+        refs = {name : getattr(self, name) for name in CARRIED}
+        refs.update(snapshot=self.snapshot, turrets=self.carried_turrets,
+                    route=None if self.route is None else tuple(self.route))
+        return refs
+
+
+    def restore_state(self, state, gameboard):
+        '''
+        Puts back what carried_state returned, before get_move is called
+        for the next turn on the same map; a fresh PlayerAI builds the map
+        tables here first.  Turns only go forward: turrets dropped from
+        the fire schedule aren't added back.
+        '''
+        if self.walls is None:
+            self.calc_walls(gameboard)
+        turrets = gameboard.turrets
+        # the slay squares as first worked out, less the ones dropped since
+        base_dead = set(state['slay_base_dead'])
+        self.slay_base_dead = state['slay_base_dead']
+        self.turret_slay_sq = self.find_turret_slay_sq(turrets, [i in base_dead for i in range(len(turrets))])
+        self.slay_bits = self.bits.mask(self.turret_slay_sq)
+        self.slay_dropped = set()
+        for i in state['slay_dropped']:
+            self.drop_turret_slay_sq(turrets[i])
+        self.turret_to_slay = None if state['turret_to_slay'] is None else turrets[state['turret_to_slay']]
+        self.slay_stage = Slay[state['slay_stage']]
+        self.preparing_slay_mode = None if state['preparing_slay_mode'] is None else Move[state['preparing_slay_mode']]
+        for name in ('learn_opp_defense', 'opp_shield_tp', 'opp_isnt_defensive_vs_laser', 'learn_opp_offense',
+                     'opp_lasers', 'opp_is_aggro_vs_shield', 'mexican_standoff_turns', 'route_version'):
+            setattr(self, name, state[name])
+        self.route = None if state['route'] is None else deque((x, y, DIRECTIONS[f]) for x, y, f in state['route'])
+        self.route_dest = state['route_dest'] and tuple(state['route_dest'])
+
+        tracker = self.turret_tracker
+        tracker.alive = np.ones(len(turrets), dtype=bool)
+        tracker.alive[state['turrets_dead']] = False
+        tracker.live_num = int(tracker.alive.sum())
+        tracker.version = state['turrets_version']
+        offsets = dict(state['turret_offsets'])
+        for i, turret in enumerate(turrets):
+            key = (turret.x, turret.y)
+            if key not in self.danger.timing:
+                continue
+            if not tracker.alive[i]:
+                self.danger.remove(turret)
+            elif self.danger.timing[key][2] != offsets.get(i, 0):
+                self.danger.shift(key, offsets.get(i, 0))
+        # caches keyed on the turret version may not match the restored one
+        self.forecast_key = None
+        self.spacetime.cache = {}
+        self.carried_turrets = None
 
+
+    def decide_move(self, gameboard, player, opponent):
+        '''
+        Body of get_move, which adds per-turn instrumentation around it.
+
+        In deadline mode (time_budget set) a QA-vetted NONE or SHOOT is
+        worked out right after the map setup, the distance search stops at
+        the deadline, and the fallback is returned whenever the budget runs
+        out before a better move or the destination is beyond what was
+        searched.  A distance table too slow to build within the budget is
+        built in the background, so the first turn only pays for the map
+        setup (see calc_walls).
+        '''
         print_debug('...')
-        start = time.time()
         turn = gameboard.current_turn
+        with instrument.span('snapshot'):
+            snap = self.snapshot = Snapshot(gameboard, player, opponent)
+        opp = snap.players[1]
         if self.learn_opp_defense:
             # If opponent used a shield or a teleport last turn, he's overly cautious, and I don't have to use my laser to make him use up his defence. 
-            self.opp_isnt_defensive_vs_laser = not bool(self.opp_shield_tp - opponent.shield_count - opponent.teleport_count)
+            self.opp_isnt_defensive_vs_laser = not bool(self.opp_shield_tp - opp[SHIELDS] - opp[TELEPORTS])
             self.learn_opp_defense = False
         if self.learn_opp_offense:
             # If opponent shot a laser last turn, he takes risks while I hold a shield.  Will take advantage of this next time. 
-            self.opp_is_aggro_vs_shield = bool(self.opp_lasers - opponent.laser_count)
+            self.opp_is_aggro_vs_shield = bool(self.opp_lasers - opp[LASERS])
             self.learn_opp_offense = False
 
-        if self.walls == None:
-            self.calc_walls(gameboard)
-
-        self.update_live_turrets(gameboard)
+        with instrument.span('setup'):
+            new_map = self.walls == None
+            if new_map:
+                self.calc_walls(gameboard)
+            elif self.warm_up is not None and self.warm_up.pending:
+                self.adopt_warm_tables()
+
+            self.update_live_turrets(gameboard)
+            if new_map:
+                self.save_map_tables()
+            self.bullet_grid = BulletGrid(self.w, self.h, snap)
+            self.bullet_bits = self.bits.bullets(snap)
+
+        # in deadline mode have a safe move ready before anything else
+        fallback = None
+        if self.deadline is not None:
+            with instrument.span('fallback'):
+                fallback = self.fallback_move(gameboard, player, opponent)
+            if self.out_of_time():
+                print_debug("out of time, fallback", fallback)
+                return fallback
 
         # reached a turret slaying squre
-        if (player.x, player.y) in self.turret_slay_sq:
-            target_turret = self.turret_slay_sq[(player.x, player.y)]
+        if self.bits.has(self.slay_bits, player.x, player.y):
+            target_turret = self.slay_target((player.x, player.y))
             turns_req = 4 # enter turn shoot turn away
             if self.is_adjacent(player, target_turret.x, target_turret.y):
                 turns_req = 3
 
-            self.prepare_to_turret_slay(gameboard, target_turret, player, opponent, turn, turns_req)
+            with instrument.span('slay_prep'):
+                self.prepare_to_turret_slay(gameboard, target_turret, player, opponent, turn, turns_req)
             if not self.preparing_slay_mode: # finished all preparation
                 self.turret_to_slay = target_turret
         else:
@@ -120,11 +406,19 @@ class PlayerAI:
             print_debug("uninterrupted slaying mode")
             return self.turret_slay(gameboard, player, opponent)
 
+        if fallback is not None and self.out_of_time():
+            print_debug("out of time, fallback", fallback)
+            return fallback
+
         # update actual distances to everything
-        self.calc_distances(gameboard, player)
+        with instrument.span('distances'):
+            self.calc_distances(gameboard, player)
+        if fallback is not None and self.out_of_time():
+            return fallback
 
         # use a powerup if opportunity presents itself (someone is in danger)
-        powerup_move = self.consider_powering_up(gameboard, player, opponent)
+        with instrument.span('powerup'):
+            powerup_move = self.consider_powering_up(gameboard, player, opponent)
         if powerup_move is not None:
             return powerup_move
 
@@ -146,29 +440,165 @@ class PlayerAI:
         if self.next_pos((player.x,player.y), player.direction) == (opponent.x,opponent.y):
             return Move.SHOOT
         
-        destination = self.calc_destination(gameboard, opponent)
-        
-        direction = self.shortest_path(player, destination[0], destination[1])
+        with instrument.span('destination'):
+            destination = self.calc_destination(gameboard, opponent)
+            if fallback is not None and self.dist_to(destination[0], destination[1]) >= UNREACHABLE:
+                print_debug("destination beyond the searched radius, fallback", fallback)
+                return fallback
+            direction = self.shortest_path(player, destination[0], destination[1])
         move = self.dir_to_move(player, direction)
+        if self.bits.has(self.slay_bits, *destination):
+            # get there when the turret can be slain straight away, instead of waiting on the square
+            with instrument.span('spacetime'):
+                timed = self.timed_move(gameboard, player, opponent, self.slay_goals(destination))
+            if timed is not None and timed != move:
+                print_debug("timed for the slay phase", timed)
+                self.route = None
+                move = timed
         print_debug(move)
-        move = self.QA_move(gameboard, player, opponent, move)
+        with instrument.span('qa'):
+            qa_move = self.QA_move(gameboard, player, opponent, move)
+        if qa_move == Move.NONE and move == Move.FORWARD and not self.is_safe_from_all_turretfire(
+                *self.next_pos((player.x, player.y), player.direction), gameboard=gameboard):
+            # about to stand and wait for the fire to stop, maybe it can be timed or walked around
+            with instrument.span('spacetime'):
+                timed = self.timed_move(gameboard, player, opponent,
+                                        [(spacetime.state_mask(self.engine, [destination]), None, None)])
+            if timed is not None and timed != Move.FORWARD and self.QA_move(gameboard, player, opponent, timed) == timed:
+                print_debug("timed around turret fire", timed)
+                qa_move = timed
+        if qa_move != move:
+            # overridden, we're leaving the planned path
+            self.route = None
+        move = qa_move
         print_debug(move)
 
+        if self.lookahead is not None and move in {Move.FORWARD, Move.NONE} | set(face_moves.values()):
+            with instrument.span('lookahead'):
+                move = self.lookahead_move(player, opponent, destination, move)
 
-        print_debug("Turn %d:  %f" % (turn, 1000*(time.time() - start)))
         print_debug(destination)
         return move
 
 
+    def lookahead_move(self, player, opponent, destination, move):
+        '''
+        Search a few turns ahead (lookahead.py) and return its best move if
+        it scores better than the rule-based move, else the rule-based move.
+        Also keeps the rules when there is too little time left to search.
+        '''
+        deadline = self.deadline
+        if deadline is None:
+            deadline = time.perf_counter() + LOOKAHEAD_BUDGET
+        if deadline - time.perf_counter() < LOOKAHEAD_MIN_TIME:
+            return move
+
+        tx, ty = destination
+        if self.dist_table is not None:
+            state_distance = self.dist_table.state_distance
+            n = self.grid.n
+            target = self.grid.cell(tx, ty)
+            dest_dist = lambda c, f: state_distance(f*n + c, target)
+        else:
+            # no distances from arbitrary states, wrap-around manhattan distance instead
+            w, h = self.w, self.h
+            def dest_dist(c, f):
+                x, y = divmod(c, h)
+                dx = abs(x - tx)
+                dy = abs(y - ty)
+                return min(dx, w - dx) + min(dy, h - dy)
+
+        f = D_INDEX[player.direction]
+        values = self.lookahead.plan(self.snapshot.turn, player.x, player.y, f, self.bullet_bits,
+                                     opponent.x, opponent.y, D_INDEX[opponent.direction], dest_dist, deadline)
+        if not values:
+            return move
+
+        # the rule-based move as a search action
+        if move == Move.FORWARD:
+            rule = FORWARD if FORWARD in values else STAY
+        elif move == Move.NONE or move == face_moves[player.direction]:
+            rule = STAY
+        else:
+            rule = D_INDEX[next(d for d, m in face_moves.items() if m == move)]
+        best = max(values, key=values.get)
+        if values[best] <= values[rule]:
+            return move
+        print_debug("lookahead overrides", move, values)
+        self.route = None
+        if best == STAY:
+            return Move.NONE
+        if best == FORWARD:
+            return Move.FORWARD
+        return face_moves[DIRECTIONS[best]]
+
+
+    def timed_move(self, gameboard, player, opponent, goals):
+        '''
+        First move of the earliest safe arrival at one of the goals (see
+        SpaceTime.earliest), or None if there's none within reach or we're
+        already there.  In deadline mode also None if the search can't
+        finish in time, leaving time for QA after it.
+        '''
+        search_deadline = None
+        if self.deadline is not None:
+            search_deadline = self.deadline - DEADLINE_RESERVE * self.time_budget
+            if time.perf_counter() >= search_deadline:
+                return None
+        forecast = self.danger_forecast(gameboard)
+        found = self.spacetime.earliest(player.x, player.y, player.direction, gameboard.current_turn, goals,
+                                        blocked=[(opponent.x, opponent.y)],
+                                        unsafe=None if forecast.quiet else forecast.unsafe,
+                                        version=self.turret_tracker.version, deadline=search_deadline)
+        if found is None or found[1] is None:
+            return None
+        first = found[1]
+        if first == spacetime.WAIT:
+            return Move.NONE
+        if first == spacetime.FORWARD:
+            return Move.FORWARD
+        return self.dir_to_move(player, DIRECTIONS[first])
+
+
+    def slay_goals(self, sq):
+        '''
+        SpaceTime goal for the slay square sq: standing on it facing a way
+        prepare_to_turret_slay accepts, on the phase it waits for.
+        '''
+        turret = self.slay_target(sq)
+        facings = []
+        for d in DIRECTIONS:
+            nx, ny = self.next_pos(sq, d)
+            if not self.walls[nx*self.h + ny] and (nx == turret.x or ny == turret.y):
+                facings.append(D_INDEX[d])
+        return [(spacetime.state_mask(self.engine, [sq], facings),
+                 turret.fire_time + turret.cooldown_time, turret.fire_time)]
+
+
+    def fallback_move(self, gameboard, player, opponent):
+        ''' Cheap move for when time runs out: stand still (or shoot the opponent in front), vetted by QA_move. '''
+        move = self.QA_move(gameboard, player, opponent, Move.NONE)
+        if move == Move.NONE and self.next_pos((player.x,player.y), player.direction) == (opponent.x,opponent.y):
+            return Move.SHOOT
+        return move
+
+
+    def out_of_time(self):
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+
     def run_for_the_hills(self, gameboard):
         ''' Decide which teleport location to escape to; always returns a valid Move order '''
-        close_tp_locs = sorted(enumerate(gameboard.teleport_locations), key=lambda x: self.dist[x[1][0]][x[1][1]][0])
+        self.route = None
+        if self.dist is None:
+            # no distances yet this game (deadline fallback on the first turn)
+            close_tp_locs = list(enumerate(self.snapshot.teleport_locations))
+        else:
+            close_tp_locs = sorted(enumerate(self.snapshot.teleport_locations), key=lambda x: self.dist_to(x[1][0], x[1][1]))
         
         # go for the 2nd closest if possible, which is more likely to be safe else use closest
-        if len(close_tp_locs) > 1:
-            return tp_index_to_move[close_tp_locs[1][0]]
-        elif len(close_tp_locs) == 1:
-            return tp_index_to_move[close_tp_locs[0][0]]
+        if close_tp_locs:
+            return tp_index_to_move[close_tp_locs[min(self.escape_rank, len(close_tp_locs) - 1)][0]]
         # if there are no teleport locations, good maps should not have teleport powerups, but just in case...
         else:
             return Move.NONE
@@ -237,40 +667,171 @@ class PlayerAI:
                 
 
     def calc_walls(self, gameboard):
+        self.route = None
         self.h = gameboard.height
         self.w = gameboard.width
+        self.map_tables = {}
+        self.map_tables_new = False
+        shared = None
+        if self.map_cache is not None or self.shared_maps is not None or self.shared_memory:
+            self.map_key = mapcache.fingerprint(gameboard, self.long_range_slay, self.min_slay_cooldown,
+                                                self.adjacent_slay_cooldown)
+        if self.shared_maps is not None:
+            shared = self.shared_maps.get(self.map_key)
+        if shared is not None:
+            self.map_tables = dict(shared.tables)
+        else:
+            if self.shared_memory:
+                self.map_tables = sharedmaps.process_tables().acquire(self.map_key, self) or {}
+            if not self.map_tables and self.map_cache is not None:
+                self.map_tables = self.map_cache.load(self.map_key) or {}
         
-        self.walls = [[False for y in range(gameboard.height)] for x in range(gameboard.width)]
-        for wall in gameboard.walls:
-            self.walls[wall.x][wall.y] = True
-        for turret in gameboard.turrets:
-            self.walls[turret.x][turret.y] = True
-
-    def look_at_cross(self, gameboard, cur_x, cur_y, arm_length, func):
-        # assumes cur_x and cur_y are % w and h
-        # gives the direction towards cur_x and cur_y from arm
-        h = self.h
+        if shared is not None:
+            self.grid = shared.grid
+            self.bits = shared.bits
+            self.engine = shared.engine
+        else:
+            self.grid = Grid(self.w, self.h, [(wall.x, wall.y) for wall in gameboard.walls]
+                                             + [(turret.x, turret.y) for turret in gameboard.turrets])
+            self.bits = BitBoards(self.grid)
+            self.engine = DistanceEngine(np.frombuffer(self.grid.walls, dtype=np.uint8).reshape(self.w, self.h) != 0)
+        self.walls = self.grid.walls
+        self.turret_squares = {(turret.x, turret.y) for turret in gameboard.turrets}
+        if self.use_dist_table:
+            if 'dist_table' in self.map_tables:
+                self.dist_table = DistanceTable(self.engine, self.map_tables['dist_table'])
+            elif self.warm_up is not None or ((self.auto_warm_up or self.time_budget is not None)
+                                              and table_memory(self.engine.n) <= TABLE_MEMORY_BUDGET
+                                              and table_build_time(self.engine.n) > self.turn_seconds()):
+                # searched every turn until it's ready, in deadline mode whatever warm_up says
+                if self.warm_up is None:
+                    self.warm_up = WarmUp()
+                self.warm_up.start('dist_table', build_distance_table, self.engine)
+            else:
+                # None if over the memory budget or too slow for a turn, in which case we search every turn
+                self.dist_table = build_distance_table(self.engine, max_seconds=self.turn_seconds())
+                if self.dist_table is not None:
+                    self.map_tables['dist_table'] = self.dist_table.table
+                    self.map_tables_new = True
+        if 'wall_ray' in self.map_tables:
+            self.wall_ray = {d : ray.tolist() for d, ray in zip(DIRECTIONS, self.map_tables['wall_ray'])}
+        else:
+            self.calc_wall_rays()
+            self.map_tables['wall_ray'] = np.array([self.wall_ray[d] for d in DIRECTIONS], dtype=np.int32)
+            self.map_tables_new = True
+        self.danger = DangerSchedule(self.w, self.h, self.wall_ray, gameboard.turrets)
+        self.forecaster = Forecaster(self.w, self.h, self.wall_ray, self.danger)
+        if self.use_lookahead:
+            self.lookahead = Lookahead(self.grid, self.bits, self.danger)
+        self.spacetime = spacetime.SpaceTime(self.engine, self.danger)
+
+
+    def turn_seconds(self):
+        ''' How long a turn may take: the time budget in deadline mode, else instrument.DEADLINE_MS. '''
+        return self.time_budget if self.time_budget is not None else instrument.DEADLINE_MS / 1000
+
+
+    def adopt_warm_tables(self):
+        '''
+        Switches to the tables the warm up has finished since last turn.
+        Only called at the start of a turn, so each turn uses either the
+        per-turn search or the table throughout.
+        '''
+        for name, table in self.warm_up.poll().items():
+            if name == 'dist_table' and table is not None:
+                print_debug("distance table ready")
+                self.dist_table = table
+                self.map_tables['dist_table'] = table.table
+                self.map_tables_new = True
+        self.save_map_tables()
+
+
+    def save_map_tables(self):
+        '''
+        Writes a new map's tables to the map cache unless they all came
+        from there, and offers them to the other PlayerAIs on shared_maps
+        and, unless they came from there, in shared memory.
+        '''
+        if self.warm_up is not None and 'dist_table' in self.warm_up.pending:
+            # wait for the rest, they all go in one file
+            return
+        if self.shared_memory and self.map_key not in sharedmaps.process_tables().segments:
+            views = sharedmaps.process_tables().publish(self.map_key, self.map_tables, self)
+            if views is not None:
+                if self.dist_table is not None and 'dist_table' in views:
+                    # drop the private copy for the shared one
+                    self.dist_table = DistanceTable(self.engine, views['dist_table'])
+                self.map_tables = dict(views, **{name : table for name, table in self.map_tables.items()
+                                                 if name not in views})
+        if self.shared_maps is not None and self.map_key not in self.shared_maps:
+            self.shared_maps[self.map_key] = mapcache.SharedMap(self.grid, self.bits, self.engine, self.map_tables)
+        if self.map_cache is not None and self.map_tables_new:
+            if self.warm_up is not None:
+                self.warm_up.start('map_cache', self.map_cache.store, self.map_key, self.map_tables)
+            else:
+                self.map_cache.store(self.map_key, self.map_tables)
+        # the tables in use keep what they need
+        self.map_tables = {}
+        self.map_tables_new = False
+
+
+    def calc_wall_rays(self):
+        '''
+        self.wall_ray[d][x][y] is the number of steps from (x,y) in
+        direction d to the first wall or turret, wrapping around the map
+        (w or h if the whole line is open).  Anything closer than that is
+        in line of sight, so fire and line of sight checks become a
+        single comparison.  Also defined on walls, so turrets can look
+        out from their own square.
+        '''
         w = self.w
-        for x in range(cur_x + 1, cur_x + 1 + arm_length):
-            func(gameboard, x % w, cur_y, Direction.LEFT)
-        for x in range(cur_x - 1, cur_x - 1 - arm_length, -1):
-            func(gameboard, x % w, cur_y, Direction.RIGHT)
-        for y in range(cur_y + 1, cur_y + 1 + arm_length):
-            func(gameboard, cur_x, y % h, Direction.UP)
-        for y in range(cur_y - 1, cur_y - 1 - arm_length, -1):
-            func(gameboard, cur_x, y % h, Direction.DOWN)
-
-
-    # cross functions go here -----------------------------------------
-    def cross_no_bullet(self, gameboard, x, y, direction):
-        # print_debug("checking bullets ({},{})".format(x,y))
-        bullets = gameboard.are_bullets_at_tile(x, y)
-        # check if the bullet there is headed towards you
-        for b in bullets:
-            # print_debug("found bullet going {}".format(b.direction))
-            if b.direction == direction:
-                self.bullet_incoming = b
-                break
+        h = self.h
+        self.wall_ray = {d : [[0 for y in range(h)] for x in range(w)] for d in list(Direction)}
+        walls = self.walls
+        lines = []
+        for y in range(h):
+            lines.append((Direction.RIGHT, [x*h + y for x in range(w)]))
+            lines.append((Direction.LEFT, [x*h + y for x in range(w-1, -1, -1)]))
+        for x in range(w):
+            lines.append((Direction.DOWN, [x*h + y for y in range(h)]))
+            lines.append((Direction.UP, [x*h + y for y in range(h-1, -1, -1)]))
+
+        for d, line in lines:
+            ray = self.wall_ray[d]
+            size = len(line)
+            blocked = [i for i in range(size) if walls[line[i]]]
+            if not blocked:
+                for c in line:
+                    ray[c // h][c % h] = size
+                continue
+            # walk backwards from a wall, remembering the closest wall ahead
+            start = blocked[0]
+            last = start
+            for k in range(1, size + 1):
+                i = (start - k) % size
+                c = line[i]
+                ray[c // h][c % h] = (last - i) % size or size
+                if walls[c]:
+                    last = i
+
+
+    def can_hit(self, tx, ty, x1, y1, fire_range=4):
+        ''' Whether fire from (tx,ty) reaches (x1,y1) within fire_range squares before hitting a wall. '''
+        if tx == x1:
+            k = (y1 - ty) % self.h
+            if 0 < k <= fire_range and k < self.wall_ray[Direction.DOWN][tx][ty]:
+                return True
+            k = (ty - y1) % self.h
+            if 0 < k <= fire_range and k < self.wall_ray[Direction.UP][tx][ty]:
+                return True
+        if ty == y1:
+            k = (x1 - tx) % self.w
+            if 0 < k <= fire_range and k < self.wall_ray[Direction.RIGHT][tx][ty]:
+                return True
+            k = (tx - x1) % self.w
+            if 0 < k <= fire_range and k < self.wall_ray[Direction.LEFT][tx][ty]:
+                return True
+        return False
 
 
     def prepare_to_turret_slay(self, gameboard, target_turret, player, opponent, turn, turns_req_uninterrupted):
@@ -283,7 +844,7 @@ class PlayerAI:
         # can't slay if facing the wrong way (don't need to modulo since turret is inside grid)
         # moving in the current direction won't be in the way of turret fire (also means turret will be in way of your fire)
         (nx, ny) = self.next_pos((player.x, player.y), player.direction)
-        if self.walls[nx][ny] or (nx != target_turret.x and ny != target_turret.y): # turn towards a location in the firing range of turret
+        if self.walls[nx*self.h + ny] or (nx != target_turret.x and ny != target_turret.y): # turn towards a location in the firing range of turret
             # turn to either get away from wall or towards turret fire
             for d in list(Direction):
                 (x,y) = self.next_pos((player.x, player.y), d)
@@ -302,16 +863,16 @@ class PlayerAI:
             self.preparing_slay_mode = Move.NONE
             return
 
-        # cannot slay if about to die
-        self.bullet_incoming = None
-        self.look_at_cross(gameboard, player.x, player.y, turns_req_uninterrupted, self.cross_no_bullet)
-        if self.bullet_incoming:
-            print_debug("NO SLAY: bullet incoming ({},{})".format(self.bullet_incoming.x, self.bullet_incoming.y))
+        # cannot slay if about to die (we stay here or one square ahead until done)
+        ahead = self.next_pos((player.x, player.y), player.direction)
+        # the target's own fire is timed by the phase check above
+        if self.danger_forecast(gameboard).unsafe_hits([(player.x, player.y), ahead], range(1, turns_req_uninterrupted + 1),
+                                                       exclude=[(target_turret.x, target_turret.y)]):
+            print_debug("NO SLAY: bullet or turret fire incoming")
             return 
 
         # dangerous if opponent can get to us
-        # NOTE self.dist is from self to the other object, which is only an approximation of the distance
-        if self.dist[opponent.x][opponent.y][0] < turns_req_uninterrupted:
+        if self.opp_dist_to(opponent, player.x, player.y) < turns_req_uninterrupted:
             print_debug("NO SLAY: opponent too close")
             return 
 
@@ -321,7 +882,7 @@ class PlayerAI:
         #     tele_in = gameboard.teleport_locations
         #     for tele in tele_in:
         #         # distance that either the opponent or their bullet can close + 1 turn for teleport usage
-        #         if self.dist[tele[0]][tele[1]][0] + 1 < turns_req_uninterrupted:
+        #         if self.dist[tele[0], tele[1]] + 1 < turns_req_uninterrupted:
         #             print_debug("NO SLAY: opponent can teleport in")
         #             return 
 
@@ -341,26 +902,24 @@ class PlayerAI:
             print_debug("Turning to shoot")
             self.slay_stage = Slay.SHOOT
             for d in list(Direction):
-                for i in range(4):
-                    x1,y1 = self.next_pos((player.x,player.y),d,n=i+1)
-                    if gameboard.is_wall_at_tile(x1,y1): # can't reach turret by going this direction
-                        break # go to next direction
-                    if gameboard.is_turret_at_tile(x1,y1):  # reached turret without hitting a wall first
-                        return self.dir_to_move(player,d)
+                # first thing in the way in this direction has to be the turret
+                k = self.wall_ray[d][player.x][player.y]
+                if k > 4 and not self.long_range_slay:
+                    continue
+                x1,y1 = self.next_pos((player.x,player.y),d,n=k)
+                if (x1,y1) in self.turret_squares:
+                    return self.dir_to_move(player,d)
 
         # just shoot it
         elif self.slay_stage == Slay.SHOOT:
             print_debug("Shooting")
             # finished slaying turret
             self.slay_stage = Slay.PREMOVE
-            print_debug(len(self.last_turret_slay_sq))
-            # make sure that when squares are updated, those ones are not added
-            self.last_turret_slay_sq = {}
-            for k,v in self.turret_slay_sq.items():
-                if not (v.x == self.turret_to_slay.x and v.y == self.turret_to_slay.y):
-                    self.last_turret_slay_sq[k] = v
-            # self.last_turret_slay_sq = {k:v for k,v in self.turret_slay_sq.items() if v.x != self.turret_to_slay.x and v.y != self.turret_to_slay.y}
-            print_debug(len(self.last_turret_slay_sq))
+            print_debug(len(self.turret_slay_sq))
+            # done with this turret whether or not the shot kills it, never come back to its squares
+            self.drop_turret_slay_sq(self.turret_to_slay)
+            self.turret_tracker.bump()
+            print_debug(len(self.turret_slay_sq))
             self.turret_to_slay = None
             # get away from turret on the next move by resuming normal behaviour
             return Move.SHOOT
@@ -376,55 +935,23 @@ class PlayerAI:
 
     def is_safe_from_one_turretfire(self, x1, y1, tx, ty):
         ''' Also works for Laser usage.  (tx,ty) is source of fire, (x1,y1) is test position. '''
-        if tx == x1:
-            #checks if you're above/below/right/left of turret, and in range and not blocked by a wall
-            #up
-            for y in range(ty-1, ty-5, -1):
-                if self.walls[tx][y % self.h] == True:
-                    break
-                if y == y1:
-                    #BAD - TURRETFIRE
-                    return False
-            #down
-            for y in range(ty+1, ty+5):
-                if self.walls[tx][y % self.h] == True:
-                    break
-                if y == y1:
-                    #BAD - TURRETFIRE
-                    return False
-        if ty == y1:
-            #right
-            for x in range(tx-1, tx-5, -1):
-                if self.walls[x % self.w][ty] == True:
-                    break
-                if x == x1:
-                    #BAD - TURRETFIRE
-                    return False
-            #left
-            for x in range(tx+1, tx+5):
-                if self.walls[x % self.w][ty] == True:
-                    break
-                if x == x1:
-                    #BAD - TURRETFIRE
-                    return False
-        return True
-                    
+        return not self.can_hit(tx, ty, x1, y1)
+
 
     def is_safe_from_all_turretfire(self, x1, y1, gameboard):
         ''' Check whether the square at (x1,y1) is safe from turret fire on the next turn. '''
-        for turret in gameboard.turrets:
-            if turret.is_firing_next_turn:
-                # turret about to be destroyed, don't worry about it
-                self.bullet_incoming = None
-                self.look_at_cross(gameboard, turret.x, turret.y, 1, self.cross_no_bullet)
-                if self.bullet_incoming:
-                    print_debug("turret at ({},{}) about to die, ignore".format(turret.x, turret.y))
-                    continue
+        # turrets a bullet is about to destroy are already left out of the forecast
+        return not self.danger_forecast(gameboard).fire[1, x1, y1]
 
-                if self.is_safe_from_one_turretfire(x1, y1, turret.x, turret.y) == False:
-                    return False
-        # safe from all turrets
-        return True
+
+    def danger_forecast(self, gameboard):
+        ''' This turn's Forecast of bullets and turret fire, worked out on first use. '''
+        turn = gameboard.current_turn
+        version = self.turret_tracker.version
+        if self.forecast is None or self.forecast_key != (turn, version):
+            self.forecast = self.forecaster.forecast(turn, self.bullet_grid)
+            self.forecast_key = (turn, version)
+        return self.forecast
 
 
     def QA_move(self, gameboard, player, opponent, move):
@@ -435,28 +962,38 @@ class PlayerAI:
             if not self.is_safe_from_all_turretfire(x1, y1, gameboard):
                 return Move.NONE
             #Avoid bullets
-            for bullet in gameboard.bullets:
-                if bullet.direction == d_opp[player.direction]:
-                    #Bullet right in front of you - RUN!
-                    if (bullet.x, bullet.y) == (x1,y1):
-                        if player.teleport_count != 0:
-                            return self.run_for_the_hills(gameboard)
-                        elif player.shield_count != 0:
-                            return Move.SHIELD
-                        else:
-                            return move #nothing to be done; take the damage and go on your merry way.
-                    elif self.next_pos((bullet.x, bullet.y), bullet.direction, n=2) == (x1,y1):
-                        #Bullet coming at you from 3 squares away - turn away
-                        for d in d_perp[bullet.direction]:
-                            x2,y2 = self.next_pos((player.x,player.y), d)
-                            if self.walls[x2][y2] == False:
-                                return self.dir_to_move(player, d)
-                if self.next_pos((bullet.x, bullet.y), bullet.direction) == (x1,y1):
+            # look up the squares that matter instead of scanning all bullets, handling
+            # them in gameboard.bullets order as (bullet index, direction, squares before (x1,y1))
+            bd = d_opp[player.direction]
+            x3,y3 = self.prev_pos((x1,y1), bd, n=2)
+            threats = [(self.bullet_grid.index_at(x1, y1, bd), bd, 0),
+                       (self.bullet_grid.index_at(x3, y3, bd), bd, 2)]
+            for d in list(Direction):
+                x3,y3 = self.prev_pos((x1,y1), d)
+                threats.append((self.bullet_grid.index_at(x3, y3, d), d, 1))
+            for i, bullet_dir, bullet_dist in sorted(threats, key=lambda t: t[0]):
+                if i == NO_BULLET:
+                    break
+                #Bullet right in front of you - RUN!
+                if bullet_dist == 0:
+                    if player.teleport_count != 0:
+                        return self.run_for_the_hills(gameboard)
+                    elif player.shield_count != 0:
+                        return Move.SHIELD
+                    else:
+                        return move #nothing to be done; take the damage and go on your merry way.
+                elif bullet_dist == 2:
+                    #Bullet coming at you from 3 squares away - turn away
+                    for d in d_perp[bullet_dir]:
+                        x2,y2 = self.next_pos((player.x,player.y), d)
+                        if not self.walls[x2*self.h + y2]:
+                            return self.dir_to_move(player, d)
+                else:
                     #Bullet coming at you from 2 squares away - turn away
-                    if player.direction not in d_perp[bullet.direction]:
-                        for d in d_perp[bullet.direction]:
+                    if player.direction not in d_perp[bullet_dir]:
+                        for d in d_perp[bullet_dir]:
                             x2,y2 = self.next_pos((player.x,player.y), d)
-                            if self.walls[x2][y2] == False:
+                            if not self.walls[x2*self.h + y2]:
                                 return self.dir_to_move(player, d)
                         else:
                             #Nowhere to turn - RUN!
@@ -472,7 +1009,7 @@ class PlayerAI:
             #Avoid the square right in front of opponent - his shot would hit you with no warning.
             #But, there's also risk of a mexican standoff, with no one moving.  Only spend 2 turns shooting. 
             if (x1,y1) == self.next_pos((opponent.x, opponent.y), opponent.direction):
-                if self.mexican_standoff_turns < 2:
+                if self.mexican_standoff_turns < self.standoff_turns:
                     self.mexican_standoff_turns += 1
                     return Move.SHOOT
                 else:
@@ -480,14 +1017,14 @@ class PlayerAI:
                         if d == player.direction:
                             continue
                         x2,y2 = self.next_pos((player.x,player.y), d)
-                        if self.walls[x2][y2] == False:
+                        if not self.walls[x2*self.h + y2]:
                             return self.dir_to_move(player, d)
         #If you don't move, check that you won't get injured. 
         elif move in [Move.FACE_LEFT, Move.FACE_RIGHT, Move.FACE_DOWN, Move.FACE_UP, Move.LASER, Move.NONE]:
             x1,y1 = (player.x, player.y)
             if not self.is_safe_from_all_turretfire(x1, y1, gameboard):
                 x2,y2 = self.next_pos((x1,y1), player.direction)
-                if self.walls[x2][y2] == False:
+                if not self.walls[x2*self.h + y2]:
                     return Move.FORWARD
                 elif player.teleport_count != 0:
                     return self.run_for_the_hills(gameboard)
@@ -496,21 +1033,23 @@ class PlayerAI:
                 else:
                     return move #nothing to be done; take the damage and go on your merry way.
             #Avoid unavoidable bullets (coming right at you from 1 square)
-            for bullet in gameboard.bullets:
-                if bullet.direction == d_opp[player.direction]:
-                    #Bullet right in front of you - RUN!
-                    if (bullet.x, bullet.y) == (x1,y1):
-                        if player.teleport_count != 0:
-                            return self.run_for_the_hills(gameboard)
-                        elif player.shield_count != 0:
-                            return Move.SHIELD
-                        else:
-                            return move #nothing to be done; take the damage and go on your merry way.
+            #Bullet right in front of you - RUN!
+            if self.bullet_grid.at(x1, y1, d_opp[player.direction]):
+                if player.teleport_count != 0:
+                    return self.run_for_the_hills(gameboard)
+                elif player.shield_count != 0:
+                    return Move.SHIELD
+                else:
+                    return move #nothing to be done; take the damage and go on your merry way.
         #All seems well.  No overrides. 
         return move
 
 
     def calc_destination(self, gameboard, opponent):
+        if self.dist_field is not None:
+            # only search until the choice below is settled: a slay square costs slay_sq_bonus extra turns
+            self.dist_field.nearest([(self.snapshot.power_up_squares, 0),
+                                     (self.turret_slay_sq.keys(), self.slay_sq_bonus)])
         turret_sq, turret_d = self.nearest_turret_slay_sq()
         pu_sq, pu_d = self.nearest_powerup_sq(gameboard)
         print_debug('distances', pu_d, turret_d)
@@ -520,103 +1059,135 @@ class PlayerAI:
             return turret_sq
         elif turret_d == None:
             return pu_sq
-        elif turret_d + 1 < pu_d:
+        elif turret_d + self.slay_sq_bonus < pu_d:
             return turret_sq
         else:
             return pu_sq
 
 
     def update_live_turrets(self, gameboard):
-        new_live_turret_num = 0
-        for turret in gameboard.turrets:
-            if not turret.is_dead:
-                new_live_turret_num += 1
-
-        # some turret died
-        if new_live_turret_num != self.live_turret_num:
-            live_turret_num = new_live_turret_num
+        ''' Squares are only calculated once, then dropped as their turrets die. '''
+        first_turn = self.turret_tracker.alive is None
+        died = self.turret_tracker.update(self.snapshot)
+        if first_turn:
             self.calc_turret_slay_sq(gameboard)
+        for turret in died:
+            self.drop_turret_slay_sq(turret)
+            self.danger.remove(turret)
+        if self.danger.sync(self.snapshot):
+            self.turret_tracker.bump()
+
+
+    def slay_target(self, sq):
+        ''' The turret to slay from sq, the last one listed like when the squares were a plain dict. '''
+        return self.turret_slay_sq[sq][-1]
+
+
+    def drop_turret_slay_sq(self, turret):
+        ''' Takes turret off its squares, a square only goes once no other live turret can be slain from it. '''
+        squares = []
+        for sq, turrets in self.turret_slay_sq.items():
+            live = [t for t in turrets if t.x != turret.x or t.y != turret.y]
+            if len(live) < len(turrets):
+                if live:
+                    self.turret_slay_sq[sq] = live
+                else:
+                    squares.append(sq)
+        for sq in squares:
+            del self.turret_slay_sq[sq]
+        self.slay_dropped.add((turret.x, turret.y))
+        self.slay_bits &= ~self.bits.mask(squares)
 
 
     def calc_turret_slay_sq(self, gameboard):
-        # reset to get rid of dead ones
-        self.turret_slay_sq = {}
+        # only done on the first turn, update_live_turrets drops squares of dead turrets after that
+        snap = self.snapshot
+        self.slay_base_dead = np.nonzero(snap.turret_dead)[0].tolist()
+        self.slay_dropped = set()
+        if 'slay_squares' in self.map_tables:
+            xy = self.grid.xy
+            self.turret_slay_sq = {}
+            for c, i in self.map_tables['slay_squares'].tolist():
+                self.turret_slay_sq.setdefault(xy[c], []).append(snap.turrets[i])
+            self.slay_bits = self.bits.mask(self.turret_slay_sq)
+            return
 
-        for turret in gameboard.turrets:
-            if turret.is_dead:
+        self.turret_slay_sq = self.find_turret_slay_sq(snap.turrets, snap.turret_dead.tolist())
+        self.slay_bits = self.bits.mask(self.turret_slay_sq)
+
+        # (cell, turret index) in the same order for the map cache, a row per turret of a square
+        index = {id(turret) : i for i, turret in enumerate(snap.turrets)}
+        self.map_tables['slay_squares'] = np.array([(self.grid.cell(*sq), index[id(turret)])
+                                                    for sq, turrets in self.turret_slay_sq.items()
+                                                    for turret in turrets],
+                                                   dtype=np.int32).reshape(-1, 2)
+        self.map_tables_new = True
+
+
+    def find_turret_slay_sq(self, turrets, dead):
+        ''' {(x,y): [turrets]} of the squares to slay each of turrets from, leaving out the dead ones. '''
+        slay_sq = {}
+        def add(sq, turret):
+            listed = slay_sq.setdefault(sq, [])
+            if not listed or listed[-1] is not turret:
+                listed.append(turret)
+        walls = self.walls
+        step = self.grid.step
+        xy = self.grid.xy
+        for turret, is_dead in zip(turrets, dead):
+            if is_dead:
                 continue
-            tx = turret.x
-            ty = turret.y
-            cd = turret.cooldown_time
+            tx, ty, cd = turret.x, turret.y, turret.cooldown_time
+            tc = self.grid.cell(tx, ty)
             #Can't kill low-cooldown turrets from within their firing
             #range (without powerups or getting shot)
-            if cd <= 1:
+            if cd < self.min_slay_cooldown:
                 continue
             #Can only kill 3-cooldown turrets from direct adjacency.
-            elif cd <= 2:
+            elif cd <= self.adjacent_slay_cooldown:
                 for d in list(Direction):
-                    x1,y1 = self.next_pos((tx,ty),d)
-                    if self.walls[x1][y1] == False:
-                        for dp in d_perp[d]:
-                            x2,y2 = self.next_pos((x1,y1),dp)
-                            # allow only removal from turret slay squares by keeping track of last turn's squares
-                            if self.last_turret_slay_sq != None and (x2,y2) not in self.last_turret_slay_sq:
-                                continue
-                            if self.walls[x2][y2] == False:
-                                self.turret_slay_sq[(x2,y2)] = turret
+                    c1 = step[1][D_INDEX[d]][tc]
+                    if not walls[c1]:
+                        for fp in f_perp[d]:
+                            c2 = step[1][fp][c1]
+                            if not walls[c2]:
+                                add(xy[c2], turret)
             #Can kill slow-cooldown turrets from anywhere.
-            elif cd > 2:
+            else:
                 for d in list(Direction):
-                    for i in range(4):
-                        x1,y1 = self.next_pos((tx,ty),d,n=i+1)
-                        if self.walls[x1][y1] == False:
-                            for dp in d_perp[d]:
-                                x2,y2 = self.next_pos((x1,y1),dp)
-                                # allow only removal from turret slay squares by keeping track of last turn's squares
-                                if self.last_turret_slay_sq != None and (x2,y2) not in self.last_turret_slay_sq:
-                                    continue
-                                if self.walls[x2][y2] == False:
-                                    self.turret_slay_sq[(x2,y2)] = turret
-                        else:
-                            break
-
-        self.last_turret_slay_sq = self.turret_slay_sq
-            # didn't test on any long range map, so just ignore long range special squares
-            # #Can kill any turrets from beyond their shooting range.
-            # for d in [Direction.UP, Direction.DOWN]:
-            #     x1,y1 = self.next_pos((tx,ty),d)
-            #     for i in range(self.h // 2 - 1):
-            #         if self.walls[x1][y1] == True:
-            #             break
-            #         if i >= 4:
-            #             self.turret_slay_sq[(x1,y1)] = turret
-            #         x1,y1 = self.next_pos((x1,y1),d)
-            # for d in [Direction.LEFT, Direction.RIGHT]:
-            #     x1,y1 = self.next_pos((tx,ty),d)
-            #     for i in range(self.w // 2 - 1):
-            #         if self.walls[x1][y1] == True:
-            #             break
-            #         if i >= 4:
-            #             self.turret_slay_sq[(x1,y1)] = turret
-            #         x1,y1 = self.next_pos((x1,y1),d)
+                    f = D_INDEX[d]
+                    # squares in range up to the first wall
+                    for i in range(min(4, self.wall_ray[d][tx][ty] - 1)):
+                        c1 = step[i+1][f][tc]
+                        for fp in f_perp[d]:
+                            c2 = step[1][fp][c1]
+                            if not walls[c2]:
+                                add(xy[c2], turret)
+
+            #Can kill any turrets from beyond their shooting range.
+            # (opt in, didn't test on any long range map)
+            if self.long_range_slay:
+                for d in list(Direction):
+                    half = (self.h if d in (Direction.UP, Direction.DOWN) else self.w) // 2
+                    for k in range(5, min(half, self.wall_ray[d][tx][ty])):
+                        add(self.next_pos((tx,ty),d,n=k), turret)
+        return slay_sq
 
 
     def nearest_sq(self, squares):
-        # Assumes self.dist calculated.
+        # Assumes self.dist calculated (and, with a lazy search, expanded far enough).
         if len(squares) == 0:
             return None, None
-        closest_sq = min(squares, key=lambda sq: self.dist[sq[0]][sq[1]][0])
-        dist = self.dist[closest_sq[0]][closest_sq[1]][0]
-        return closest_sq, dist
+        squares = list(squares)
+        xs, ys = zip(*squares)
+        d = self.dist[list(xs), list(ys)]
+        i = int(np.argmin(d))
+        return squares[i], int(d[i])
 
 
     def nearest_sq_dict(self, squares):
-        # For dictionaries with keys as (x,y):turret
-        if len(squares) == 0:
-            return None, None
-        closest_sq = min(squares.keys(), key=lambda sq: self.dist[sq[0]][sq[1]][0])
-        dist = self.dist[closest_sq[0]][closest_sq[1]][0]
-        return closest_sq, dist
+        # For dictionaries keyed by (x,y)
+        return self.nearest_sq(squares.keys())
 
 
     def nearest_turret_slay_sq(self):
@@ -625,21 +1196,15 @@ class PlayerAI:
 
 
     def nearest_powerup_sq(self, gameboard):
-        pu_squares = [(pu.x, pu.y) for pu in gameboard.power_ups]
-        return self.nearest_sq(pu_squares)
+        return self.nearest_sq(self.snapshot.power_up_squares)
 
 
     def next_pos(self, curr_pos, direction, n=1):
         ''' Get coordinates of the square in direction of current_pos. '''
+        if instrument.ENABLED:
+            instrument.count('next_pos')
         x,y = curr_pos
-        if direction == Direction.DOWN:
-            return (x, (y+n)%self.h)
-        elif direction == Direction.UP:
-            return (x, (y-n)%self.h)
-        elif direction == Direction.RIGHT:
-            return ((x+n)%self.w, y)
-        elif direction == Direction.LEFT:
-            return ((x-n)%self.w, y)
+        return self.grid.next_pos(x, y, D_INDEX[direction], n)
 
 
     def prev_pos(self, curr_pos, direction, n=1):
@@ -649,95 +1214,86 @@ class PlayerAI:
         curr_pos. 
         '''
         x,y = curr_pos
-        if direction == Direction.DOWN:
-            return (x, (y-n)%self.h)
-        elif direction == Direction.UP:
-            return (x, (y+n)%self.h)
-        elif direction == Direction.RIGHT:
-            return ((x-n)%self.w, y)
-        elif direction == Direction.LEFT:
-            return ((x+n)%self.w, y)
+        return self.grid.next_pos(x, y, opposite(D_INDEX[direction]), n)
 
 
     def calc_distances(self, gameboard, player):
         ''' 
-        Magic.  Produces self.dist - a 2D array corresponding to the
-        game map, with each cell containint (dist, dirList), where dist
-        is the number of turns to get from the player's current position
-        to that cell, and dirList is a list of possible final
-        orientations / last moves taken to do this in the shortest
-        amount of time.
-
-        This array can be used to reconstruct the shortest path from the
-        player to any cell, as well as for accurate distance
-        measurements. 
-        '''
-        self.dist = [[(9001,[Direction.DOWN]) for y in range(gameboard.height)] for x in range(gameboard.width)]
-        self.calc_distances_propagate(gameboard, {(player.x,player.y) : [player.direction]}, {}, 0)
-
-
-    def calc_distances_propagate(self, gameboard, squares1, squares2, distance):
-        ''' 
-        The details:  every square is either 1 turn away or 2 turns
-        away, depending on player's current orientation relative to the
-        direction of that square.  Thus, we increment distances and
-        spread the net of 'reached' squares (keeping track of
-        orientation along the shortest paths to deal with above), until
-        we've reached all reachable squares.
-
-        squares1, squares2 = {(x,y) : [dList]}, where (x,y) is cell
-        coordinate, and dList is the list of directions from which you
-        can arrive at this cell along a shortest path (may be multiple). 
+        Produces self.dist - a 2D array corresponding to the game map,
+        where self.dist[x, y] is the number of turns to get from the
+        player's current position to that cell, and self.arrive, a
+        bitmask of the possible final orientations / last moves taken
+        to do this in the shortest amount of time.
+
+        The search itself is done over (x, y, facing) states by the
+        distance engine (see distances.py), so the result can also be
+        traced back to the first move along a shortest path.  With the
+        all-pairs table (see build_distance_table) it is just a lookup,
+        and self.arrive is left as None.
+
+        Without the table the search is lazy: it starts here and only
+        goes as far out as calc_destination, dist_to and shortest_path
+        need, so self.dist reads UNREACHABLE beyond that.  In deadline
+        mode it stops short of the deadline.
         '''
-        for pos in squares1:
-            squares2.pop(pos,None)
-        next_squares1 = squares2
-        next_squares2 = {}
-        for pos, dList in squares1.items():
-            x,y = pos
-            for d_propagation in list(Direction):
-                x1,y1 = self.next_pos((x,y), d_propagation)
-                if self.walls[x1][y1] == False:
-                    if d_propagation in dList:
-                        if self.dist[x1][y1][0] > distance + 1:
-                            if (x1,y1) in next_squares1:
-                                next_squares1[(x1,y1)] += [d_propagation]
-                            else:
-                                next_squares1[(x1,y1)] = [d_propagation]
-                        if self.dist[x1][y1][0] == distance + 1:
-                            d_new = self.dist[x1][y1][1] + [d_propagation]
-                            if (x1,y1) in next_squares1:
-                                next_squares1[(x1,y1)] += d_new
-                            else:
-                                next_squares1[(x1,y1)] = d_new
-                    else:
-                        if self.dist[x1][y1][0] > distance + 2:
-                            if (x1,y1) in next_squares2:
-                                next_squares2[(x1,y1)] += [d_propagation]
-                            else:
-                                next_squares2[(x1,y1)] = [d_propagation]
-                        if self.dist[x1][y1][0] == distance + 2:
-                            d_new = self.dist[x1][y1][1] + [d_propagation]
-                            if (x1,y1) in next_squares2:
-                                next_squares2[(x1,y1)] += d_new
-                            else:
-                                next_squares2[(x1,y1)] = d_new
-            self.dist[x][y] = (distance,dList)
-        if len(next_squares1) == 0 and len(next_squares2) == 0:
+        if self.dist_table is not None:
+            # one row of the precomputed table, no arrival directions needed to trace back
+            self.dist_field = None
+            prefetched, self.prefetched_dist = self.prefetched_dist, None
+            if prefetched is not None and prefetched[:3] == (player.x, player.y, player.direction):
+                # looked up along with the rest of the batch
+                self.dist = prefetched[3]
+            else:
+                self.dist = self.dist_table.dist_from(player.x, player.y, player.direction)
+            self.arrive = None
             return
-        return self.calc_distances_propagate(gameboard, next_squares1, next_squares2, distance+1)
+        search_deadline = None
+        if self.deadline is not None:
+            # stop early enough to leave time for picking the destination and QA
+            search_deadline = self.deadline - DEADLINE_RESERVE * self.time_budget
+        self.dist_field = self.engine.start(player.x, player.y, player.direction, deadline=search_deadline)
+        self.dist = self.dist_field.dist
+        self.arrive = self.dist_field.arrive
+
+
+    def dist_to(self, x, y):
+        ''' Turns from the player to (x,y), searching further if the lazy search hasn't got there. '''
+        if self.dist_field is not None:
+            return self.dist_field.distance(x, y)
+        return int(self.dist[x, y])
+
+
+    def opp_dist_to(self, opponent, x, y):
+        ''' Turns for the opponent to get to (x,y). '''
+        if self.dist_table is not None:
+            return self.dist_table.distance(opponent.x, opponent.y, opponent.direction, x, y)
+        # NOTE self.dist is from self to the other object, which is only an approximation of the distance
+        return self.dist_to(opponent.x, opponent.y)
 
 
     def shortest_path(self, player, x, y):
         # Assumes self.dist calculated.  Returns direction in which you
-        # must move to get to (x,y) in shortest turns possible.  Assumes you have not reached target. 
-        x0 = player.x
-        y0 = player.y
-        while (x != x0) or (y != y0):
-            dList = self.dist[x][y][1]
-            d = dList[0]
-            x,y = self.prev_pos((x,y),d)
-        return d
+        # must move to get to (x,y) in shortest turns possible.
+        # The whole route is kept, and as long as the player took the planned step towards
+        # the same destination with the same turrets up, the next step is just read off it.
+        state = (player.x, player.y, player.direction)
+        if (self.route and self.route[0] == state and self.route_dest == (x, y)
+                and self.route_version == self.turret_tracker.version):
+            self.route.popleft()
+        else:
+            if instrument.ENABLED:
+                instrument.count('route_plans')
+            if self.dist_table is not None:
+                route = self.dist_table.route(player.x, player.y, player.direction, x, y)
+            else:
+                route = self.dist_field.route(x, y)
+            self.route = deque(route)
+            self.route_dest = (x, y)
+            self.route_version = self.turret_tracker.version
+        # already there or can't get there, keep facing the same way
+        if not self.route:
+            return player.direction
+        return self.route[0][2]
 
 
     def dir_to_move(self, player, direction):
@@ -0,0 +1,125 @@
+'''
+Many matches through one call: get_moves takes a (gameboard, player,
+opponent) triple per match and returns a Move per match.
+
+Each match keeps its own PlayerAI (turret deaths, the slay state machine,
+what was learnt about the opponent are all per match), but the PlayerAIs
+share their map tables through one shared_maps dict, so a map's walls,
+neighbour tables, distance engine and all-pairs table are built once
+however many matches are played on it.  With the all-pairs table the
+per-turn distance grids of every match on a map are one fancy index into
+it for the whole batch, handed to each PlayerAI before its turn.  Maps
+too large for the table still search lazily per match.
+
+The safety checks stay with each PlayerAI: a match's Forecast is a
+handful of small array operations, and putting several matches' bullets
+through one scatter saved less than it cost to gather them.  What's
+left per match is mostly the space-time search.
+
+    python batch.py --matches 1 4 16 64 --size 30     throughput against one PlayerAI per call, on the same shared_maps
+'''
+import argparse
+import time
+import numpy as np
+from distances import FAR, UNREACHABLE
+from PlayerAI import PlayerAI
+import simulator
+
+
+class Batch:
+    ''' The PlayerAIs of the matches being played, by match id. '''
+
+    def __init__(self, shared_maps=None, **options):
+        ''' options are passed on to every PlayerAI. '''
+        self.options = options
+        self.maps = {} if shared_maps is None else shared_maps # shared_maps of all the PlayerAIs
+        self.bots = {}
+
+    def get_moves(self, turns, ids=None):
+        '''
+        turns is a list of (gameboard, player, opponent), one per match,
+        and ids the match each one belongs to (by default its position, so
+        a match has to keep its place in the list).  Returns the Moves in
+        the same order.
+        '''
+        if ids is None:
+            ids = range(len(turns))
+        bots = []
+        for key in ids:
+            bot = self.bots.get(key)
+            if bot is None:
+                bot = self.bots[key] = PlayerAI(shared_maps=self.maps, **self.options)
+            bots.append(bot)
+        self.prefetch(bots, turns)
+        return [bot.get_move(*turn) for bot, turn in zip(bots, turns)]
+
+    def prefetch(self, bots, turns):
+        ''' Distance grids of all the players whose PlayerAI has an all-pairs table, a table at a time. '''
+        groups = {}
+        for bot, (gameboard, player, opponent) in zip(bots, turns):
+            if bot.dist_table is not None:
+                table = bot.dist_table.table
+                groups.setdefault(id(table), (table, bot.engine, []))[2].append((bot, player))
+        for table, engine, members in groups.values():
+            states = [engine.state(player.x, player.y, player.direction) for bot, player in members]
+            rows = table[states].astype(np.int32)
+            rows[rows == FAR] = UNREACHABLE
+            for (bot, player), row in zip(members, rows.reshape(len(states), engine.w, engine.h)):
+                bot.prefetched_dist = (player.x, player.y, player.direction, row)
+
+    def end(self, key):
+        ''' The match is over, close and forget its PlayerAI (the map tables stay for the next match on the map). '''
+        bot = self.bots.pop(key, None)
+        if bot is not None:
+            bot.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Moves per second of Batch against one PlayerAI per match on the same shared_maps.')
+    parser.add_argument('--matches', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--size', type=int, default=30)
+    parser.add_argument('--turrets', type=int, default=8)
+    parser.add_argument('--turns', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    def boards(count):
+        # every match on the same map, as the hosting setup mostly does
+        out = []
+        for i in range(count):
+            gameboard, s0, s1 = simulator.random_board(args.size, args.size, turrets=args.turrets, seed=args.seed)
+            out.append(simulator.Match(gameboard, None, None, s0, s1, max_turns=args.turns))
+        for match in out:
+            for p in match.players:
+                p.hp = 10**9 # never runs out
+        return out
+
+    def play(count, get_moves):
+        matches = boards(count)
+        moves = 0
+        start = time.perf_counter()
+        while not matches[0].over():
+            sides = [get_moves(side, [(m.gameboard, m.players[side], m.players[1 - side]) for m in matches])
+                     for side in (0, 1)]
+            for i, m in enumerate(matches):
+                m.step([sides[0][i], sides[1][i]])
+            moves += 2 * len(matches)
+        return moves / (time.perf_counter() - start), [m.moves for m in matches]
+
+    # the map tables are built before timing and shared either way, so the difference is what batching adds
+    shared = {}
+    match = boards(1)[0]
+    PlayerAI(shared_maps=shared).get_move(match.gameboard, match.players[0], match.players[1])
+    print('{}x{} map, {} turns, moves/s'.format(args.size, args.size, args.turns))
+    print('{:>8} {:>10} {:>10}'.format('matches', 'PlayerAI', 'Batch'))
+    for count in args.matches:
+        bots = [[PlayerAI(shared_maps=shared) for i in range(count)] for side in (0, 1)]
+        single_rate, single_moves = play(count, lambda side, turns: [bot.get_move(*turn) for bot, turn in zip(bots[side], turns)])
+        batches = [Batch(shared_maps=shared), Batch(shared_maps=shared)]
+        batch_rate, batch_moves = play(count, lambda side, turns: batches[side].get_moves(turns))
+        print('{:>8} {:>10.0f} {:>10.0f}  ({:.2f}x, same moves: {})'.format(
+            count, single_rate, batch_rate, batch_rate / single_rate, single_moves == batch_moves))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+'''
+get_move latency across map sizes and entity densities.
+
+Plays PlayerAI against itself in the simulator on generated boards and
+times every get_move call of player 0, split by the phase methods it goes
+through.  Bullets are topped up every turn so the scenario keeps its
+density, and both players get unlimited hp so every run lasts the full
+number of turns.
+
+    python benchmark.py                                  default scenarios
+    python benchmark.py --size 20,40 --turrets 4,16 --bullets 0,30
+    python benchmark.py --json bench.json --limit-ms 200
+
+Prints a table, optionally writes the same results as JSON, and exits
+non-zero if any scenario's max turn time is over --limit-ms.
+'''
+import argparse
+import itertools
+import json
+import math
+import random
+import sys
+import time
+from PythonClientAPI.libs.Game.Enums import *
+from PlayerAI import PlayerAI
+import simulator
+
+# PlayerAI methods timed separately; nested calls are counted in both
+PHASES = ['calc_walls', 'update_live_turrets', 'calc_distances', 'consider_powering_up',
+          'prepare_to_turret_slay', 'turret_slay', 'calc_destination', 'shortest_path', 'timed_move', 'QA_move',
+          'lookahead_move']
+
+DEFAULT_SCENARIOS = [
+    dict(size=15, walls=0.15, turrets=2, cooldown=(1, 5), bullets=0, power_ups=2),
+    dict(size=25, walls=0.15, turrets=6, cooldown=(1, 5), bullets=10, power_ups=3),
+    dict(size=40, walls=0.15, turrets=12, cooldown=(1, 5), bullets=30, power_ups=4),
+    dict(size=60, walls=0.10, turrets=24, cooldown=(1, 5), bullets=60, power_ups=6),
+]
+
+
+def percentile(values, p):
+    ''' Nearest-rank percentile of a non-empty list. '''
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(math.ceil(p / 100.0 * len(values))) - 1))
+    return values[k]
+
+
+def summarize(samples):
+    ''' p50/p99/max in milliseconds. '''
+    if not samples:
+        return dict(n=0, p50=0.0, p99=0.0, max=0.0)
+    ms = [1000 * s for s in samples]
+    return dict(n=len(ms), p50=percentile(ms, 50), p99=percentile(ms, 99), max=max(ms))
+
+
+class PhaseTimer:
+    '''
+    Wraps the PHASES methods of one PlayerAI instance and collects the time
+    spent in each phase per turn (0 on turns that skip it).
+    '''
+
+    def __init__(self, ai):
+        self.current = {}
+        self.samples = {name: [] for name in PHASES}
+        for name in PHASES:
+            setattr(ai, name, self.wrap(name, getattr(ai, name)))
+
+    def wrap(self, name, method):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.current[name] = self.current.get(name, 0.0) + time.perf_counter() - start
+        return timed
+
+    def end_turn(self, keep=True):
+        if keep:
+            for name in PHASES:
+                self.samples[name].append(self.current.get(name, 0.0))
+        self.current = {}
+
+
+def top_up_bullets(gameboard, count, rng):
+    ''' Add bullets on random open squares until there are count in flight. '''
+    while len(gameboard.bullets) < count:
+        x = rng.randrange(gameboard.width)
+        y = rng.randrange(gameboard.height)
+        if gameboard.blocked(x, y):
+            continue
+        gameboard.bullets.append(simulator.Bullet(x, y, rng.choice(list(Direction)), 1))
+
+
+def run_scenario(scenario, turns, seed):
+    size = scenario['size']
+    gameboard, s0, s1 = simulator.random_board(
+        size, size, wall_density=scenario['walls'], turrets=scenario['turrets'],
+        power_ups=scenario['power_ups'], cooldown_time=scenario['cooldown'], seed=seed)
+    ai = PlayerAI()
+    timer = PhaseTimer(ai)
+    match = simulator.Match(gameboard, ai, PlayerAI(), s0, s1, max_turns=turns)
+    for p in match.players:
+        p.hp = 10**9 # never runs out
+    rng = random.Random(seed)
+
+    totals = []
+    first_turn = None
+    while not match.over():
+        top_up_bullets(gameboard, scenario['bullets'], rng)
+        player, opponent = match.players
+        start = time.perf_counter()
+        move = ai.get_move(gameboard, player, opponent)
+        spent = time.perf_counter() - start
+        if first_turn is None:
+            # map preprocessing happens here, keep it out of the steady state numbers
+            first_turn = spent
+            timer.end_turn(keep=False)
+        else:
+            totals.append(spent)
+            timer.end_turn()
+        match.step([move, match.ais[1].get_move(gameboard, opponent, player)])
+
+    result = dict(scenario, cooldown=list(scenario['cooldown']), seed=seed, turns=len(totals) + 1,
+                  first_turn_ms=1000 * first_turn, total=summarize(totals))
+    result['phases'] = {name: summarize(timer.samples[name]) for name in PHASES}
+    return result
+
+
+def int_list(text):
+    return [int(v) for v in text.split(',')]
+
+
+def float_list(text):
+    return [float(v) for v in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark PlayerAI.get_move per-turn latency.')
+    parser.add_argument('--size', type=int_list, help='comma separated map sides')
+    parser.add_argument('--walls', type=float_list, default=[0.15], help='wall densities')
+    parser.add_argument('--turrets', type=int_list, default=[4])
+    parser.add_argument('--cooldown', type=int_list, default=[1, 5], help='min,max turret cooldown')
+    parser.add_argument('--bullets', type=int_list, default=[0])
+    parser.add_argument('--power-ups', type=int_list, default=[3])
+    parser.add_argument('--turns', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--limit-ms', type=float, help='fail if any steady state turn takes longer')
+    args = parser.parse_args()
+
+    if args.size:
+        scenarios = [dict(size=s, walls=w, turrets=t, cooldown=tuple(args.cooldown), bullets=b, power_ups=p)
+                     for s, w, t, b, p in itertools.product(args.size, args.walls, args.turrets,
+                                                            args.bullets, args.power_ups)]
+    else:
+        scenarios = DEFAULT_SCENARIOS
+
+    results = []
+    print('{:>5} {:>5} {:>7} {:>7} {:>9} {:>8} {:>8} {:>8}  slowest phase (p99)'.format(
+        'size', 'walls', 'turrets', 'bullets', 'first ms', 'p50 ms', 'p99 ms', 'max ms'))
+    for scenario in scenarios:
+        r = run_scenario(scenario, args.turns, args.seed)
+        results.append(r)
+        slowest = max(PHASES, key=lambda name: r['phases'][name]['p99'])
+        print('{:>5} {:>5} {:>7} {:>7} {:>9.2f} {:>8.2f} {:>8.2f} {:>8.2f}  {} {:.2f}'.format(
+            r['size'], r['walls'], r['turrets'], r['bullets'], r['first_turn_ms'],
+            r['total']['p50'], r['total']['p99'], r['total']['max'],
+            slowest, r['phases'][slowest]['p99']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.limit_ms is not None:
+        over = [r for r in results if r['total']['max'] > args.limit_ms]
+        if over:
+            print('{} scenario(s) over {} ms'.format(len(over), args.limit_ms), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
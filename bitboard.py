@@ -0,0 +1,102 @@
+'''
+Big-int bitboards.  A set of squares is one Python int with bit
+x*h + y set for each square (the same flattening as grid.py and
+distances.py), so questions over the whole map are a few bitwise ops on
+ints instead of loops over squares: moving every bullet of a direction
+is one shift, and fire from all turrets at once is one ray cast.
+
+Shifts wrap around the map like everything else: along x a square is h
+bits away and the board rotates, along y only the edge row needs moving
+back to the other side.
+'''
+import numpy as np
+from distances import D_DX, D_DY
+
+RAY_RANGE = 4 # turret fire and laser range
+
+
+class BitBoards:
+    ''' Per-map masks and shift helpers.  Walls never change, so build once. '''
+
+    def __init__(self, grid):
+        ''' grid is the map's Grid, its walls include turrets. '''
+        self.w = grid.w
+        self.h = grid.h
+        self.n = grid.n
+        self.full = (1 << self.n) - 1
+        self.walls = self.from_bytes(grid.walls)
+        self.open = self.full & ~self.walls
+        column = 1 << (self.h - 1)
+        self.top = 0 # y == 0 squares
+        for x in range(self.w):
+            self.top |= 1 << (x * self.h)
+        self.bottom = self.top * column # y == h-1 squares
+
+    def from_bytes(self, flags):
+        ''' Mask of the cells with a non-zero byte in a flat bytearray. '''
+        bits = np.packbits(np.frombuffer(bytes(flags), dtype=np.uint8) != 0, bitorder='little')
+        return int.from_bytes(bits.tobytes(), 'little')
+
+    def mask(self, squares):
+        m = 0
+        for (x, y) in squares:
+            m |= 1 << (x * self.h + y)
+        return m
+
+    def has(self, mask, x, y):
+        return bool(mask >> (x * self.h + y) & 1)
+
+    def squares(self, mask):
+        ''' The (x, y) squares in mask, in cell order. '''
+        out = []
+        while mask:
+            low = mask & -mask
+            out.append(divmod(low.bit_length() - 1, self.h))
+            mask ^= low
+        return out
+
+    def shift(self, mask, f, k=1):
+        ''' Every square of mask moved k squares in facing f, wrapping around the map. '''
+        n = self.n
+        h = self.h
+        for i in range(k):
+            if D_DX[f] == 1:
+                mask = ((mask << h) | (mask >> (n - h))) & self.full
+            elif D_DX[f] == -1:
+                mask = (mask >> h) | ((mask << (n - h)) & self.full)
+            elif D_DY[f] == 1:
+                mask = ((mask & ~self.bottom) << 1) | ((mask & self.bottom) >> (h - 1))
+            else:
+                mask = ((mask & ~self.top) >> 1) | ((mask & self.top) << (h - 1))
+        return mask
+
+    def advance(self, mask, f):
+        ''' Bullets in mask travelling in facing f one turn later; the ones flying into a wall or turret are gone. '''
+        return self.shift(mask, f) & self.open
+
+    def rays(self, sources, k=RAY_RANGE):
+        ''' Squares within k steps of any source in a straight line, stopping at the first wall (fire zones). '''
+        zone = 0
+        for f in range(4):
+            ray = sources
+            for i in range(k):
+                ray = self.advance(ray, f)
+                if not ray:
+                    break
+                zone |= ray
+        return zone
+
+    def bullets(self, snapshot):
+        ''' One mask per facing of the squares with a bullet travelling that way. '''
+        masks = [0, 0, 0, 0]
+        cells = (snapshot.bullet_x * self.h + snapshot.bullet_y).tolist()
+        for f, c in zip(snapshot.bullet_f.tolist(), cells):
+            masks[f] |= 1 << c
+        return masks
+
+    def arriving(self, bullet_masks, k=1):
+        ''' Squares that a bullet is heading straight at from exactly k squares away (walls not considered). '''
+        m = 0
+        for f in range(4):
+            m |= self.shift(bullet_masks[f], f, k)
+        return m
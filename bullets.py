@@ -0,0 +1,39 @@
+'''
+Per-turn snapshot of the bullets in flight, one channel per travel direction.
+'''
+import numpy as np
+import instrument
+from distances import D_INDEX
+
+NO_BULLET = np.iinfo(np.int32).max
+
+
+class BulletGrid:
+    '''
+    first[f, x, y] is the index in gameboard.bullets of the first bullet at
+    (x,y) travelling in DIRECTIONS[f], or NO_BULLET.  Keeping the index
+    rather than a flag lets callers that used to scan the bullet list in
+    order still pick the same bullet.
+    '''
+
+    def __init__(self, w, h, snapshot):
+        ''' Built from the turn's Snapshot, indices are into snapshot.bullets. '''
+        self.w = w
+        self.h = h
+        self.bullets = snapshot.bullets
+        self.first = np.full((4, w, h), NO_BULLET, dtype=np.int32)
+        np.minimum.at(self.first, (snapshot.bullet_f, snapshot.bullet_x, snapshot.bullet_y),
+                      np.arange(len(self.bullets), dtype=np.int32))
+
+    def at(self, x, y, direction):
+        ''' First bullet at (x,y) travelling in direction, or None. '''
+        if instrument.ENABLED:
+            instrument.count('bullet_lookups')
+        i = self.first[D_INDEX[direction], x, y]
+        return None if i == NO_BULLET else self.bullets[i]
+
+    def index_at(self, x, y, direction):
+        ''' Like at, but the bullet's index (NO_BULLET if none) so results can be ordered. '''
+        if instrument.ENABLED:
+            instrument.count('bullet_lookups')
+        return int(self.first[D_INDEX[direction], x, y])
@@ -0,0 +1,134 @@
+'''
+Turret fire known ahead of time.  Turrets never move and fire on a fixed
+[fire_time, cooldown_time] cycle, so which squares are under fire at turn t
+is periodic and can be looked up instead of re-derived from the turrets.
+'''
+from math import gcd
+import numpy as np
+from distances import DIRECTIONS, D_DX, D_DY
+
+TURRET_RANGE = 4
+# dense per-phase grids are only kept while they fit in this many bytes
+SCHEDULE_MEMORY_BUDGET = 16 * 2**20
+
+
+def fire_mask(w, h, wall_ray, tx, ty, fire_range=TURRET_RANGE):
+    ''' (w,h) bool array of the squares fire from (tx,ty) reaches. '''
+    mask = np.zeros((w, h), dtype=bool)
+    for f, d in enumerate(DIRECTIONS):
+        for k in range(1, min(fire_range + 1, wall_ray[d][tx][ty])):
+            mask[(tx + k * D_DX[f]) % w, (ty + k * D_DY[f]) % h] = True
+    return mask
+
+
+class DangerSchedule:
+    '''
+    Squares under turret fire at any turn.  A turret with period
+    fire_time + cooldown_time fires while (turn - offset) % period < fire_time;
+    offset starts at 0 and is corrected by sync if the server disagrees.
+
+    When the turrets' common period (the LCM) is small enough, counts[phase]
+    holds how many turrets hit each square at that phase, so a lookup is a
+    single index and a dead turret is subtracted out of the phases it fired
+    in.  Otherwise only the per-turret masks are kept and combined on demand.
+    '''
+
+    def __init__(self, w, h, wall_ray, turrets, budget=SCHEDULE_MEMORY_BUDGET):
+        self.w = w
+        self.h = h
+        self.masks = {}
+        self.timing = {} # (x,y):[period, fire_time, offset]
+        self.period = 1
+        for t in turrets:
+            if t.is_dead:
+                continue
+            self.masks[(t.x, t.y)] = fire_mask(w, h, wall_ray, t.x, t.y)
+            period = t.fire_time + t.cooldown_time
+            self.timing[(t.x, t.y)] = [period, t.fire_time, 0]
+            self.period = self.period * period // gcd(self.period, period)
+
+        self.counts = None
+        if self.period * w * h <= budget:
+            self.counts = np.zeros((self.period, w, h), dtype=np.uint8)
+            for key in self.masks:
+                self._add(key, 1)
+
+    def firing(self, key, turn):
+        period, fire_time, offset = self.timing[key]
+        return (turn - offset) % period < fire_time
+
+    def _add(self, key, sign):
+        period, fire_time, offset = self.timing[key]
+        mask = self.masks[key]
+        # the phases it fires in are fire_time strided slices, period divides self.period
+        for k in range(fire_time):
+            phases = self.counts[(offset + k) % period::period]
+            if sign > 0:
+                phases += mask
+            else:
+                phases -= mask
+
+    def remove(self, turret):
+        ''' Turret died, it won't fire again. '''
+        key = (turret.x, turret.y)
+        if key not in self.masks:
+            return
+        if self.counts is not None:
+            self._add(key, -1)
+        del self.masks[key]
+        del self.timing[key]
+
+    def sync(self, snapshot):
+        '''
+        Check the schedule against the server's is_firing_next_turn (from
+        the turn's Snapshot) and shift a turret's phase when they disagree.
+        Returns True if anything moved.
+        '''
+        turn = snapshot.turn
+        moved = False
+        for key, firing_next in zip(zip(snapshot.turret_x.tolist(), snapshot.turret_y.tolist()),
+                                    snapshot.turret_firing_next.tolist()):
+            if key not in self.timing or firing_next == self.firing(key, turn + 1):
+                continue
+            period, fire_time, offset = self.timing[key]
+            if firing_next:
+                # assume it just started its firing stretch
+                self.shift(key, (turn + 1) % period)
+            else:
+                # assume it just finished firing
+                self.shift(key, (turn + 1 - fire_time) % period)
+            moved = True
+        return moved
+
+    def shift(self, key, offset):
+        ''' Set the turret at key (x,y) to start firing on turns offset mod its period. '''
+        if self.counts is not None:
+            self._add(key, -1)
+        self.timing[key][2] = offset
+        if self.counts is not None:
+            self._add(key, 1)
+
+    def hit_grid(self, turn, exclude=()):
+        ''' (w,h) bool array of the squares under fire on the given turn, from turrets other than exclude. '''
+        if self.counts is not None and not exclude:
+            return self.counts[turn % self.period] > 0
+        grid = np.zeros((self.w, self.h), dtype=bool)
+        for key, mask in self.masks.items():
+            if key not in exclude and self.firing(key, turn):
+                grid |= mask
+        return grid
+
+    def hit_grids(self, turns, exclude=()):
+        ''' (len(turns),w,h) bool array, hit_grid for each of the given turns. '''
+        turns = np.asarray(turns)
+        if self.counts is None:
+            return np.array([self.hit_grid(t, exclude) for t in turns.tolist()],
+                            dtype=bool).reshape(len(turns), self.w, self.h)
+        counts = self.counts[turns % self.period]
+        exclude = [key for key in exclude if key in self.masks]
+        if exclude:
+            counts = counts.astype(np.int32)
+            for key in exclude:
+                firing = np.array([self.firing(key, t) for t in turns.tolist()])
+                counts -= firing[:, None, None] * self.masks[key]
+        return counts > 0
@@ -0,0 +1,392 @@
+'''
+Orientation-aware turn distances, backed by NumPy.
+
+The search runs over (x, y, facing) states rather than over cells:
+moving forward costs 1 turn and keeps the facing, turning in place
+costs 1 turn and keeps the cell.  Moving towards a square you are not
+facing therefore costs 2 turns, which is exactly the rule the old
+recursive propagation encoded with its lists of arrival directions.
+
+States are flattened as s = facing*n + cell with cell = x*h + y, so
+that a (w*h) slice reshapes straight into a [x, y] indexed grid.
+'''
+import time
+import numpy as np
+import instrument
+from PythonClientAPI.libs.Game.Enums import *
+
+# facings as small ints so they can index arrays (clockwise from UP)
+DIRECTIONS = (Direction.UP, Direction.RIGHT, Direction.DOWN, Direction.LEFT)
+D_INDEX = {d: i for i, d in enumerate(DIRECTIONS)}
+D_DX = (0, 1, 0, -1)
+D_DY = (-1, 0, 1, 0)
+
+UNREACHABLE = 9001
+
+
+class DistanceEngine:
+    ''' Per-map tables for turn-distance searches.  Walls never change, so build once. '''
+
+    def __init__(self, walls):
+        ''' walls is a (w, h) bool array that also marks turret squares. '''
+        self.walls = np.asarray(walls, dtype=bool)
+        self.w, self.h = self.walls.shape
+        self.n = self.w * self.h
+        self.open = ~self.walls.ravel()
+
+        # fwd[s] is the state reached by moving forward from s, -1 if walled off
+        cells = np.arange(self.n).reshape(self.w, self.h)
+        self.fwd = np.empty(4 * self.n, dtype=np.int64)
+        for f in range(4):
+            # roll by the opposite step so that target[x, y] holds the cell at (x+dx, y+dy)
+            target = np.roll(cells, (-D_DX[f], -D_DY[f]), axis=(0, 1)).ravel()
+            target = np.where(self.open[target], target + f * self.n, -1)
+            self.fwd[f * self.n:(f + 1) * self.n] = target
+        self.facing_offsets = np.arange(4, dtype=np.int64)[:, None] * self.n
+
+    def state(self, x, y, direction):
+        return D_INDEX[direction] * self.n + x * self.h + y
+
+    def search(self, x, y, direction, max_dist=None, deadline=None):
+        '''
+        Breadth first search from the state (x, y, direction).  Every edge
+        costs one turn so each frontier is one distance level, expanded with
+        a couple of array gathers instead of per-square Python objects.
+        States further than max_dist are left UNREACHABLE, and so are the
+        levels not reached by deadline (a time.perf_counter() value), in
+        which case the field's timed_out flag is set.
+        '''
+        field = self.start(x, y, direction, deadline)
+        field.expand(max_dist)
+        return field
+
+    def start(self, x, y, direction, deadline=None):
+        '''
+        A DistanceField that has only settled the start state.  It searches
+        further on demand, level by level, as squares are asked about.
+        '''
+        return DistanceField(self, self.state(x, y, direction), deadline)
+
+
+class DistanceField:
+    '''
+    One search, expanded lazily.
+    dist[x, y]      turns to reach (x, y) in any orientation
+    arrive[x, y]    bitmask of facings (1 << D_INDEX[d]) that reach (x, y) in dist turns,
+                    i.e. the directions of the last move along some shortest path
+    level           distance settled so far, squares further out are still UNREACHABLE
+    complete        True once there is nothing left to expand
+    timed_out       True if the deadline stopped the search
+
+    dist and arrive are updated in place, so references to them stay valid
+    as the search goes on.  distance, route and nearest expand just far
+    enough to answer exactly.
+    '''
+
+    def __init__(self, engine, start, deadline=None):
+        self.engine = engine
+        self.start = start
+        self.deadline = deadline
+        self.state_dist = np.full(4 * engine.n, UNREACHABLE, dtype=np.int32)
+        self.state_dist[start] = 0
+        self.frontier = np.array([start], dtype=np.int64)
+        self.level = 0
+        self.complete = False
+        self.timed_out = False
+        self.dist = np.full((engine.w, engine.h), UNREACHABLE, dtype=np.int32)
+        self.arrive = np.zeros((engine.w, engine.h), dtype=np.uint8)
+        self._refresh()
+
+    def _step(self):
+        ''' Settle one more level, returns False if there was nothing left or no time. '''
+        if self.complete or self.timed_out:
+            return False
+        if not self.frontier.size:
+            self.complete = True
+            return False
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.timed_out = True
+            return False
+        engine = self.engine
+        state_dist = self.state_dist
+        frontier = self.frontier
+        self.level += 1
+        moved = engine.fwd[frontier]
+        moved = moved[moved >= 0]
+        turned = (frontier % engine.n + engine.facing_offsets).ravel()
+        cand = np.concatenate((moved, turned))
+        cand = np.unique(cand[state_dist[cand] == UNREACHABLE])
+        state_dist[cand] = self.level
+        self.frontier = cand
+        if instrument.ENABLED:
+            instrument.count('search_levels')
+            instrument.count('frontier_states', cand.size)
+        return True
+
+    def _refresh(self):
+        by_facing = self.state_dist.reshape(4, self.engine.w, self.engine.h)
+        by_facing.min(axis=0, out=self.dist)
+        self.arrive[...] = 0
+        for f in range(4):
+            self.arrive |= ((by_facing[f] == self.dist) << f).astype(np.uint8)
+        self.arrive[self.dist == UNREACHABLE] = 0
+
+    def expand(self, max_dist=None):
+        ''' Search on to max_dist (everything by default). '''
+        while (max_dist is None or self.level < max_dist) and self._step():
+            pass
+        self._refresh()
+
+    def _cell_states(self, squares):
+        ''' (len(squares), 4) array of the states on the given squares. '''
+        engine = self.engine
+        cells = np.array([x * engine.h + y for (x, y) in squares], dtype=np.int64)
+        return cells[:, None] + engine.facing_offsets.ravel()[None, :]
+
+    def distance(self, x, y):
+        ''' Turns to (x, y), searching as far as needed. '''
+        states = self._cell_states([(x, y)])[0]
+        while self.state_dist[states].min() == UNREACHABLE and self._step():
+            pass
+        self._refresh()
+        return int(self.dist[x, y])
+
+    def nearest(self, groups):
+        '''
+        groups is a list of (squares, offset).  Searches until the square
+        with the smallest distance + offset is settled (ties go to the
+        earlier group, then the earlier square) and returns (group index,
+        square, distance), or None if none of them can be reached.
+
+        Squares in the other groups are only settled as far as needed to
+        rule them out, so their dist may still read UNREACHABLE.
+        '''
+        groups = [(list(squares), offset) for (squares, offset) in groups if len(squares)]
+        if not groups:
+            return None
+        states = [self._cell_states(squares) for (squares, offset) in groups]
+        while True:
+            best = None
+            for g, (squares, offset) in enumerate(groups):
+                d = self.state_dist[states[g]].min(axis=1)
+                i = int(np.argmin(d))
+                if d[i] != UNREACHABLE and (best is None or (int(d[i]) + offset, g) < best[0]):
+                    best = ((int(d[i]) + offset, g), g, squares[i], int(d[i]))
+            # anything not settled yet is at least level+1 away
+            if best is not None and all(best[0] < (self.level + 1 + offset, g)
+                                        for g, (squares, offset) in enumerate(groups)):
+                break
+            if not self._step():
+                break
+        self._refresh()
+        if best is None:
+            return None
+        return best[1:]
+
+    def route(self, x, y):
+        '''
+        The states (x, y, Direction) a shortest path to (x, y) goes through,
+        one per turn, ending on (x, y).  Empty if (x, y) is the start square
+        or unreachable.
+        '''
+        self.distance(x, y)
+        engine = self.engine
+        n = engine.n
+        h = engine.h
+        d = int(self.dist[x, y])
+        if d == 0 or d == UNREACHABLE:
+            return []
+        sd = self.state_dist
+        cell = x * h + y
+        mask = int(self.arrive[x, y])
+        f = (mask & -mask).bit_length() - 1
+        states = []
+        # walk back one state at a time, either undoing a forward step or a turn
+        while d > 0:
+            states.append((cell, f))
+            cx, cy = divmod(cell, h)
+            prev = ((cx - D_DX[f]) % engine.w) * h + (cy - D_DY[f]) % engine.h
+            if sd[f * n + prev] == d - 1:
+                cell = prev
+            else:
+                for f1 in range(4):
+                    if f1 != f and sd[f1 * n + cell] == d - 1:
+                        f = f1
+                        break
+            d -= 1
+        return [divmod(c, h) + (DIRECTIONS[f],) for (c, f) in reversed(states)]
+
+
+# all-pairs tables are stored as uint8, FAR marks squares 255+ turns away (or unreachable)
+FAR = 255
+TABLE_MEMORY_BUDGET = 64 * 2**20
+# sources are searched a block at a time, each block's frontier bits taking about this many bytes
+TABLE_BLOCK_BYTES = 2**20
+# bytes of working arrays per map square and byte column of a block (frontier, visited, bit planes,
+# per-level temporaries and the unpacked rows), measured with tracemalloc
+TABLE_BLOCK_OVERHEAD = 40
+# build time per source state and square, measured from 26 ns on 20x20 maps to 50 ns on 60x60
+# (more levels to search on wider maps), the top end so estimates err long
+TABLE_BUILD_NS = 50
+
+
+def table_block(n):
+    ''' Byte columns (8 sources each) searched at once for a map with n squares. '''
+    return max(1, min((4 * n + 7) // 8, TABLE_BLOCK_BYTES // (4 * n + 1)))
+
+
+def table_memory(n):
+    ''' Peak bytes used to build and hold the all-pairs table of a map with n squares. '''
+    return 4 * n * n + TABLE_BLOCK_OVERHEAD * n * table_block(n) + 32 * n
+
+
+def table_build_time(n):
+    ''' Rough seconds to build the all-pairs table of a map with n squares. '''
+    return 4 * n * n * TABLE_BUILD_NS * 1e-9
+
+
+def build_distance_table(engine, budget=TABLE_MEMORY_BUDGET, max_seconds=None):
+    '''
+    All-pairs turn distances from every (x, y, facing) state to every
+    square, or None when the map is too large for the memory budget or
+    would take longer than max_seconds to build (callers then fall back
+    to a per-turn search).
+
+    Sources are searched a block of table_block(n)*8 states at a time,
+    each block written straight into its rows of the table, so the peak
+    is the table plus one block's working arrays (see table_memory).
+    '''
+    n = engine.n
+    if table_memory(n) > budget or (max_seconds is not None and table_build_time(n) > max_seconds):
+        return None
+    s_num = 4 * n
+
+    # pred[t] is the state that moves forward into t, or the all-zero padding row
+    pred = np.full(s_num, s_num, dtype=np.int64)
+    movable = np.nonzero(engine.fwd >= 0)[0]
+    pred[engine.fwd[movable]] = movable
+
+    table = np.empty((s_num, n), dtype=np.uint8)
+    step = 8 * table_block(n)
+    for s0 in range(0, s_num, step):
+        if not _search_block(engine, pred, table, s0, min(s_num, s0 + step)):
+            return None
+    return DistanceTable(engine, table)
+
+
+def _search_block(engine, pred, table, s0, s1):
+    '''
+    Fills table[s0:s1] with one breadth first search from all those
+    states at once: the frontier of each source is a bit column packed 8
+    sources per byte, so each level is a handful of bitwise ops over
+    (states x sources/8) bytes.  Distances are accumulated one bit plane
+    at a time and only unpacked at the end.  False if some square is FAR
+    or more turns away.
+    '''
+    n = engine.n
+    s_num = 4 * n
+    b_num = (s1 - s0 + 7) // 8
+
+    sources = np.arange(s0, s1)
+    sources = sources[engine.open[sources % n]]
+    frontier = np.zeros((s_num + 1, b_num), dtype=np.uint8)
+    frontier[sources, (sources - s0) // 8] = (128 >> ((sources - s0) % 8)).astype(np.uint8)
+    visited = frontier[:s_num].copy()
+    by_facing = visited.reshape(4, n, b_num)
+    # facings of a cell can share a byte column on maps under 8 squares, so or rather than max
+    cell_seen = by_facing[0] | by_facing[1] | by_facing[2] | by_facing[3]
+    planes = np.zeros((8, n, b_num), dtype=np.uint8)
+
+    distance = 0
+    while frontier.any():
+        distance += 1
+        if distance == FAR:
+            return False
+        by_facing = frontier[:s_num].reshape(4, n, b_num)
+        turned = by_facing[0] | by_facing[1] | by_facing[2] | by_facing[3]
+        new = frontier[pred].reshape(4, n, b_num)
+        new |= turned
+        new &= ~visited.reshape(4, n, b_num)
+        new = new.reshape(s_num, b_num)
+        visited |= new
+        frontier[:s_num] = new
+
+        by_facing = new.reshape(4, n, b_num)
+        cell_new = (by_facing[0] | by_facing[1] | by_facing[2] | by_facing[3]) & ~cell_seen
+        cell_seen |= cell_new
+        for bit in range(8):
+            if distance >> bit & 1:
+                planes[bit] |= cell_new
+    del frontier, visited
+
+    # anything never reached is FAR
+    planes |= ~cell_seen
+    rows = np.zeros((n, 8 * b_num), dtype=np.uint8)
+    for bit in range(8):
+        rows |= np.unpackbits(planes[bit], axis=1) << bit
+    table[s0:s1] = rows[:, :s1 - s0].T
+    return True
+
+
+class DistanceTable:
+    '''
+    Precomputed turn distances from every (x, y, facing) state to every
+    square: table[state, cell], FAR for 255+ turns or unreachable.
+    Lookups are O(1), and a whole row is the distance field of one state.
+    '''
+
+    def __init__(self, engine, table):
+        self.engine = engine
+        self.table = table
+
+    def distance(self, x, y, direction, tx, ty):
+        ''' Turns for something at (x, y) facing direction to reach (tx, ty). '''
+        d = int(self.table[self.engine.state(x, y, direction), tx * self.engine.h + ty])
+        return UNREACHABLE if d == FAR else d
+
+    def state_distance(self, s, cell):
+        ''' Turns from state s (see DistanceEngine.state) to the square with index cell. '''
+        d = int(self.table[s, cell])
+        return UNREACHABLE if d == FAR else d
+
+    def dist_from(self, x, y, direction):
+        ''' The (w,h) distance grid of one state, with the same values as DistanceField.dist. '''
+        row = self.table[self.engine.state(x, y, direction)].astype(np.int32)
+        row[row == FAR] = UNREACHABLE
+        return row.reshape(self.engine.w, self.engine.h)
+
+    def first_direction(self, x, y, direction, tx, ty):
+        '''
+        Direction of the first square to move into along a shortest path
+        from state (x, y, direction) to (tx, ty), or None if already there
+        or unreachable.
+        '''
+        engine = self.engine
+        target = tx * engine.h + ty
+        s = engine.state(x, y, direction)
+        d = int(self.table[s, target])
+        if d == 0 or d == FAR:
+            return None
+        moved = engine.fwd[s]
+        if moved >= 0 and self.table[moved, target] == d - 1:
+            return direction
+        # otherwise turn first, and never twice in a row on a shortest path
+        cell = s % engine.n
+        for f in range(4):
+            if self.table[f * engine.n + cell, target] == d - 1:
+                return DIRECTIONS[f]
+        return None
+
+    def route(self, x, y, direction, tx, ty):
+        ''' Like DistanceField.route, the states along a shortest path from (x, y, direction) to (tx, ty). '''
+        states = []
+        d = self.first_direction(x, y, direction, tx, ty)
+        while d is not None:
+            if d == direction:
+                f = D_INDEX[d]
+                x = (x + D_DX[f]) % self.engine.w
+                y = (y + D_DY[f]) % self.engine.h
+            direction = d
+            states.append((x, y, direction))
+            d = self.first_direction(x, y, direction, tx, ty)
+        return states
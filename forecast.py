@@ -0,0 +1,107 @@
+'''
+Danger over the next few turns: where bullets in flight will be, which
+squares turret fire covers and the two together as one "unsafe" cube,
+all (T,w,h) arrays indexed by turns from now.  Move vetting, the slay
+checks and the space-time search all read the same cube.
+'''
+import numpy as np
+from distances import DIRECTIONS, D_DX, D_DY
+from bullets import NO_BULLET
+
+FORECAST_HORIZON = 6
+BULLET_SPEED = 1 # squares per turn
+
+
+class Forecaster:
+    ''' Per-map part of the forecast; call forecast every turn. '''
+
+    def __init__(self, w, h, wall_ray, danger):
+        self.w = w
+        self.h = h
+        self.danger = danger
+        # ray[f, x, y] as an array so all bullets can be looked up at once
+        self.ray = np.array([wall_ray[d] for d in DIRECTIONS], dtype=np.int32)
+        # a ray the length of the line means no wall in the way at all (bullets are
+        # never on a wall), so those bullets loop around forever
+        size = np.array([h, w, h, w])[:, None, None]
+        self.ray[self.ray == size] = np.iinfo(np.int32).max
+        self.dx = np.array(D_DX)
+        self.dy = np.array(D_DY)
+
+    def forecast(self, turn, bullet_grid, horizon=FORECAST_HORIZON):
+        f, x, y = np.nonzero(bullet_grid.first != NO_BULLET)
+        return Forecast(turn, self.flights(f, x, y, horizon), self.danger, self.doomed(f, x, y))
+
+    def doomed(self, f, x, y):
+        ''' (x,y) of the turrets that one of the bullets is one square away from and heading straight at. '''
+        hit = self.ray[f, x, y] == 1
+        if not hit.any():
+            return set()
+        return set(zip(((x[hit] + self.dx[f[hit]]) % self.w).tolist(),
+                       ((y[hit] + self.dy[f[hit]]) % self.h).tolist())) & self.danger.masks.keys()
+
+    def flights(self, f, x, y, horizon):
+        '''
+        (horizon, w, h) bool array of where bullet i, travelling in facing
+        f[i] from (x[i], y[i]), is on each turn.  Bullets wrap around the
+        map and stop at the first wall or turret, found from the wall rays
+        rather than stepped through, so every bullet and turn is placed in
+        one scatter.
+        '''
+        t = np.arange(horizon)
+        steps = t[None, :] * BULLET_SPEED
+        # a bullet is still flying while it hasn't reached the first wall in its way
+        alive = steps < self.ray[f, x, y][:, None]
+        xs = (x[:, None] + steps * self.dx[f][:, None]) % self.w
+        ys = (y[:, None] + steps * self.dy[f][:, None]) % self.h
+        ts = np.broadcast_to(t, alive.shape)
+        out = np.zeros((horizon, self.w, self.h), dtype=bool)
+        out[ts[alive], xs[alive], ys[alive]] = True
+        return out
+
+
+class Forecast:
+    '''
+    bullets[t, x, y]    a bullet is on (x,y) t turns from now
+    fire[t, x, y]       turret fire covers (x,y) t turns from now
+    unsafe[t, x, y]     either of the above
+
+    t = 0 is the current turn, see Forecaster.flights.  Turret fire comes
+    from the DangerSchedule, less the doomed turrets (a bullet destroys
+    them before they fire again) from t = 1 on.
+    '''
+
+    def __init__(self, turn, bullets, danger, doomed=()):
+        self.turn = turn
+        self.horizon = len(bullets)
+        self.bullets = bullets
+        self.danger = danger
+        self.doomed = set(doomed)
+        turns = turn + np.arange(self.horizon)
+        self.fire = danger.hit_grids(turns)
+        if self.doomed:
+            self.fire[1:] = danger.hit_grids(turns[1:], self.doomed)
+        self.unsafe = bullets | self.fire
+        self.quiet = not bullets.any() # no bullets, so fire is just the DangerSchedule
+
+    def unsafe_hits(self, squares, turns, exclude=()):
+        '''
+        Whether a bullet or turret fire is on any of the squares on any of
+        the turns (counted from now), not counting fire from the turrets at
+        the (x,y) in exclude.
+        '''
+        turns = [t for t in turns if t < self.horizon]
+        if not turns:
+            return False
+        xs, ys = zip(*squares)
+        # turns x squares, pairing each x with its own y
+        at = (np.array(turns)[:, None], np.array(xs), np.array(ys))
+        if not self.unsafe[at].any():
+            return False
+        if not exclude or self.bullets[at].any():
+            return True
+        # the cube can't take a turret back out, so only then look at the rest of the turrets
+        exclude = set(exclude)
+        fire = np.array([self.danger.hit_grid(self.turn + t, exclude | self.doomed if t else exclude)
+                         for t in turns])
+        return bool(fire[(np.arange(len(turns))[:, None],) + at[1:]].any())
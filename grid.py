@@ -0,0 +1,46 @@
+'''
+Flat map core.  Squares are single ints, cell = x*h + y (the same
+flattening as distances.py), walls are a bytearray indexed by cell, and
+the wrap-around is done once when the map is built: step[k][f][cell] is
+the cell k squares away from cell in facing f, so walking the torus is
+one index per step instead of comparing Directions and taking a modulo.
+'''
+from array import array
+import numpy as np
+from distances import D_DX, D_DY
+
+MAX_STEP = 4 # neighbour tables go this far out (turret, laser and bullet danger range)
+
+
+def opposite(f):
+    ''' The facing index pointing the other way (UP<->DOWN, LEFT<->RIGHT). '''
+    return f ^ 2
+
+
+class Grid:
+    ''' Walls and neighbour tables for one map.  Walls never change, so build once. '''
+
+    def __init__(self, w, h, blocked):
+        ''' blocked is an iterable of the (x, y) squares with a wall or a turret. '''
+        self.w = w
+        self.h = h
+        self.n = w * h
+        self.walls = bytearray(self.n)
+        for (x, y) in blocked:
+            self.walls[x * h + y] = 1
+        self.xy = [(x, y) for x in range(w) for y in range(h)]
+        cells = np.arange(self.n, dtype=np.int32).reshape(w, h)
+        self.step = [None]
+        for k in range(1, MAX_STEP + 1):
+            # rolled back by the step, so [x, y] holds the cell k squares on
+            self.step.append([array('i', np.roll(cells, (-k * D_DX[f], -k * D_DY[f]), axis=(0, 1)).tobytes())
+                              for f in range(4)])
+
+    def cell(self, x, y):
+        return x * self.h + y
+
+    def next_pos(self, x, y, f, k=1):
+        ''' (x, y) of the square k squares from (x, y) in facing f. '''
+        if k <= MAX_STEP:
+            return self.xy[self.step[k][f][x * self.h + y]]
+        return ((x + k * D_DX[f]) % self.w, (y + k * D_DY[f]) % self.h)
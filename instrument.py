@@ -0,0 +1,191 @@
+'''
+Per-turn timing spans and hot-path counters for get_move.
+
+Off by default; enable() or TURRETSLAYER_INSTRUMENT=1 in the environment
+turns it on.  While off, span() hands back one shared no-op context manager
+and hot paths guard their count() calls with `if instrument.ENABLED`, so the
+cost is an attribute lookup.
+
+While on, every turn's span durations (monotonic clock) and counter totals
+go into fixed-size ring buffers, turns over DEADLINE_MS are remembered with
+their breakdown, and a summary is printed to stderr at exit (or call dump).
+'''
+import atexit
+import os
+import sys
+import time
+from array import array
+
+RING_SIZE = 1024 # turns of history kept per span / counter
+SLOW_TURNS = 32 # slow turns kept with their full breakdown
+DEADLINE_MS = float(os.environ.get('TURRETSLAYER_DEADLINE_MS', 200))
+
+ENABLED = False
+DEBUG = False
+
+_clock = time.perf_counter
+
+
+class Ring:
+    ''' Fixed-size ring buffer of floats. '''
+
+    def __init__(self, size=RING_SIZE):
+        self.values = array('d', bytes(8 * size))
+        self.size = size
+        self.n = 0 # total ever added
+
+    def add(self, value):
+        self.values[self.n % self.size] = value
+        self.n += 1
+
+    def recent(self):
+        return sorted(self.values[:min(self.n, self.size)])
+
+    def summary(self):
+        v = self.recent()
+        if not v:
+            return dict(n=0)
+        return dict(n=self.n, mean=sum(v) / len(v),
+                    p50=v[(len(v) - 1) // 2], p99=v[min(len(v) - 1, int(0.99 * len(v)))], max=v[-1])
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = _clock()
+        return self
+
+    def __exit__(self, *exc):
+        _turn_spans[self.name] = _turn_spans.get(self.name, 0.0) + _clock() - self.start
+        return False
+
+
+_spans = {} # name:Ring of per-turn milliseconds
+_counters = {} # name:Ring of per-turn totals
+_turn_spans = {}
+_turn_counts = {}
+_turn = None
+_turn_start = None
+_slow = [] # (turn, total ms, {span: ms}, {counter: n})
+_worst = None
+
+
+def enable(debug=False):
+    ''' Start collecting (and with debug, print print_debug output too). '''
+    global ENABLED, DEBUG
+    if not ENABLED:
+        atexit.register(dump)
+    ENABLED = True
+    DEBUG = debug
+
+
+def disable():
+    global ENABLED, DEBUG
+    ENABLED = False
+    DEBUG = False
+
+
+def reset():
+    global _turn, _turn_start, _worst
+    _spans.clear()
+    _counters.clear()
+    _turn_spans.clear()
+    _turn_counts.clear()
+    del _slow[:]
+    _turn = None
+    _turn_start = None
+    _worst = None
+
+
+def debug(*arg):
+    if DEBUG:
+        print(*arg, file=sys.stderr)
+
+
+def span(name):
+    ''' with instrument.span('distances'): ... times the block as part of this turn. '''
+    if not ENABLED:
+        return _NO_SPAN
+    return _Span(name)
+
+
+def count(name, n=1):
+    _turn_counts[name] = _turn_counts.get(name, 0) + n
+
+
+def start_turn(turn):
+    global _turn, _turn_start
+    if not ENABLED:
+        return
+    _turn = turn
+    _turn_start = _clock()
+    _turn_spans.clear()
+    _turn_counts.clear()
+
+
+def end_turn():
+    ''' Fold this turn's spans and counters into the histograms. '''
+    global _worst
+    if not ENABLED or _turn_start is None:
+        return
+    total = 1000 * (_clock() - _turn_start)
+    _spans.setdefault('turn', Ring()).add(total)
+    for name, spent in _turn_spans.items():
+        _spans.setdefault(name, Ring()).add(1000 * spent)
+    for name, n in _turn_counts.items():
+        _counters.setdefault(name, Ring()).add(n)
+
+    record = (_turn, total, {k: 1000 * v for k, v in _turn_spans.items()}, dict(_turn_counts))
+    if _worst is None or total > _worst[1]:
+        _worst = record
+    if total > DEADLINE_MS:
+        _slow.append(record)
+        if len(_slow) > SLOW_TURNS:
+            del _slow[0]
+
+
+def summary():
+    return dict(spans={k: r.summary() for k, r in _spans.items()},
+                counters={k: r.summary() for k, r in _counters.items()},
+                deadline_ms=DEADLINE_MS,
+                slow_turns=[dict(turn=t, ms=ms, spans=s, counters=c) for (t, ms, s, c) in _slow],
+                worst_turn=None if _worst is None else dict(turn=_worst[0], ms=_worst[1],
+                                                            spans=_worst[2], counters=_worst[3]))
+
+
+def dump(file=None):
+    ''' Print the summary (to stderr by default). '''
+    file = file or sys.stderr
+    s = summary()
+    if not s['spans']:
+        return
+    print('--- get_move timing (ms per turn) ---', file=file)
+    for name, r in sorted(s['spans'].items()):
+        print('{:>14}  n={n:<6} mean={mean:8.3f} p50={p50:8.3f} p99={p99:8.3f} max={max:8.3f}'.format(name, **r), file=file)
+    print('--- counters (per turn) ---', file=file)
+    for name, r in sorted(s['counters'].items()):
+        print('{:>14}  n={n:<6} mean={mean:8.1f} p50={p50:8.0f} p99={p99:8.0f} max={max:8.0f}'.format(name, **r), file=file)
+    w = s['worst_turn']
+    print('worst turn {}: {:.3f} ms {}'.format(w['turn'], w['ms'],
+          ' '.join('{}={:.3f}'.format(k, v) for k, v in sorted(w['spans'].items()))), file=file)
+    if s['slow_turns']:
+        print('{} turn(s) over {} ms: {}'.format(len(s['slow_turns']), DEADLINE_MS,
+              ' '.join(str(t['turn']) for t in s['slow_turns'])), file=file)
+
+
+if os.environ.get('TURRETSLAYER_INSTRUMENT'):
+    enable(debug=os.environ.get('TURRETSLAYER_INSTRUMENT') == 'debug')
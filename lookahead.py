@@ -0,0 +1,119 @@
+'''
+Short lookahead over movement, as an alternative to the fixed
+shortest-path-then-QA rules when heading for a destination.
+
+The forward model is cheap because almost nothing in it depends on our
+own moves: bullets fly straight (bitboards advanced one turn at a time),
+turret fire follows the DangerSchedule, and the opponent is taken to
+stay where it is, with an expected cost for standing in its line of
+fire (the chance node of an expectimax, folded into its expectation).
+So a search state is just (cell, facing, turns from now), and a
+transposition table keyed on that collapses the many move orders that
+end up in the same place.
+
+The search deepens one turn at a time until the deadline and keeps the
+values of the deepest horizon it finished.
+'''
+import time
+from grid import opposite
+
+HIT_COST = 100.0 # in turns of distance to the destination
+OPP_SHOT_RISK = 0.3 # chance the opponent shoots down its line on a given turn
+MAX_DEPTH = 8
+OPP_RANGE = 4
+
+# actions besides turning to face 0..3
+STAY = -1
+FORWARD = -2
+
+
+class OutOfTime(Exception):
+    pass
+
+
+class Lookahead:
+    ''' Per-map part of the search, plan is called once per turn. '''
+
+    def __init__(self, grid, bits, danger):
+        self.grid = grid
+        self.bits = bits
+        self.danger = danger
+
+    def plan(self, turn, x, y, f, bullet_masks, opp_x, opp_y, opp_f, dest_dist, deadline, max_depth=MAX_DEPTH):
+        '''
+        Values of the root actions (STAY, FORWARD or a facing to turn to)
+        for the deepest horizon searched before deadline, or None if not
+        even one turn could be searched.  dest_dist(cell, facing) is the
+        turns left to the destination from a leaf.
+        '''
+        self.turn = turn
+        self.dest_dist = dest_dist
+        self.deadline = deadline
+        self.opp_cell = self.grid.cell(opp_x, opp_y)
+        opp_ray = 1 << self.opp_cell
+        self.opp_lane = 0
+        for k in range(OPP_RANGE):
+            opp_ray = self.bits.advance(opp_ray, opp_f)
+            self.opp_lane |= opp_ray
+        # bullets[t][f] and unsafe[t] for t turns from now, extended as the horizon grows
+        self.bullets = [list(bullet_masks)]
+        self.unsafe = [0]
+
+        start = self.grid.cell(x, y)
+        values = None
+        for depth in range(1, max_depth + 1):
+            self.extend(depth)
+            self.table = {}
+            try:
+                found = {}
+                for (c, g, action) in self.successors(start, f):
+                    found[action] = self.step_value(start, c, g, action, 1, depth)
+            except OutOfTime:
+                break
+            values = found
+        return values
+
+    def extend(self, depth):
+        bits = self.bits
+        while len(self.unsafe) <= depth:
+            t = len(self.unsafe)
+            masks = [bits.advance(m, f) for f, m in enumerate(self.bullets[-1])]
+            self.bullets.append(masks)
+            firing = [key for key in self.danger.masks if self.danger.firing(key, self.turn + t)]
+            self.unsafe.append(masks[0] | masks[1] | masks[2] | masks[3] | bits.rays(bits.mask(firing)))
+
+    def successors(self, c, f):
+        ''' (cell, facing, action) after each distinct move from (c, f). '''
+        out = [(c, f, STAY)]
+        nc = self.grid.step[1][f][c]
+        if not self.grid.walls[nc] and nc != self.opp_cell:
+            out.append((nc, f, FORWARD))
+        for g in range(4):
+            if g != f:
+                out.append((c, g, g))
+        return out
+
+    def step_value(self, c, nc, nf, action, t, depth):
+        ''' Cost of moving (c) -> (nc, nf) as move t, plus the best value from there. '''
+        cost = 0.0
+        if self.unsafe[t] >> nc & 1:
+            cost += HIT_COST
+        elif action == FORWARD and self.bullets[t - 1][opposite(nf)] >> nc & 1:
+            # walked through a bullet coming the other way
+            cost += HIT_COST
+        if self.opp_lane >> nc & 1:
+            cost += OPP_SHOT_RISK * HIT_COST
+        return self.value(nc, nf, t, depth) - cost
+
+    def value(self, c, f, t, depth):
+        if t == depth:
+            return -self.dest_dist(c, f)
+        key = (c, f, t)
+        v = self.table.get(key)
+        if v is not None:
+            return v
+        if time.perf_counter() >= self.deadline:
+            raise OutOfTime()
+        v = max(self.step_value(c, nc, g, action, t + 1, depth) for (nc, g, action) in self.successors(c, f))
+        self.table[key] = v
+        return v
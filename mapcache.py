@@ -0,0 +1,178 @@
+'''
+On-disk cache of per-map tables.  Matches are often played on the same
+few maps, and the all-pairs distance table alone can take a second to
+build on the first turn, so the tables are written out once and memory
+mapped back in on later matches.
+
+A map is identified by a fingerprint of everything the tables depend on
+(size, walls, turrets and teleport locations), and each one is a single
+file in the cache directory:
+
+    header     magic, CACHE_VERSION, length of the index
+    index      JSON {name: [dtype, shape, offset]}
+    arrays     raw, each starting on an ALIGN byte boundary
+
+Arrays come back as read-only views of the mapped file, so loading costs
+about as much as opening it.  Files of another CACHE_VERSION are never
+read, and the directory is kept under max_bytes by dropping the least
+recently used maps (a hit touches the file's mtime).
+'''
+import hashlib
+import json
+import os
+import struct
+import numpy as np
+import instrument
+
+CACHE_VERSION = 2 # bump whenever a cached table changes meaning or layout
+MAGIC = b'TSMAPS\0\0'
+HEADER = struct.Struct('<8sII') # magic, version, index bytes
+ALIGN = 64
+SUFFIX = '.map'
+MAX_BYTES = 256 * 2**20
+
+
+def fingerprint(gameboard, *extra):
+    ''' Hex digest identifying the map, extra is anything else the cached tables depend on. '''
+    key = hashlib.sha1()
+    key.update(struct.pack('<II', gameboard.width, gameboard.height))
+    for wall in sorted((wall.x, wall.y) for wall in gameboard.walls):
+        key.update(struct.pack('<II', *wall))
+    key.update(b'turrets')
+    # in gameboard order, cached tables refer to turrets by index
+    for turret in gameboard.turrets:
+        key.update(struct.pack('<IIII?', turret.x, turret.y, turret.fire_time, turret.cooldown_time,
+                               turret.is_dead))
+    key.update(b'teleports')
+    for loc in gameboard.teleport_locations:
+        key.update(struct.pack('<II', *loc))
+    key.update(repr(extra).encode())
+    return key.hexdigest()
+
+
+def layout(tables):
+    '''
+    (index, header bytes, total bytes) of tables laid out as a cache file,
+    index is {name: [dtype, shape, offset]}.
+    '''
+    index = {}
+    offset = 0
+    for name, table in tables.items():
+        index[name] = [table.dtype.str, list(table.shape), offset]
+        offset += -(-table.nbytes // ALIGN) * ALIGN
+    # offsets so far are from the start of the arrays, which follow the padded header and index
+    size = len(json.dumps(index).encode())
+    start = -(-(HEADER.size + size + 16 * len(index)) // ALIGN) * ALIGN
+    for entry in index.values():
+        entry[2] += start
+    text = json.dumps(index).encode()
+    return index, HEADER.pack(MAGIC, CACHE_VERSION, len(text)) + text, start + offset
+
+
+def unpack(data):
+    ''' {name: array view} of a uint8 array holding a cache file, ValueError if it isn't a whole one. '''
+    magic, version, size = HEADER.unpack_from(data)
+    if magic != MAGIC or version != CACHE_VERSION:
+        raise ValueError('not a version %d map cache file' % CACHE_VERSION)
+    index = json.loads(bytes(data[HEADER.size:HEADER.size + size]).decode())
+    tables = {}
+    for name, (dtype, shape, offset) in index.items():
+        dtype = np.dtype(dtype)
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        if offset + nbytes > data.size:
+            raise ValueError('truncated at ' + name)
+        tables[name] = data[offset:offset + nbytes].view(dtype).reshape(shape)
+    return tables
+
+
+def debug(*arg):
+    if instrument.DEBUG:
+        instrument.debug('mapcache:', *arg)
+
+
+class MapCache:
+    ''' A cache directory.  Nothing here raises on a bad or missing file, that is just a miss. '''
+
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.directory, '%s.v%d%s' % (key, CACHE_VERSION, SUFFIX))
+
+    def load(self, key):
+        ''' {name: read-only array} stored under key, or None. '''
+        path = self.path(key)
+        try:
+            tables = unpack(np.memmap(path, dtype=np.uint8, mode='r'))
+            os.utime(path) # most recently used
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, struct.error) as e:
+            debug('dropping', path, e)
+            self.remove(path)
+            return None
+        return tables
+
+    def store(self, key, tables):
+        ''' Writes {name: array} under key (replacing what was there), then evicts old maps. '''
+        index, header, size = layout(tables)
+        path = self.path(key)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp, 'wb') as out:
+                out.write(header)
+                for name, table in tables.items():
+                    out.seek(index[name][2])
+                    out.write(np.ascontiguousarray(table).tobytes())
+                out.truncate(size)
+            # readers see the old file or the new one, never half of one
+            os.replace(tmp, path)
+        except OSError as e:
+            debug('could not write', path, e)
+            self.remove(tmp)
+            return
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        ''' Removes least recently used files (other versions first) until the directory fits in max_bytes. '''
+        current = '.v%d%s' % (CACHE_VERSION, SUFFIX)
+        files = []
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(SUFFIX) and entry.path != keep:
+                    stat = entry.stat()
+                    files.append((entry.name.endswith(current), stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return
+        total = sum(f[2] for f in files)
+        if keep is not None and os.path.exists(keep):
+            total += os.path.getsize(keep)
+        for (_, _, size, path) in sorted(files):
+            if total <= self.max_bytes:
+                break
+            debug('evicting', path)
+            self.remove(path)
+            total -= size
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class SharedMap:
+    '''
+    What PlayerAIs in one process playing the same map can share, as
+    none of it changes during a match: the objects built straight from
+    the walls, and tables, the same {name: array} a cache file holds.
+    Kept in a {fingerprint: SharedMap} dict, see PlayerAI shared_maps.
+    '''
+
+    def __init__(self, grid, bits, engine, tables):
+        self.grid = grid
+        self.bits = bits
+        self.engine = engine
+        self.tables = tables
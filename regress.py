@@ -0,0 +1,151 @@
+'''
+Replays recorded matches (see replay.py) through the current PlayerAI
+and diffs its moves against the recorded ones, turn by turn, with the
+time get_move takes now against the time it took when recorded.
+
+Before every turn the bot state recorded with it (PlayerAI.carried_state:
+slay state machine, what was learnt about the opponent, planned route,
+turret bookkeeping) is restored, so one changed decision doesn't drag
+every later turn of the match along with it and each turn is judged on
+its own.  --free leaves the bot to carry its own state instead, which is
+what a whole changed match would look like.
+
+    python regress.py replays/                 every .replay in the directory
+    python regress.py a.replay b.replay --json out.json --show 20
+
+Exits non-zero if any move differs, so it can gate a change.  Recorded
+times come from wherever the match was played, compare speedups on the
+same machine.
+'''
+import argparse
+import json
+import os
+import sys
+import time
+from distances import DIRECTIONS
+from benchmark import summarize
+from PlayerAI import PlayerAI
+from replay import Replay
+from snapshot import PX, PY, PF, HP, SHIELDS, LASERS, TELEPORTS, SHIELD_ACTIVE
+import simulator
+
+
+def board_for(replay):
+    ''' A simulator Gameboard of the recorded map, entities get filled in per turn by set_turn. '''
+    header = replay.header
+    return simulator.Gameboard(header['width'], header['height'], replay.walls(),
+                               [tuple(t) for t in header['turrets']], (),
+                               [tuple(loc) for loc in header['teleport_locations']])
+
+
+def set_player(player, row):
+    player.x, player.y = row[PX], row[PY]
+    player.direction = DIRECTIONS[row[PF]]
+    player.hp = row[HP]
+    player.shield_count = row[SHIELDS]
+    player.laser_count = row[LASERS]
+    player.teleport_count = row[TELEPORTS]
+    player.shield_active = bool(row[SHIELD_ACTIVE])
+
+
+def set_turn(gameboard, players, state):
+    ''' Puts the recorded TurnState on the gameboard and players. '''
+    gameboard.current_turn = state.turn
+    for turret, dead, firing in zip(gameboard.turrets, state.turret_dead.tolist(), state.turret_firing_next.tolist()):
+        turret.is_dead = dead
+        turret.is_firing_next_turn = firing
+    # the power-up type isn't recorded, the bot doesn't look at it
+    gameboard.power_ups = [simulator.PowerUp(x, y, None) for x, y in state.power_ups.tolist()]
+    gameboard.bullets = [simulator.Bullet(x, y, DIRECTIONS[f], None) for x, y, f in state.bullets.tolist()]
+    for player, row in zip(players, state.players.tolist()):
+        set_player(player, row)
+
+
+def check(path, restore=True, options={}):
+    '''
+    Replays one file, returns a JSON-able dict with the turns whose move
+    differs, the recorded and replayed get_move times and the per-turn
+    differences (replayed - recorded, negative when faster now).
+    '''
+    replay = Replay(path)
+    gameboard = board_for(replay)
+    players = [simulator.Player(0, 0, DIRECTIONS[0]), simulator.Player(0, 0, DIRECTIONS[0])]
+    ai = PlayerAI(**options)
+    diffs = []
+    recorded = []
+    replayed = []
+    for i in range(len(replay)):
+        state = replay[i]
+        set_turn(gameboard, players, state)
+        if restore and state.bot_state is not None:
+            ai.restore_state(state.bot_state, gameboard)
+        start = time.perf_counter()
+        move = ai.get_move(gameboard, players[0], players[1])
+        spent = time.perf_counter() - start
+        if move != state.move:
+            diffs.append(dict(turn=state.turn, recorded=state.move.name, replayed=move.name))
+        if i:
+            # leave the map setup of the first turn out of the comparison
+            recorded.append(state.spent)
+            replayed.append(spent)
+    replay.close()
+    deltas = [b - a for a, b in zip(recorded, replayed)]
+    return dict(path=path, turns=len(replay), diffs=diffs, recorded=summarize(recorded), replayed=summarize(replayed),
+                mean_recorded_ms=1000 * sum(recorded) / max(1, len(recorded)),
+                mean_replayed_ms=1000 * sum(replayed) / max(1, len(replayed)),
+                delta=summarize(deltas), deltas_ms=[1000 * d for d in deltas])
+
+
+def replay_paths(args):
+    paths = []
+    for arg in args:
+        if os.path.isdir(arg):
+            paths.extend(os.path.join(arg, name) for name in sorted(os.listdir(arg)) if name.endswith('.replay'))
+        else:
+            paths.append(arg)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Diff PlayerAI moves against recorded matches.')
+    parser.add_argument('replays', nargs='+', help='.replay files or directories of them')
+    parser.add_argument('--free', action='store_true', help="don't restore the recorded bot state each turn")
+    parser.add_argument('--budget-ms', type=float, help='replay in deadline mode (moves may then differ by timing)')
+    parser.add_argument('--show', type=int, default=5, help='differing turns listed per match')
+    parser.add_argument('--json', help='write the per-match results to this file')
+    args = parser.parse_args()
+    options = {} if args.budget_ms is None else dict(time_budget=args.budget_ms / 1000.0)
+
+    results = []
+    turns = diffs = 0
+    recorded_ms = replayed_ms = 0.0
+    print('{:>6} {:>6} {:>11} {:>11} {:>8}  replay'.format('turns', 'diffs', 'rec mean ms', 'now mean ms', 'speedup'))
+    for path in replay_paths(args.replays):
+        try:
+            r = check(path, restore=not args.free, options=options)
+        except ValueError as e:
+            # empty or unfinished recordings
+            print('skipped:', e)
+            continue
+        results.append(r)
+        turns += r['turns']
+        diffs += len(r['diffs'])
+        recorded_ms += r['mean_recorded_ms'] * (r['turns'] - 1)
+        replayed_ms += r['mean_replayed_ms'] * (r['turns'] - 1)
+        print('{:>6} {:>6} {:>11.3f} {:>11.3f} {:>7.2f}x  {}'.format(
+            r['turns'], len(r['diffs']), r['mean_recorded_ms'], r['mean_replayed_ms'],
+            r['mean_recorded_ms'] / r['mean_replayed_ms'] if r['mean_replayed_ms'] else 0.0, os.path.basename(path)))
+        for d in r['diffs'][:args.show]:
+            print('{:>13} turn {}: recorded {} now {}'.format('', d['turn'], d['recorded'], d['replayed']))
+    print('{} matches, {} turns, {} differing moves, {:.2f}x speedup'.format(
+        len(results), turns, diffs, recorded_ms / replayed_ms if replayed_ms else 0.0))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if diffs:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,448 @@
+'''
+Match recordings: every turn's state as PlayerAI saw it (its Snapshot),
+what the bot carried over from earlier turns (PlayerAI.carried_state),
+the Move it answered with and how long that took, appended to one file
+per match.
+
+File layout, little-endian:
+
+    magic, FORMAT_VERSION, length of the header
+    header     JSON: map size, walls (packed bits), turrets, teleport
+               locations, and the Move names that move bytes index
+    records    one per turn, each a u16 length and then
+                   turn u16, move u8, flags u8, microseconds u32,
+                   both players' rows
+                   [TURRETS]    dead and firing-next bitmasks
+                   [POWER_UPS]  u16 count, (x, y) each
+                   bullets      KEYFRAME: u16 count, (x, y, facing) each
+                                otherwise: a bitmask of which of last
+                                turn's bullets, moved on one square, are
+                                still there, then u16 count of new ones
+                                and (x, y, facing) each
+                   [BOT_STATE]  u16 length, JSON: the whole state if
+                                STATE_FULL, else the keys that changed
+                                (see state_delta)
+
+Turrets, power-ups and bot state are only written when they change and bullets are
+a delta against where last turn's bullets should have flown, so a quiet
+turn costs a few dozen bytes.  Every KEYFRAME_TURNS turns the whole state
+is written out, so reading any turn decodes at most that many records.
+A record never goes over TURN_BUDGET bytes: past that, bullets are left
+out and the record is flagged TRUNCATED (the following records stay
+consistent with what was written), and then the bot state is left out
+and the record flagged STATE_LOST (the next one that fits has all of
+it).  Only huge numbers of turrets or power-ups can go past it.
+
+ReplayWriter encodes and writes in a background thread through a buffered
+file, get_move only queues the Snapshot.  The buffer is flushed at every
+keyframe, so a crash loses at most KEYFRAME_TURNS turns, and close (at
+the end of the match) writes out the rest.  Replay memory maps one file
+and decodes turns on demand, Archive does the same for a directory of
+them without keeping more than a few open.
+'''
+import atexit
+import collections
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import numpy as np
+from PythonClientAPI.libs.Game.Enums import *
+from distances import D_DX, D_DY
+from snapshot import PX, PY, PF, HP, SHIELDS, LASERS, TELEPORTS, SHIELD_ACTIVE
+
+MAGIC = b'TSREPLAY'
+FORMAT_VERSION = 3
+PREAMBLE = struct.Struct('<8sII') # magic, version, header bytes
+LENGTH = struct.Struct('<H')
+RECORD = struct.Struct('<HBBI') # turn, move, flags, microseconds get_move took
+PLAYER = struct.Struct('<HHBiBBBB') # x, y, facing, hp, shields, lasers, teleports, shield active
+COUNT = struct.Struct('<H')
+POWER_UP = np.dtype([('x', '<u2'), ('y', '<u2')])
+BULLET = np.dtype([('x', '<u2'), ('y', '<u2'), ('f', 'u1')])
+
+# record flags
+KEYFRAME = 1
+TURRETS = 2
+POWER_UPS = 4
+TRUNCATED = 8
+BOT_STATE = 16
+STATE_FULL = 32
+STATE_LOST = 64
+
+KEYFRAME_TURNS = 32
+TURN_BUDGET = 8192 # bytes per record at most
+BUFFER_BYTES = 1 << 16
+MOVES = list(Move)
+
+
+def bits(flags):
+    return np.packbits(np.asarray(flags, dtype=bool), bitorder='little').tobytes()
+
+
+def unbits(data, n):
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=n, bitorder='little').astype(bool)
+
+
+def flown(bullets, w, h):
+    ''' (x, y, f) rows of bullets one square further along. '''
+    out = bullets.copy()
+    f = bullets['f'].astype(np.intp)
+    out['x'] = (bullets['x'].astype(np.int64) + np.take(D_DX, f)) % w
+    out['y'] = (bullets['y'].astype(np.int64) + np.take(D_DY, f)) % h
+    return out
+
+
+def state_delta(old, new):
+    '''
+    The keys of new whose values differ from old's.  A list that is old's
+    with its first k items gone (the route after a step) is written as
+    {'drop': k}.
+    '''
+    delta = {}
+    for key, value in new.items():
+        was = old.get(key)
+        if value == was:
+            continue
+        if (isinstance(value, list) and isinstance(was, list) and len(value) < len(was)
+                and was[len(was) - len(value):] == value):
+            value = {'drop': len(was) - len(value)}
+        delta[key] = value
+    return delta
+
+
+def apply_delta(old, delta):
+    ''' The state state_delta(old, new) was made from. '''
+    state = dict(old)
+    for key, value in delta.items():
+        if isinstance(value, dict):
+            value = old[key][value['drop']:]
+        state[key] = value
+    return state
+
+
+class TurnState:
+    '''
+    One decoded turn: turn, move (a Move), spent (seconds get_move
+    took), players (2x8 int array with the snapshot.py columns),
+    turret_dead and turret_firing_next (bool arrays in header turret
+    order), power_ups (k,2) and bullets (k,3) (x, y, facing index),
+    truncated if bullets were left out, and bot_state (the
+    PlayerAI.carried_state dict from before the move, None if not known).
+    '''
+
+    def __init__(self, turn, move, spent, players, turret_dead, turret_firing_next, power_ups, bullets, truncated,
+                 bot_state):
+        self.turn = turn
+        self.move = move
+        self.spent = spent
+        self.players = players
+        self.turret_dead = turret_dead
+        self.turret_firing_next = turret_firing_next
+        self.power_ups = power_ups
+        self.bullets = bullets
+        self.truncated = truncated
+        self.bot_state = bot_state
+
+
+class ReplayWriter:
+    ''' Records one match.  record is cheap, encoding and I/O happen on the writer thread. '''
+
+    def __init__(self, path, gameboard, snapshot):
+        self.path = path
+        self.w = gameboard.width
+        self.h = gameboard.height
+        walls = np.zeros(self.w * self.h, dtype=bool)
+        for wall in gameboard.walls:
+            walls[wall.x * self.h + wall.y] = True
+        self.header = dict(width=self.w, height=self.h, walls=bits(walls).hex(),
+                           turrets=np.stack([snapshot.turret_x, snapshot.turret_y, snapshot.turret_fire_time,
+                                             snapshot.turret_cooldown], axis=1).tolist(),
+                           teleport_locations=[list(loc) for loc in snapshot.teleport_locations],
+                           moves=[move.name for move in MOVES])
+        # what the last record left the reader with
+        self.turrets = None
+        self.power_ups = None
+        self.bot_state = None
+        self.bullets = None
+        self.since_keyframe = KEYFRAME_TURNS
+
+        self.queue = queue.Queue()
+        self.error = None # what stopped the writer thread
+        self.raised = False
+        self.thread = threading.Thread(target=self.run, name='replay-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def record(self, snapshot, move, bot_state=None, spent=0.0):
+        '''
+        Queues the turn, snapshot and bot_state must not be changed
+        afterwards (PlayerAI makes new ones every turn).  bot_state can
+        also be a function returning it, called on the writer thread so
+        the caller doesn't wait for it to be worked out.  Raises what
+        stopped the writer thread, if it has stopped; turns after that
+        are dropped.
+        '''
+        self.check()
+        if self.error is None:
+            self.queue.put((snapshot, move, bot_state, spent))
+
+    def close(self):
+        ''' Writes out everything queued and closes the file, raising what stopped the writer if not raised yet. '''
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        atexit.unregister(self.close)
+        self.check()
+
+    def check(self):
+        if self.error is not None and not self.raised:
+            self.raised = True
+            raise self.error
+
+    def run(self):
+        try:
+            with open(self.path, 'wb', buffering=BUFFER_BYTES) as out:
+                text = json.dumps(self.header).encode()
+                out.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(text)))
+                out.write(text)
+                while True:
+                    item = self.queue.get()
+                    if item is None:
+                        break
+                    keyframe = self.since_keyframe >= KEYFRAME_TURNS
+                    body = self.encode(*item)
+                    out.write(LENGTH.pack(len(body)))
+                    out.write(body)
+                    if keyframe:
+                        out.flush()
+        except Exception as e:
+            # handed to the caller by the next record or close
+            self.error = e
+
+    def encode(self, snap, move, bot_state, spent):
+        if callable(bot_state):
+            bot_state = bot_state()
+        flags = 0
+        keyframe = self.since_keyframe >= KEYFRAME_TURNS
+        if keyframe:
+            flags |= KEYFRAME
+            self.since_keyframe = 0
+        self.since_keyframe += 1
+
+        parts = []
+        for row in snap.players.tolist():
+            parts.append(PLAYER.pack(row[PX], row[PY], row[PF], row[HP], row[SHIELDS], row[LASERS],
+                                     row[TELEPORTS], row[SHIELD_ACTIVE]))
+        turrets = bits(snap.turret_dead) + bits(snap.turret_firing_next)
+        if keyframe or turrets != self.turrets:
+            flags |= TURRETS
+            parts.append(turrets)
+            self.turrets = turrets
+        power_ups = np.zeros(len(snap.power_up_x), dtype=POWER_UP)
+        power_ups['x'] = snap.power_up_x
+        power_ups['y'] = snap.power_up_y
+        power_ups = power_ups.tobytes()
+        if keyframe or power_ups != self.power_ups:
+            flags |= POWER_UPS
+            parts.append(COUNT.pack(len(snap.power_up_x)) + power_ups)
+            self.power_ups = power_ups
+
+        now = np.zeros(len(snap.bullet_x), dtype=BULLET)
+        now['x'] = snap.bullet_x
+        now['y'] = snap.bullet_y
+        now['f'] = snap.bullet_f
+        if keyframe:
+            kept = np.zeros(0, dtype=BULLET)
+            added = now
+        else:
+            expected = flown(self.bullets, self.w, self.h)
+            left = collections.Counter(now.tolist())
+            still = []
+            for b in expected.tolist():
+                still.append(left[b] > 0)
+                left[b] -= 1
+            parts.append(bits(still))
+            kept = expected[np.array(still, dtype=bool)]
+            added = np.array([b for b, k in left.items() for i in range(k)], dtype=BULLET)
+
+        size = RECORD.size + sum(len(p) for p in parts) + COUNT.size
+        room = max(0, (TURN_BUDGET - size) // BULLET.itemsize)
+        if len(added) > room:
+            flags |= TRUNCATED
+            added = added[:room]
+        parts.append(COUNT.pack(len(added)) + added.tobytes())
+        self.bullets = np.concatenate([kept, added])
+
+        if bot_state is not None:
+            full = keyframe or self.bot_state is None
+            delta = bot_state if full else state_delta(self.bot_state, bot_state)
+            if delta:
+                state = json.dumps(delta, separators=(',', ':')).encode()
+                if size + len(added) * BULLET.itemsize + COUNT.size + len(state) <= TURN_BUDGET:
+                    flags |= BOT_STATE | (STATE_FULL if full else 0)
+                    parts.append(COUNT.pack(len(state)) + state)
+                    self.bot_state = bot_state
+                else:
+                    flags |= STATE_LOST
+                    self.bot_state = None
+        micros = min(int(spent * 1e6), 2**32 - 1)
+        return RECORD.pack(snap.turn, MOVES.index(move), flags, micros) + b''.join(parts)
+
+
+class Replay:
+    ''' One recorded match, memory mapped.  replay[i] is the i-th recorded turn as a TurnState. '''
+
+    def __init__(self, path):
+        ''' ValueError if path isn't a replay, or one that hasn't got its header written yet. '''
+        self.path = path
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < PREAMBLE.size:
+                raise ValueError('{} is empty or cut short'.format(path))
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, size = PREAMBLE.unpack_from(self.data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.data.close()
+            raise ValueError('{} is not a version {} replay'.format(path, FORMAT_VERSION))
+        if PREAMBLE.size + size > len(self.data):
+            self.data.close()
+            raise ValueError('{} is empty or cut short'.format(path))
+        self.header = json.loads(self.data[PREAMBLE.size:PREAMBLE.size + size].decode())
+        self.w = self.header['width']
+        self.h = self.header['height']
+        self.moves = [Move[name] for name in self.header['moves']]
+        self.n_turrets = len(self.header['turrets'])
+        self.offsets = self.index(PREAMBLE.size + size)
+        self.keyframes = [i for i, at in enumerate(self.offsets) if self.data[at + 3] & KEYFRAME]
+        self.cursor = None # (i, TurnState) last decoded, so reading turns in order decodes each once
+
+    def index(self, at):
+        ''' Offsets of the record bodies, a record cut short at the end (match still running) is left out. '''
+        offsets = []
+        end = len(self.data)
+        while at + LENGTH.size <= end:
+            size, = LENGTH.unpack_from(self.data, at)
+            if at + LENGTH.size + size > end:
+                break
+            offsets.append(at + LENGTH.size)
+            at += LENGTH.size + size
+        return offsets
+
+    def walls(self):
+        ''' The (x, y) wall squares. '''
+        cells = np.nonzero(unbits(bytes.fromhex(self.header['walls']), self.w * self.h))[0]
+        return [divmod(int(c), self.h) for c in cells]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self.offsets):
+            raise IndexError(i)
+        if self.cursor is not None and self.cursor[0] <= i and i - self.cursor[0] <= KEYFRAME_TURNS:
+            j, state = self.cursor
+        else:
+            j = self.keyframes[np.searchsorted(self.keyframes, i, side='right') - 1]
+            state = self.decode(j, None)
+        while j < i:
+            j += 1
+            state = self.decode(j, state)
+        self.cursor = (i, state)
+        return state
+
+    def decode(self, i, prev):
+        data = self.data
+        at = self.offsets[i]
+        turn, move, flags, micros = RECORD.unpack_from(data, at)
+        at += RECORD.size
+        players = np.zeros((2, 8), dtype=np.int64)
+        for p in range(2):
+            x, y, f, hp, shields, lasers, teleports, shield_active = PLAYER.unpack_from(data, at)
+            players[p, [PX, PY, PF, HP, SHIELDS, LASERS, TELEPORTS, SHIELD_ACTIVE]] = (
+                x, y, f, hp, shields, lasers, teleports, shield_active)
+            at += PLAYER.size
+        if flags & TURRETS:
+            k = (self.n_turrets + 7) // 8
+            dead = unbits(data[at:at + k], self.n_turrets)
+            firing = unbits(data[at + k:at + 2 * k], self.n_turrets)
+            at += 2 * k
+        else:
+            dead, firing = prev.turret_dead, prev.turret_firing_next
+        if flags & POWER_UPS:
+            count, = COUNT.unpack_from(data, at)
+            at += COUNT.size
+            power_ups = np.frombuffer(data, dtype=POWER_UP, count=count, offset=at)
+            at += count * POWER_UP.itemsize
+            power_ups = np.stack([power_ups['x'], power_ups['y']], axis=1).astype(np.int64)
+        else:
+            power_ups = prev.power_ups
+        if flags & KEYFRAME:
+            kept = np.zeros((0, 3), dtype=np.int64)
+        else:
+            expected = flown(self.as_records(prev.bullets), self.w, self.h)
+            k = (len(expected) + 7) // 8
+            still = unbits(data[at:at + k], len(expected))
+            at += k
+            kept = self.as_rows(expected[still])
+        count, = COUNT.unpack_from(data, at)
+        at += COUNT.size
+        added = self.as_rows(np.frombuffer(data, dtype=BULLET, count=count, offset=at))
+        at += count * BULLET.itemsize
+        if flags & BOT_STATE:
+            size, = COUNT.unpack_from(data, at)
+            bot_state = json.loads(data[at + COUNT.size:at + COUNT.size + size].decode())
+            if not flags & STATE_FULL:
+                bot_state = apply_delta(prev.bot_state, bot_state)
+        elif flags & STATE_LOST or prev is None:
+            bot_state = None
+        else:
+            bot_state = prev.bot_state
+        return TurnState(turn, self.moves[move], micros / 1e6, players, dead, firing, power_ups,
+                         np.concatenate([kept, added]), bool(flags & TRUNCATED), bot_state)
+
+    def as_records(self, rows):
+        out = np.zeros(len(rows), dtype=BULLET)
+        out['x'], out['y'], out['f'] = rows[:, 0], rows[:, 1], rows[:, 2]
+        return out
+
+    def as_rows(self, records):
+        return np.stack([records['x'], records['y'], records['f']], axis=1).astype(np.int64).reshape(-1, 3)
+
+    def close(self):
+        self.data.close()
+
+
+class Archive:
+    '''
+    Every replay in a directory by file name, opened on first use and
+    closed again when more than max_open are open (least recently used
+    first), so thousands of matches cost nothing until they're read.
+    Empty files (matches that haven't written anything yet) are left out.
+    '''
+
+    def __init__(self, directory, max_open=64):
+        self.directory = directory
+        self.names = sorted(entry.name for entry in os.scandir(directory)
+                            if entry.name.endswith('.replay') and entry.stat().st_size > 0)
+        self.max_open = max_open
+        self.open = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __getitem__(self, name):
+        replay = self.open.pop(name, None)
+        if replay is None:
+            replay = Replay(os.path.join(self.directory, name))
+            while len(self.open) >= self.max_open:
+                self.open.popitem(last=False)[1].close()
+        self.open[name] = replay
+        return replay
+
+    def turn(self, name, i):
+        return self[name][i]
@@ -0,0 +1,227 @@
+'''
+Per-map tables in shared memory, for running one PlayerAI per worker
+process without every worker building and holding its own copy.
+
+The first process on a map publishes its tables (the {name: array} a
+mapcache file holds, in the same layout) into a multiprocessing.shared_memory
+segment named after the map's fingerprint; every other process attaches
+the segment and gets read-only NumPy views straight into it.  The magic
+number at the start is written last, so a publisher dying half way
+leaves a segment nobody reads (and the next one to find it unlinks it).
+
+Segments are reference counted across processes by the pids using them,
+kept in a file in lock_dir that is flock'd around creating, attaching
+and unlinking the segment, and removed along with it.  A process drops its reference when its last
+PlayerAI on the map is gone (or at exit), and whoever drops the last one
+unlinks the segment; pids that died without letting go are pruned on the
+way.  The locking needs POSIX; on Windows shared memory is freed with
+the last handle anyway, so the counting is skipped there.
+'''
+import atexit
+import contextlib
+import json
+import os
+import tempfile
+import weakref
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+import mapcache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+PREFIX = 'turretslayer'
+
+
+def segment_name(key):
+    # POSIX shared memory names are short, 20 hex digits of the fingerprint are plenty
+    return '%s-%s-v%d' % (PREFIX, key[:20], mapcache.CACHE_VERSION)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedTables:
+    ''' This process's handles on the shared segments, by map fingerprint. '''
+
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir or tempfile.gettempdir()
+        self.segments = {} # key:SharedMemory
+        self.users = {} # key:number of PlayerAIs of this process using the segment
+        atexit.register(self.close)
+
+    def acquire(self, key, user):
+        '''
+        Read-only {name: array} views of the map's published tables, or
+        None if nobody has published them yet.  They stay valid while
+        user (the PlayerAI holding them) is alive.
+        '''
+        if key not in self.segments:
+            with self.pids(key) as pids:
+                shm = self.attach(key, pids)
+                if shm is None:
+                    return None
+                pids.add(os.getpid())
+            self.segments[key] = shm
+        self.use(key, user)
+        return self.views(self.segments[key])
+
+    def publish(self, key, tables, user):
+        '''
+        Puts tables in a new segment for the map and returns views of it
+        like acquire (of the segment already there if another process got
+        in first), or None if there's no shared memory to be had.
+        '''
+        if key not in self.segments:
+            index, header, size = mapcache.layout(tables)
+            with self.pids(key) as pids:
+                shm = self.attach(key, pids)
+                if shm is None:
+                    try:
+                        shm = self.open(segment_name(key), size)
+                    except OSError as e:
+                        mapcache.debug('no shared memory for', key, e)
+                        return None
+                    buf = np.ndarray(size, dtype=np.uint8, buffer=shm.buf)
+                    for name, table in tables.items():
+                        offset = index[name][2]
+                        buf[offset:offset + table.nbytes] = np.ascontiguousarray(table).reshape(-1).view(np.uint8)
+                    buf[len(mapcache.MAGIC):len(header)] = np.frombuffer(header[len(mapcache.MAGIC):], dtype=np.uint8)
+                    # magic last, a crash before here leaves a segment nobody will read
+                    buf[:len(mapcache.MAGIC)] = np.frombuffer(mapcache.MAGIC, dtype=np.uint8)
+                    del buf
+                pids.add(os.getpid())
+            self.segments[key] = shm
+        return self.acquire(key, user)
+
+    def attach(self, key, pids):
+        '''
+        The map's segment if it's there and whole, else None.  Called with
+        the pids lock held; a segment left half done by a crashed
+        publisher is unlinked if nobody uses it.
+        '''
+        try:
+            shm = self.open(segment_name(key))
+        except FileNotFoundError:
+            return None
+        try:
+            self.views(shm)
+        except ValueError:
+            if not pids and fcntl is not None:
+                self.unlink(shm)
+            shm.close()
+            return None
+        return shm
+
+    def open(self, name, size=None):
+        ''' Attach (size None) or create the segment, leaving its lifetime to the reference counts. '''
+        shm = shared_memory.SharedMemory(name, create=size is not None, size=size or 0)
+        # the resource tracker would unlink it when this process exits, under the others' feet
+        try:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        return shm
+
+    def unlink(self, shm):
+        # unlink unregisters it again, which the tracker complains about unless it's registered
+        resource_tracker.register(shm._name, 'shared_memory')
+        shm.unlink()
+
+    def views(self, shm):
+        data = np.ndarray(shm.size, dtype=np.uint8, buffer=shm.buf)
+        data.flags.writeable = False
+        return mapcache.unpack(data)
+
+    def use(self, key, user):
+        self.users[key] = self.users.get(key, 0) + 1
+        weakref.finalize(user, self.unuse, key)
+
+    def unuse(self, key):
+        if key not in self.users:
+            # released already (at exit)
+            return
+        self.users[key] -= 1
+        if self.users[key] <= 0:
+            self.release(key)
+
+    def release(self, key):
+        ''' This process is done with the map, the last process done unlinks the segment. '''
+        shm = self.segments.pop(key, None)
+        self.users.pop(key, None)
+        if shm is None:
+            return
+        with self.pids(key) as pids:
+            pids.discard(os.getpid())
+            if not pids and fcntl is not None:
+                try:
+                    self.unlink(shm)
+                except FileNotFoundError:
+                    pass
+        try:
+            shm.close()
+        except BufferError:
+            # views still around, the mapping goes when they do
+            pass
+
+    @contextlib.contextmanager
+    def pids(self, key):
+        '''
+        The set of live pids using the map's segment, held under the lock
+        and written back afterwards, or the file removed once the set is
+        empty.  Without flock (Windows) it's a throwaway set with this
+        process in it.
+        '''
+        if fcntl is None:
+            yield {os.getpid()}
+            return
+        path = os.path.join(self.lock_dir, segment_name(key) + '.pids')
+        while True:
+            f = open(path, 'a+')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                same = os.path.samestat(os.fstat(f.fileno()), os.stat(path))
+            except FileNotFoundError:
+                same = False
+            if same:
+                break
+            # removed by whoever held the lock before us, lock the new one
+            f.close()
+        with f:
+            f.seek(0)
+            try:
+                pids = set(json.loads(f.read() or '[]'))
+            except ValueError:
+                pids = set()
+            pids = {pid for pid in pids if pid_alive(pid)}
+            yield pids
+            if pids:
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(sorted(pids)))
+            else:
+                os.remove(path)
+
+    def close(self):
+        for key in list(self.segments):
+            self.release(key)
+
+
+_process_tables = None
+
+
+def process_tables():
+    ''' The SharedTables of this process, made on first use. '''
+    global _process_tables
+    if _process_tables is None:
+        _process_tables = SharedTables()
+    return _process_tables
@@ -0,0 +1,368 @@
+'''
+Headless stand-in for the match server, for running PlayerAI offline.
+
+The gameboard, player and opponent objects carry the attributes PlayerAI
+reads from the real client API, and Match.step applies one turn of
+movement, bullets, turrets, powerups, teleports, shields and lasers.  The
+rules follow what the bot assumes about the server, not the server's
+source, so use it for load testing and profiling rather than for settling
+rule questions.
+
+    python simulator.py --size 20 --seed 3 [--profile]
+'''
+import argparse
+import random
+import time
+from enum import Enum
+from PythonClientAPI.libs.Game.Enums import *
+from distances import D_INDEX, D_DX, D_DY
+
+BULLET_SPEED = 1 # squares per turn
+TURRET_RANGE = 4
+LASER_RANGE = 4
+SHIELD_TURNS = 2 # the turn it goes up and the next one
+START_HP = 3
+MAX_TURNS = 500
+
+TURRET_KILL_POINTS = 1
+HIT_POINTS = 1
+
+face_move_to_dir = {Move.FACE_UP : Direction.UP,
+                    Move.FACE_DOWN : Direction.DOWN,
+                    Move.FACE_LEFT : Direction.LEFT,
+                    Move.FACE_RIGHT : Direction.RIGHT}
+teleport_move_to_index = {Move.TELEPORT_0:0, Move.TELEPORT_1:1,
+                          Move.TELEPORT_2:2, Move.TELEPORT_3:3,
+                          Move.TELEPORT_4:4, Move.TELEPORT_5:5}
+
+
+class PowerUpType(Enum):
+    SHIELD = 0
+    LASER = 1
+    TELEPORT = 2
+
+
+class Wall:
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class Turret:
+    __slots__ = ('x', 'y', 'fire_time', 'cooldown_time', 'is_dead', 'is_firing_next_turn')
+
+    def __init__(self, x, y, fire_time, cooldown_time):
+        self.x = x
+        self.y = y
+        self.fire_time = fire_time
+        self.cooldown_time = cooldown_time
+        self.is_dead = False
+        self.is_firing_next_turn = False
+
+    def is_firing(self, turn):
+        return not self.is_dead and turn % (self.fire_time + self.cooldown_time) < self.fire_time
+
+
+class Bullet:
+    __slots__ = ('x', 'y', 'direction', 'shooter')
+
+    def __init__(self, x, y, direction, shooter):
+        self.x = x
+        self.y = y
+        self.direction = direction
+        self.shooter = shooter
+
+
+class PowerUp:
+    __slots__ = ('x', 'y', 'power_up_type')
+
+    def __init__(self, x, y, power_up_type):
+        self.x = x
+        self.y = y
+        self.power_up_type = power_up_type
+
+
+class Player:
+    def __init__(self, x, y, direction, hp=START_HP):
+        self.x = x
+        self.y = y
+        self.direction = direction
+        self.hp = hp
+        self.score = 0
+        self.shield_count = 0
+        self.laser_count = 0
+        self.teleport_count = 0
+        self.shield_active = False
+        self.shield_turns = 0
+
+
+class Gameboard:
+    ''' The map and everything on it, with the query helpers the client API provides. '''
+
+    def __init__(self, width, height, walls, turrets, power_ups=(), teleport_locations=()):
+        self.width = width
+        self.height = height
+        self.walls = [Wall(x, y) for (x, y) in walls]
+        self.turrets = [Turret(x, y, f, c) for (x, y, f, c) in turrets]
+        self.power_ups = [PowerUp(x, y, t) for (x, y, t) in power_ups]
+        self.teleport_locations = list(teleport_locations)
+        self.bullets = []
+        self.current_turn = 0
+
+        self.wall_set = set(walls)
+        self.turret_at = {(t.x, t.y): t for t in self.turrets}
+        self.update_turrets()
+
+    def update_turrets(self):
+        for t in self.turrets:
+            t.is_firing_next_turn = t.is_firing(self.current_turn + 1)
+
+    def are_bullets_at_tile(self, x, y):
+        return [b for b in self.bullets if b.x == x and b.y == y]
+
+    def is_wall_at_tile(self, x, y):
+        return (x, y) in self.wall_set
+
+    def is_turret_at_tile(self, x, y):
+        return (x, y) in self.turret_at
+
+    def blocked(self, x, y):
+        return (x, y) in self.wall_set or (x, y) in self.turret_at
+
+    def step(self, x, y, direction, n=1):
+        f = D_INDEX[direction]
+        return ((x + n * D_DX[f]) % self.width, (y + n * D_DY[f]) % self.height)
+
+    def in_fire(self, sx, sy, x, y, fire_range):
+        ''' Whether fire from (sx,sy) in all four directions reaches (x,y) before a wall. '''
+        if sx != x and sy != y:
+            return False
+        for d in list(Direction):
+            cx, cy = sx, sy
+            for i in range(fire_range):
+                cx, cy = self.step(cx, cy, d)
+                if self.blocked(cx, cy):
+                    break
+                if (cx, cy) == (x, y):
+                    return True
+        return False
+
+
+def random_board(width, height, wall_density=0.15, turrets=4, power_ups=3, teleports=2,
+                 fire_time=(1, 3), cooldown_time=(1, 5), seed=None):
+    '''
+    Random map plus two start squares, as (gameboard, (x0,y0), (x1,y1)).
+    Wall-heavy maps can have pockets, the starts are only guaranteed to be open.
+    '''
+    rng = random.Random(seed)
+    squares = [(x, y) for x in range(width) for y in range(height)]
+    rng.shuffle(squares)
+    n_walls = int(wall_density * width * height)
+    walls = squares[:n_walls]
+    free = squares[n_walls:]
+    turret_sq = free[:turrets]
+    free = free[turrets:]
+    starts = free[:2]
+    free = free[2:]
+    pu_sq = free[:power_ups]
+    tp_sq = free[power_ups:power_ups + teleports]
+
+    gameboard = Gameboard(width, height, walls,
+                          [(x, y, rng.randint(*fire_time), rng.randint(*cooldown_time)) for (x, y) in turret_sq],
+                          [(x, y, rng.choice(list(PowerUpType))) for (x, y) in pu_sq],
+                          tp_sq)
+    return gameboard, starts[0], starts[1]
+
+
+class Match:
+    ''' Two bots with get_move(gameboard, player, opponent) on one gameboard. '''
+
+    def __init__(self, gameboard, ai0, ai1, start0, start1, max_turns=MAX_TURNS):
+        self.gameboard = gameboard
+        self.ais = [ai0, ai1]
+        self.players = [Player(start0[0], start0[1], Direction.UP),
+                        Player(start1[0], start1[1], Direction.DOWN)]
+        self.max_turns = max_turns
+        self.moves = [[], []]
+
+    def over(self):
+        return (self.gameboard.current_turn >= self.max_turns
+                or any(p.hp <= 0 for p in self.players))
+
+    def winner(self):
+        ''' 0 or 1, or None for a draw. '''
+        p0, p1 = self.players
+        key0 = (p0.hp > 0, p0.score, p0.hp)
+        key1 = (p1.hp > 0, p1.score, p1.hp)
+        if key0 == key1:
+            return None
+        return 0 if key0 > key1 else 1
+
+    def play(self):
+        ''' Plays to the end, then closes the bots that have a close (to finish their replays). '''
+        while not self.over():
+            self.step()
+        for ai in self.ais:
+            if hasattr(ai, 'close'):
+                ai.close()
+        return self.winner()
+
+    def step(self, moves=None):
+        ''' Play one turn.  moves overrides asking the bots, for replays. '''
+        gb = self.gameboard
+        p = self.players
+        if moves is None:
+            moves = [self.ais[0].get_move(gb, p[0], p[1]),
+                     self.ais[1].get_move(gb, p[1], p[0])]
+        for i in range(2):
+            self.moves[i].append(moves[i])
+
+        old_pos = [(pl.x, pl.y) for pl in p]
+        lasers = []
+        for i in range(2):
+            self.apply_move(i, moves[i], lasers)
+        # can't walk into each other, both bounce back
+        if (p[0].x, p[0].y) == (p[1].x, p[1].y):
+            for i in range(2):
+                p[i].x, p[i].y = old_pos[i]
+
+        for i in lasers:
+            self.fire_laser(i)
+        self.move_bullets(old_pos)
+
+        gb.current_turn += 1
+        for t in gb.turrets:
+            if t.is_firing(gb.current_turn):
+                for pl in p:
+                    if gb.in_fire(t.x, t.y, pl.x, pl.y, TURRET_RANGE):
+                        self.hit(pl)
+        gb.update_turrets()
+
+        for pl in p:
+            for pu in gb.power_ups:
+                if (pu.x, pu.y) == (pl.x, pl.y):
+                    if pu.power_up_type == PowerUpType.SHIELD:
+                        pl.shield_count += 1
+                    elif pu.power_up_type == PowerUpType.LASER:
+                        pl.laser_count += 1
+                    else:
+                        pl.teleport_count += 1
+                    gb.power_ups.remove(pu)
+                    break
+            if pl.shield_turns:
+                pl.shield_turns -= 1
+                pl.shield_active = pl.shield_turns > 0
+
+    def apply_move(self, i, move, lasers):
+        gb = self.gameboard
+        pl = self.players[i]
+        if move in face_move_to_dir:
+            pl.direction = face_move_to_dir[move]
+        elif move == Move.FORWARD:
+            x, y = gb.step(pl.x, pl.y, pl.direction)
+            if not gb.blocked(x, y):
+                pl.x, pl.y = x, y
+        elif move == Move.SHOOT:
+            gb.bullets.append(Bullet(pl.x, pl.y, pl.direction, i))
+        elif move == Move.SHIELD and pl.shield_count:
+            pl.shield_count -= 1
+            pl.shield_active = True
+            pl.shield_turns = SHIELD_TURNS
+        elif move == Move.LASER and pl.laser_count:
+            pl.laser_count -= 1
+            lasers.append(i)
+        elif move in teleport_move_to_index and pl.teleport_count:
+            index = teleport_move_to_index[move]
+            if index < len(gb.teleport_locations):
+                pl.teleport_count -= 1
+                pl.x, pl.y = gb.teleport_locations[index]
+
+    def fire_laser(self, i):
+        gb = self.gameboard
+        pl = self.players[i]
+        opp = self.players[1 - i]
+        if gb.in_fire(pl.x, pl.y, opp.x, opp.y, LASER_RANGE):
+            self.hit(opp)
+            pl.score += HIT_POINTS
+        for d in list(Direction):
+            for k in range(1, LASER_RANGE + 1):
+                x, y = gb.step(pl.x, pl.y, d, k)
+                if gb.blocked(x, y):
+                    self.kill_turret(x, y, i)
+                    break
+
+    def move_bullets(self, old_pos):
+        gb = self.gameboard
+        p = self.players
+        flying = []
+        for b in gb.bullets:
+            hit = False
+            for k in range(BULLET_SPEED):
+                prev = (b.x, b.y)
+                b.x, b.y = gb.step(b.x, b.y, b.direction)
+                if gb.blocked(b.x, b.y):
+                    self.kill_turret(b.x, b.y, b.shooter)
+                    hit = True
+                    break
+                for j in range(2):
+                    # landed on a player, or passed one walking the other way
+                    if ((p[j].x, p[j].y) == (b.x, b.y)
+                            or (k == 0 and old_pos[j] == (b.x, b.y) and (p[j].x, p[j].y) == prev)):
+                        self.hit(p[j])
+                        if j != b.shooter:
+                            p[b.shooter].score += HIT_POINTS
+                        hit = True
+                if hit:
+                    break
+            if not hit:
+                flying.append(b)
+        gb.bullets = flying
+
+    def kill_turret(self, x, y, shooter):
+        turret = self.gameboard.turret_at.get((x, y))
+        if turret is not None and not turret.is_dead:
+            turret.is_dead = True
+            self.players[shooter].score += TURRET_KILL_POINTS
+
+    def hit(self, pl):
+        if not pl.shield_active:
+            pl.hp -= 1
+
+
+def main():
+    from PlayerAI import PlayerAI
+    parser = argparse.ArgumentParser(description='Play PlayerAI against itself on a random map.')
+    parser.add_argument('--size', type=int, default=20)
+    parser.add_argument('--turrets', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--turns', type=int, default=MAX_TURNS)
+    parser.add_argument('--profile', action='store_true', help='print get_move timing and counters at the end')
+    parser.add_argument('--budget-ms', type=float, help='play both bots in deadline mode with this time budget')
+    parser.add_argument('--lookahead', action='store_true', help='player 0 uses the lookahead search')
+    parser.add_argument('--map-cache', help='directory both bots keep per-map tables in between runs')
+    parser.add_argument('--warm-up', action='store_true', help='both bots build their distance tables in the background, even the ones quick enough for the first turn')
+    parser.add_argument('--record', help='directory player 0 writes a replay of the match to')
+    args = parser.parse_args()
+    if args.profile:
+        import instrument
+        instrument.enable()
+
+    gameboard, s0, s1 = random_board(args.size, args.size, turrets=args.turrets, seed=args.seed)
+    budget = None if args.budget_ms is None else args.budget_ms / 1000.0
+    options = dict(time_budget=budget, map_cache=args.map_cache, warm_up=args.warm_up or None)
+    match = Match(gameboard, PlayerAI(lookahead=args.lookahead, record=args.record, **options), PlayerAI(**options),
+                  s0, s1, max_turns=args.turns)
+    start = time.perf_counter()
+    winner = match.play()
+    elapsed = time.perf_counter() - start
+    turns = gameboard.current_turn
+    print('winner: {}  turns: {}  scores: {} {}  hp: {} {}'.format(
+        winner, turns, match.players[0].score, match.players[1].score,
+        match.players[0].hp, match.players[1].hp))
+    print('{:.1f} turns/s'.format(turns / elapsed))
+
+
+if __name__ == '__main__':
+    main()
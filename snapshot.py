@@ -0,0 +1,51 @@
+'''
+Columnar copy of the gameboard and players, taken once at the start of a
+turn.  Every subsystem reads these arrays instead of walking the server's
+object graph again, and queries over all turrets or bullets can be
+vectorized.
+'''
+import numpy as np
+from distances import D_INDEX
+
+# columns of Snapshot.players
+PX, PY, PF, HP, SHIELDS, LASERS, TELEPORTS, SHIELD_ACTIVE = range(8)
+
+
+def player_row(player):
+    return [player.x, player.y, D_INDEX[player.direction], player.hp, player.shield_count,
+            player.laser_count, player.teleport_count, player.shield_active]
+
+
+class Snapshot:
+    '''
+    Entities as flat arrays in the gameboard's own order, so index i of
+    bullet_x is gameboard.bullets[i] (kept in bullets for callers that
+    need the object back), and likewise for turrets.
+
+    turret_x, turret_y, turret_fire_time, turret_cooldown   int32
+    turret_dead, turret_firing_next                         bool
+    bullet_x, bullet_y, bullet_f                            int32, f is the D_INDEX facing
+    power_up_x, power_up_y                                  int32
+    players[i, column]    row 0 is the player, row 1 the opponent, see the column names above
+    '''
+
+    def __init__(self, gameboard, player, opponent):
+        self.turn = gameboard.current_turn
+
+        self.turrets = list(gameboard.turrets)
+        t = np.array([(o.x, o.y, o.fire_time, o.cooldown_time, o.is_dead, o.is_firing_next_turn)
+                      for o in self.turrets], dtype=np.int32).reshape(-1, 6)
+        self.turret_x, self.turret_y, self.turret_fire_time, self.turret_cooldown = t[:, 0], t[:, 1], t[:, 2], t[:, 3]
+        self.turret_dead = t[:, 4].astype(bool)
+        self.turret_firing_next = t[:, 5].astype(bool)
+
+        self.bullets = list(gameboard.bullets)
+        b = np.array([(o.x, o.y, D_INDEX[o.direction]) for o in self.bullets], dtype=np.int32).reshape(-1, 3)
+        self.bullet_x, self.bullet_y, self.bullet_f = b[:, 0], b[:, 1], b[:, 2]
+
+        self.power_up_squares = [(o.x, o.y) for o in gameboard.power_ups]
+        p = np.array(self.power_up_squares, dtype=np.int32).reshape(-1, 2)
+        self.power_up_x, self.power_up_y = p[:, 0], p[:, 1]
+
+        self.teleport_locations = [tuple(loc) for loc in gameboard.teleport_locations]
+        self.players = np.array([player_row(player), player_row(opponent)], dtype=np.int32)
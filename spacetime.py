@@ -0,0 +1,138 @@
+'''
+Time-expanded search: (x, y, facing) states at each turn from now, with
+waiting in place as a move, and a square only usable on the turns it is
+clear of turret fire and bullets.  The static distance field answers "how
+many turns to get there"; this answers "how soon can I safely be there",
+which can mean waiting somewhere safe or taking the long way round
+instead of stopping in front of a turret's line of fire.
+
+Turret fire repeats with the DangerSchedule's period, so when no bullets
+are flying a result only depends on the start state and the phase of the
+schedule, and is cached on those.
+'''
+import time
+import numpy as np
+
+MAX_TURNS = 64 # give up on goals further off than this
+
+# first moves, besides turning to face facing index f = 0..3
+WAIT = -1
+FORWARD = -2
+
+
+class SpaceTime:
+    ''' Per-map tables, call earliest as often as needed. '''
+
+    def __init__(self, engine, danger):
+        self.engine = engine
+        self.danger = danger
+        n = engine.n
+        # pred[s] is the state that moves forward into s, -1 if none
+        self.pred = np.full(4 * n, -1, dtype=np.int64)
+        movable = np.nonzero(engine.fwd >= 0)[0]
+        self.pred[engine.fwd[movable]] = movable
+        self.cache = {}
+        self.cache_version = None
+
+    def earliest(self, x, y, direction, turn, goals, blocked=(), unsafe=None, version=None,
+                 max_turns=MAX_TURNS, deadline=None):
+        '''
+        Earliest safe arrival at a goal, as (turns from now, first move,
+        (x, y) reached) with the first move WAIT, FORWARD or a facing index
+        to turn to, or None if no goal can be reached within max_turns.
+
+        goals is a list of (state mask, period, phase): the (4*w*h,) bool
+        state mask counts as reached on turns where turn % period == phase
+        (any turn if period is None).  blocked squares can never be entered
+        (the opponent).  unsafe[t] is a (w,h) bool array of squares a
+        bullet or turret fire is on t turns from now (a Forecast's unsafe
+        cube), for as many turns as known, and the DangerSchedule covers
+        the turns after; without it the schedule covers every turn.
+        version identifies the turret state for the per-phase cache.
+        With a deadline (perf_counter() time) it gives up between turns
+        once that passes, and returns None as if nothing was in reach.
+        '''
+        engine = self.engine
+        n = engine.n
+        start = engine.state(x, y, direction)
+        key = None
+        if unsafe is None:
+            if version != self.cache_version:
+                self.cache = {}
+                self.cache_version = version
+            key = (start, turn % self.danger.period, tuple(blocked),
+                   tuple((m.tobytes(), p, (turn - ph) % p if p else None) for m, p, ph in goals))
+            if key in self.cache:
+                return self.cache[key]
+
+        open_cells = engine.open.copy()
+        for (bx, by) in blocked:
+            open_cells[bx * engine.h + by] = False
+
+        levels = []
+        cur = np.zeros(4 * n, dtype=bool)
+        cur[start] = True
+        result = None
+        for t in range(max_turns + 1):
+            levels.append(cur)
+            hit = self.goal_hit(cur, goals, turn + t)
+            if hit is not None:
+                result = (t, self.first_move(levels, hit), divmod(hit % n, engine.h))
+                break
+            if t == max_turns:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                # out of time, and not an answer worth caching
+                return None
+            nxt = cur.copy()
+            nxt |= np.tile(cur.reshape(4, n).any(axis=0), 4)
+            moved = engine.fwd[np.nonzero(cur)[0]]
+            nxt[moved[moved >= 0]] = True
+            if unsafe is not None and t + 1 < len(unsafe):
+                safe = open_cells & ~unsafe[t + 1].ravel()
+            else:
+                safe = open_cells & ~self.danger.hit_grid(turn + t + 1).ravel()
+            nxt &= np.tile(safe, 4)
+            if not nxt.any():
+                break
+            cur = nxt
+
+        if key is not None:
+            self.cache[key] = result
+        return result
+
+    def goal_hit(self, cur, goals, turn):
+        ''' A state in cur that is a goal on this turn, or None. '''
+        for mask, period, phase in goals:
+            if period is not None and turn % period != phase:
+                continue
+            hits = np.nonzero(cur & mask)[0]
+            if hits.size:
+                return int(hits[0])
+        return None
+
+    def first_move(self, levels, s):
+        ''' Walk back from state s on the last level to the move taken on the first turn. '''
+        n = self.engine.n
+        move = None
+        for t in range(len(levels) - 1, 0, -1):
+            prev = levels[t - 1]
+            cell = s % n
+            if prev[s]:
+                move = WAIT
+            elif self.pred[s] >= 0 and prev[self.pred[s]]:
+                move = FORWARD
+                s = int(self.pred[s])
+            else:
+                move = s // n
+                s = next(f * n + cell for f in range(4) if prev[f * n + cell])
+        return move
+
+
+def state_mask(engine, squares, facings=range(4)):
+    ''' (4*w*h,) bool mask of the given squares in the given facings. '''
+    mask = np.zeros(4 * engine.n, dtype=bool)
+    for (x, y) in squares:
+        for f in facings:
+            mask[f * engine.n + x * engine.h + y] = True
+    return mask
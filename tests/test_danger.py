@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('PythonClientAPI')
+
+from PythonClientAPI.libs.Game.Enums import Direction
+import simulator
+from danger import DangerSchedule, TURRET_RANGE
+from PlayerAI import PlayerAI
+from snapshot import Snapshot
+
+
+def board(seed=0):
+    ''' A random 12x10 board and the wall rays a PlayerAI works out for it. '''
+    gameboard, s0, s1 = simulator.random_board(12, 10, turrets=6, fire_time=(1, 3), cooldown_time=(1, 4), seed=seed)
+    players = simulator.Player(*s0, Direction.UP), simulator.Player(*s1, Direction.UP)
+    bot = PlayerAI(use_dist_table=False)
+    bot.get_move(gameboard, *players)
+    return gameboard, players, bot.wall_ray
+
+
+def under_fire(gameboard, turn, turrets=None, late=()):
+    '''
+    Squares under fire the simulator's way, from each turret's own cycle
+    (running a turn behind for the turrets in late).
+    '''
+    grid = np.zeros((gameboard.width, gameboard.height), dtype=bool)
+    for t in turrets if turrets is not None else gameboard.turrets:
+        if t.is_firing(turn - 1 if t in late else turn):
+            for x in range(gameboard.width):
+                for y in range(gameboard.height):
+                    grid[x, y] |= gameboard.in_fire(t.x, t.y, x, y, TURRET_RANGE)
+    return grid
+
+
+def schedules(gameboard, wall_ray):
+    ''' The same schedule with per-phase counts and with only the per-turret masks. '''
+    dense = DangerSchedule(gameboard.width, gameboard.height, wall_ray, gameboard.turrets)
+    sparse = DangerSchedule(gameboard.width, gameboard.height, wall_ray, gameboard.turrets, budget=0)
+    assert dense.counts is not None and sparse.counts is None
+    return dense, sparse
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_schedule_matches_the_turrets(seed):
+    gameboard, players, wall_ray = board(seed)
+    for schedule in schedules(gameboard, wall_ray):
+        turns = list(range(3, 3 + 14))
+        expected = [under_fire(gameboard, turn) for turn in turns]
+        assert all((schedule.hit_grid(turn) == grid).all() for turn, grid in zip(turns, expected))
+        assert (schedule.hit_grids(turns) == np.array(expected)).all()
+
+
+def test_remove_shift_and_exclude():
+    gameboard, players, wall_ray = board(0)
+    dead, moved = gameboard.turrets[0], gameboard.turrets[1]
+    turns = list(range(20))
+    dense, sparse = schedules(gameboard, wall_ray)
+    for schedule in (dense, sparse):
+        schedule.remove(dead)
+        schedule.remove(dead) # twice is fine
+        schedule.shift((moved.x, moved.y), 1)
+    # the moved turret now fires a turn later, the dead one not at all
+    for turn in turns:
+        expected = under_fire(gameboard, turn, gameboard.turrets[1:], late=[moved])
+        assert (dense.hit_grid(turn) == expected).all()
+        assert (sparse.hit_grid(turn) == expected).all()
+        without = under_fire(gameboard, turn, gameboard.turrets[2:])
+        assert (dense.hit_grid(turn, exclude={(moved.x, moved.y)}) == without).all()
+    assert (dense.hit_grids(turns, {(moved.x, moved.y)}) == sparse.hit_grids(turns, {(moved.x, moved.y)})).all()
+    # every turret taken back out, shifted or not, leaves nothing behind
+    for turret in gameboard.turrets:
+        dense.remove(turret)
+    assert not dense.counts.any()
+
+
+def test_sync_follows_the_server():
+    gameboard, players, wall_ray = board(1)
+    turret = next(t for t in gameboard.turrets if t.cooldown_time > 1)
+    key = (turret.x, turret.y)
+    schedule = DangerSchedule(gameboard.width, gameboard.height, wall_ray, gameboard.turrets)
+    gameboard.current_turn = 10
+    gameboard.update_turrets()
+    assert not schedule.sync(Snapshot(gameboard, *players))
+    # the server says it fires next turn when the schedule says it doesn't, or the other way round
+    turret.is_firing_next_turn = not turret.is_firing_next_turn
+    assert schedule.sync(Snapshot(gameboard, *players))
+    assert schedule.firing(key, 11) == turret.is_firing_next_turn
+    assert not schedule.sync(Snapshot(gameboard, *players))
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('PythonClientAPI')
+
+from PythonClientAPI.libs.Game.Enums import Direction
+from distances import (DistanceEngine, build_distance_table, DIRECTIONS, UNREACHABLE,
+                       table_block, table_build_time)
+
+
+def baseline_distances(walls, x, y, direction, settle_once=False):
+    '''
+    The original recursive propagation from PlayerAI.calc_distances, turns
+    to every square for a player at (x, y) facing direction.
+
+    It overwrites a square's distance each time the square comes round
+    again, and a square can be queued one level further out by a
+    neighbour processed before it on its own level, so it sometimes ends
+    up a turn too far.  settle_once keeps the first distance instead,
+    which is the only change the search in distances.py makes to it.
+    '''
+    w, h = walls.shape
+    steps = {Direction.DOWN: (0, 1), Direction.UP: (0, -1), Direction.RIGHT: (1, 0), Direction.LEFT: (-1, 0)}
+    dist = [[(UNREACHABLE, [Direction.DOWN]) for j in range(h)] for i in range(w)]
+
+    def propagate(squares1, squares2, distance):
+        for pos in squares1:
+            squares2.pop(pos, None)
+        next_squares1 = squares2
+        next_squares2 = {}
+        for (x, y), d_list in squares1.items():
+            if settle_once and dist[x][y][0] < distance:
+                continue
+            for d in Direction:
+                x1, y1 = (x + steps[d][0]) % w, (y + steps[d][1]) % h
+                if walls[x1, y1]:
+                    continue
+                if d in d_list:
+                    near, cost = next_squares1, 1
+                else:
+                    near, cost = next_squares2, 2
+                if dist[x1][y1][0] > distance + cost:
+                    near.setdefault((x1, y1), []).append(d)
+                if dist[x1][y1][0] == distance + cost:
+                    near.setdefault((x1, y1), []).extend(dist[x1][y1][1] + [d])
+            dist[x][y] = (distance, d_list)
+        if next_squares1 or next_squares2:
+            propagate(next_squares1, next_squares2, distance + 1)
+
+    propagate({(x, y): [direction]}, {}, 0)
+    return np.array([[dist[i][j][0] for j in range(h)] for i in range(w)])
+
+
+def random_walls(w, h, density, seed):
+    rng = np.random.default_rng(seed)
+    return rng.random((w, h)) < density
+
+
+MAPS = [(1, 3, 0.0), (2, 2, 0.0), (2, 3, 0.2), (3, 3, 0.3), (5, 4, 0.25), (7, 9, 0.2), (12, 10, 0.3), (11, 13, 0.15)]
+
+
+@pytest.mark.parametrize('w, h, density', MAPS)
+def test_table_matches_baseline(w, h, density):
+    for seed in range(3):
+        walls = random_walls(w, h, density, seed)
+        engine = DistanceEngine(walls)
+        table = build_distance_table(engine)
+        assert table is not None
+        for x, y in zip(*np.nonzero(~walls)):
+            for direction in DIRECTIONS:
+                expected = baseline_distances(walls, x, y, direction, settle_once=True)
+                assert np.array_equal(table.dist_from(x, y, direction), expected), (x, y, direction)
+                assert np.array_equal(engine.search(x, y, direction).dist, expected), (x, y, direction)
+                # never further than the original, and the same squares reachable
+                original = baseline_distances(walls, x, y, direction)
+                assert (expected <= original).all()
+                assert np.array_equal(expected == UNREACHABLE, original == UNREACHABLE)
+
+
+@pytest.mark.parametrize('w, h, density', MAPS)
+def test_lazy_field_matches_full_search(w, h, density):
+    walls = random_walls(w, h, density, 1)
+    engine = DistanceEngine(walls)
+    table = build_distance_table(engine)
+    rng = np.random.default_rng(2)
+    for x, y in zip(*np.nonzero(~walls)):
+        direction = DIRECTIONS[rng.integers(4)]
+        field = engine.start(x, y, direction)
+        for tx, ty in rng.permutation(np.argwhere(~walls))[:5]:
+            assert field.distance(tx, ty) == table.distance(x, y, direction, tx, ty)
+
+
+def test_route_steps_cost_one_turn_each():
+    walls = random_walls(9, 7, 0.2, 4)
+    engine = DistanceEngine(walls)
+    table = build_distance_table(engine)
+    for x, y in zip(*np.nonzero(~walls)):
+        for tx, ty in zip(*np.nonzero(~walls)):
+            d = table.distance(x, y, Direction.UP, tx, ty)
+            route = table.route(x, y, Direction.UP, tx, ty)
+            if d == UNREACHABLE or d == 0:
+                assert route == []
+            else:
+                assert len(route) == d
+                assert route[-1][:2] == (tx, ty)
+
+
+def test_blocks_cover_every_state():
+    # maps whose 4*n states aren't a whole number of blocks, and ones under a byte column
+    for w, h in [(1, 1), (1, 2), (3, 5), (30, 30)]:
+        n = w * h
+        assert 1 <= table_block(n) <= (4 * n + 7) // 8
+        engine = DistanceEngine(np.zeros((w, h), dtype=bool))
+        table = build_distance_table(engine)
+        assert table.table.shape == (4 * n, n)
+        assert (table.table[np.arange(4 * n), np.arange(4 * n) % n] == 0).all()
+
+
+def test_build_time_limit():
+    engine = DistanceEngine(np.zeros((20, 20), dtype=bool))
+    assert build_distance_table(engine, max_seconds=table_build_time(engine.n) / 2) is None
+    assert build_distance_table(engine, max_seconds=table_build_time(engine.n)) is not None
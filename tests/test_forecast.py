@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('PythonClientAPI')
+
+from PythonClientAPI.libs.Game.Enums import Direction
+import simulator
+from PlayerAI import PlayerAI
+
+
+def forecast_of(walls, turrets, bullets, turn=0):
+    '''
+    The Forecast a PlayerAI works out on a 9x7 board, bullets as
+    (x, y, direction).  Returns (bot, gameboard, forecast).
+    '''
+    gameboard = simulator.Gameboard(9, 7, walls, turrets)
+    gameboard.current_turn = turn
+    gameboard.update_turrets()
+    gameboard.bullets = [simulator.Bullet(x, y, d, None) for x, y, d in bullets]
+    bot = PlayerAI(use_dist_table=False)
+    bot.get_move(gameboard, simulator.Player(8, 6, Direction.UP), simulator.Player(8, 5, Direction.UP))
+    return bot, gameboard, bot.danger_forecast(gameboard)
+
+
+def test_bullets_stop_at_walls_and_wrap():
+    bot, gameboard, forecast = forecast_of([(6, 1)], [], [(3, 1, Direction.RIGHT), (0, 1, Direction.UP)])
+    # (leaving out column 0, the other bullet crosses row 1 there)
+    assert [(np.nonzero(forecast.bullets[t, 1:, 1])[0] + 1).tolist() for t in range(6)] == [[3], [4], [5], [], [], []]
+    # nothing in column 0 stops the other one, it goes round and round
+    assert [np.nonzero(forecast.bullets[t, 0])[0].tolist() for t in range(6)] == [[1], [0], [6], [5], [4], [3]]
+    assert not forecast.quiet
+    assert (forecast.unsafe == forecast.bullets).all()
+
+
+def test_fire_follows_the_schedule():
+    bot, gameboard, forecast = forecast_of([(6, 1)], [(4, 3, 1, 1), (1, 1, 2, 3)], [], turn=7)
+    assert forecast.quiet
+    for t in range(forecast.horizon):
+        assert (forecast.fire[t] == bot.danger.hit_grid(7 + t)).all()
+    assert (forecast.unsafe == forecast.fire).all()
+
+
+def test_doomed_turret_stops_firing():
+    # a bullet right next to the turret heading at it, the turret fires every other turn
+    bot, gameboard, forecast = forecast_of([], [(4, 3, 1, 1)], [(3, 3, Direction.RIGHT)])
+    assert forecast.doomed == {(4, 3)}
+    assert (forecast.fire[0] == bot.danger.hit_grid(0)).all()
+    assert not forecast.fire[1:].any()
+    # heading away it's no threat to the turret
+    bot, gameboard, forecast = forecast_of([], [(4, 3, 1, 1)], [(3, 3, Direction.LEFT)])
+    assert forecast.doomed == set()
+    assert all((forecast.fire[t] == bot.danger.hit_grid(t)).all() for t in range(forecast.horizon))
+    assert forecast.fire[1:].any()
+
+
+def test_unsafe_hits_leaves_out_excluded_turrets():
+    # both fire on every turn, (4,1) only from the first, (2,3) from both
+    bot, gameboard, forecast = forecast_of([], [(4, 3, 5, 1), (1, 3, 5, 1)], [])
+    assert forecast.unsafe_hits([(4, 1)], [1, 2])
+    assert not forecast.unsafe_hits([(4, 1)], [1, 2], exclude=[(4, 3)])
+    assert forecast.unsafe_hits([(2, 3)], [1], exclude=[(4, 3)])
+    assert not forecast.unsafe_hits([(2, 3)], [1], exclude=[(4, 3), (1, 3)])
+    assert not forecast.unsafe_hits([(4, 1)], [forecast.horizon])
+    assert not forecast.unsafe_hits([(7, 0)], range(forecast.horizon))
+
@@ -0,0 +1,77 @@
+import os
+import numpy as np
+import pytest
+from mapcache import MapCache, layout, unpack, ALIGN
+
+
+def tables():
+    rng = np.random.default_rng(0)
+    return {
+        'dist_table': rng.integers(0, 255, size=(4 * 15, 15), dtype=np.uint8),
+        'wall_ray': rng.integers(0, 5, size=(4, 3, 5), dtype=np.int32),
+        # an empty last table after an odd-sized one, the file ends on the padding
+        'slay_squares': np.zeros((0, 2), dtype=np.int64),
+    }
+
+
+def assert_same(loaded, stored):
+    assert list(loaded) == list(stored)
+    for name, table in stored.items():
+        assert loaded[name].dtype == table.dtype
+        assert loaded[name].shape == table.shape
+        assert np.array_equal(loaded[name], table)
+
+
+def test_layout_unpack_round_trip():
+    stored = tables()
+    index, header, size = layout(stored)
+    data = np.zeros(size, dtype=np.uint8)
+    data[:len(header)] = np.frombuffer(header, dtype=np.uint8)
+    for name, table in stored.items():
+        offset = index[name][2]
+        assert offset % ALIGN == 0
+        data[offset:offset + table.nbytes] = np.frombuffer(table.tobytes(), dtype=np.uint8)
+    assert_same(unpack(data), stored)
+
+
+def test_unpack_rejects_cut_short():
+    stored = tables()
+    index, header, size = layout(stored)
+    data = np.zeros(size, dtype=np.uint8)
+    data[:len(header)] = np.frombuffer(header, dtype=np.uint8)
+    with pytest.raises(ValueError):
+        unpack(data[:index['wall_ray'][2] + 8])
+    with pytest.raises(ValueError):
+        unpack(np.zeros(size, dtype=np.uint8))
+
+
+def test_store_load(tmp_path):
+    cache = MapCache(str(tmp_path))
+    stored = tables()
+    cache.store('abc', stored)
+    loaded = cache.load('abc')
+    assert_same(loaded, stored)
+    assert not loaded['dist_table'].flags.writeable
+    assert cache.load('missing') is None
+
+
+def test_load_drops_bad_file(tmp_path):
+    cache = MapCache(str(tmp_path))
+    cache.store('abc', tables())
+    path = cache.path('abc')
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+    assert cache.load('abc') is None
+    assert not os.path.exists(path)
+
+
+def test_evict_keeps_newest(tmp_path):
+    stored = tables()
+    size = layout(stored)[2]
+    cache = MapCache(str(tmp_path), max_bytes=2 * size)
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache.store(key, stored)
+        os.utime(cache.path(key), (i, i))
+    cache.store('d', stored)
+    assert cache.load('a') is None and cache.load('b') is None
+    assert cache.load('c') is not None and cache.load('d') is not None
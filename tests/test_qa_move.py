@@ -0,0 +1,86 @@
+import random
+import pytest
+
+pytest.importorskip('PythonClientAPI')
+
+from PythonClientAPI.libs.Game.Enums import Direction, Move
+import simulator
+from PlayerAI import PlayerAI, d_opp, d_perp
+
+MOVES = [Move.FORWARD, Move.NONE, Move.FACE_UP, Move.FACE_DOWN, Move.FACE_LEFT, Move.FACE_RIGHT]
+
+
+def baseline_qa(bot, gameboard, player, move):
+    '''
+    The bullet checks of the original QA_move, a scan over all of
+    gameboard.bullets.  The boards below have no turrets and keep the
+    opponent out of the way, so this is all of QA_move that can fire.
+    '''
+    def escape():
+        if player.teleport_count != 0:
+            return bot.run_for_the_hills(gameboard)
+        elif player.shield_count != 0:
+            return Move.SHIELD
+        return move
+
+    def open_square(d):
+        x2, y2 = bot.next_pos((player.x, player.y), d)
+        return not bot.walls[x2 * bot.h + y2]
+
+    if move == Move.FORWARD:
+        x1, y1 = bot.next_pos((player.x, player.y), player.direction)
+        for bullet in gameboard.bullets:
+            if bullet.direction == d_opp[player.direction]:
+                if (bullet.x, bullet.y) == (x1, y1):
+                    return escape()
+                elif bot.next_pos((bullet.x, bullet.y), bullet.direction, n=2) == (x1, y1):
+                    for d in d_perp[bullet.direction]:
+                        if open_square(d):
+                            return bot.dir_to_move(player, d)
+            if bot.next_pos((bullet.x, bullet.y), bullet.direction) == (x1, y1):
+                if player.direction not in d_perp[bullet.direction]:
+                    for d in d_perp[bullet.direction]:
+                        if open_square(d):
+                            return bot.dir_to_move(player, d)
+                    return escape()
+                return Move.NONE
+    else:
+        for bullet in gameboard.bullets:
+            if bullet.direction == d_opp[player.direction] and (bullet.x, bullet.y) == (player.x, player.y):
+                return escape()
+    return move
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_bullet_checks_match_the_scan(seed):
+    rng = random.Random(seed)
+    gameboard, s0, s1 = simulator.random_board(12, 12, wall_density=0.2, turrets=0, power_ups=0,
+                                               teleports=3, seed=seed)
+    bot = PlayerAI(use_dist_table=False)
+    opponent = simulator.Player(*s1, Direction.UP)
+    free = [(x, y) for x in range(12) for y in range(12) if not gameboard.blocked(x, y) and (x, y) != s1]
+    overridden = 0
+    for case in range(150):
+        x, y = rng.choice(free)
+        player = simulator.Player(x, y, rng.choice(list(Direction)))
+        player.teleport_count = rng.choice([0, 1])
+        player.shield_count = rng.choice([0, 1])
+        ahead = gameboard.step(x, y, player.direction)
+        if ahead == gameboard.step(opponent.x, opponent.y, opponent.direction):
+            continue
+        # bullets heading at the square ahead or the player's own from up to 3 squares away, and a stray one
+        gameboard.bullets = []
+        for i in range(rng.randint(1, 3)):
+            tx, ty = rng.choice([ahead, (x, y)])
+            d = rng.choice(list(Direction))
+            gameboard.bullets.append(simulator.Bullet(*gameboard.step(tx, ty, d_opp[d], rng.randint(0, 3)), d, None))
+        gameboard.bullets.insert(rng.randint(0, len(gameboard.bullets)),
+                                 simulator.Bullet(rng.randrange(12), rng.randrange(12), rng.choice(list(Direction)), None))
+        gameboard.current_turn = case
+        bot.get_move(gameboard, player, opponent)
+        move = rng.choice(MOVES)
+        expected = baseline_qa(bot, gameboard, player, move)
+        assert bot.QA_move(gameboard, player, opponent, move) == expected
+        overridden += expected != move
+    # enough of the cases had something to dodge
+    assert overridden >= 10
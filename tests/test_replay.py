@@ -0,0 +1,177 @@
+import random
+import numpy as np
+import pytest
+
+pytest.importorskip('PythonClientAPI')
+
+from PythonClientAPI.libs.Game.Enums import Move
+import replay
+import simulator
+from replay import ReplayWriter, Replay, Archive, state_delta, apply_delta
+from snapshot import Snapshot
+
+MOVES = [Move.FORWARD, Move.FORWARD, Move.SHOOT, Move.FACE_UP, Move.FACE_DOWN, Move.FACE_LEFT, Move.FACE_RIGHT,
+         Move.NONE]
+
+
+def play(path, turns=80, seed=0, hp=10**6, new_route=9):
+    '''
+    Records a match of random moves with bullets flying, returns what was
+    recorded each turn as (snapshot, move, bot_state).
+    '''
+    gameboard, s0, s1 = simulator.random_board(14, 11, turrets=6, power_ups=5, seed=seed)
+    match = simulator.Match(gameboard, None, None, s0, s1, max_turns=turns)
+    for p in match.players:
+        p.hp = hp
+    rng = random.Random(seed)
+    route = [[rng.randrange(14), rng.randrange(11), rng.randrange(4)] for i in range(40)]
+    writer = None
+    recorded = []
+    while not match.over():
+        snap = Snapshot(gameboard, match.players[0], match.players[1])
+        if writer is None:
+            writer = ReplayWriter(path, gameboard, snap)
+        if gameboard.current_turn % new_route == 0:
+            route = [[rng.randrange(14), rng.randrange(11), rng.randrange(4)] for i in range(40)]
+        bot_state = dict(turn_parity=gameboard.current_turn % 2, route=route, fixed='same every turn')
+        route = route[1:]
+        moves = [rng.choice(MOVES), rng.choice(MOVES)]
+        writer.record(snap, moves[0], bot_state, spent=0.001)
+        recorded.append((snap, moves[0], bot_state))
+        match.step(moves)
+    writer.close()
+    return recorded
+
+
+def rows(a):
+    return sorted(map(tuple, np.asarray(a).reshape(-1, 3).tolist()))
+
+
+def assert_turn(state, snap, move, bot_state):
+    assert state.turn == snap.turn
+    assert state.move == move
+    assert state.spent == pytest.approx(0.001)
+    assert np.array_equal(state.players, snap.players)
+    assert np.array_equal(state.turret_dead, snap.turret_dead)
+    assert np.array_equal(state.turret_firing_next, snap.turret_firing_next)
+    assert np.array_equal(state.power_ups, np.stack([snap.power_up_x, snap.power_up_y], axis=1))
+    assert state.bot_state == bot_state
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'match.replay')
+    recorded = play(path)
+    r = Replay(path)
+    assert len(r) == len(recorded)
+    assert sum(len(snap.bullets) for snap, move, state in recorded) > 0
+    for i, (snap, move, bot_state) in enumerate(recorded):
+        state = r[i]
+        assert_turn(state, snap, move, bot_state)
+        assert not state.truncated
+        assert rows(state.bullets) == rows(np.stack([snap.bullet_x, snap.bullet_y, snap.bullet_f], axis=1))
+    # out of order reads start from the keyframe before
+    for i in [len(recorded) - 1, 3, 40, 0]:
+        assert_turn(r[i], *recorded[i])
+    r.close()
+
+
+def test_state_delta():
+    old = dict(a=1, route=[[1, 2, 0], [1, 3, 0], [1, 4, 2]], b=[5])
+    new = dict(a=1, route=[[1, 4, 2]], b=[6])
+    delta = state_delta(old, new)
+    assert delta == dict(route={'drop': 2}, b=[6])
+    assert apply_delta(old, delta) == new
+    assert state_delta(new, new) == {}
+
+
+def test_over_budget(tmp_path, monkeypatch):
+    # room for a keyframe with one bullet, not for the bot state
+    monkeypatch.setattr(replay, 'TURN_BUDGET', 69)
+    path = str(tmp_path / 'match.replay')
+    recorded = play(path, seed=1)
+    r = Replay(path)
+    assert any(r[i].truncated for i in range(len(r)))
+    for i, (snap, move, bot_state) in enumerate(recorded):
+        state = r[i]
+        assert state.bot_state is None
+        # the bullets read back are a subset of the real ones
+        real = rows(np.stack([snap.bullet_x, snap.bullet_y, snap.bullet_f], axis=1))
+        assert all(b in real for b in rows(state.bullets))
+    sizes = np.diff(r.offsets)
+    assert (sizes - replay.LENGTH.size <= 69).all()
+
+
+def test_state_comes_back_after_lost(tmp_path, monkeypatch):
+    # a new 40 step route doesn't fit, the whole state does once the route is shorter
+    monkeypatch.setattr(replay, 'TURN_BUDGET', 330)
+    path = str(tmp_path / 'match.replay')
+    recorded = play(path, seed=2, new_route=30)
+    r = Replay(path)
+    known = [r[i].bot_state is not None for i in range(len(r))]
+    for i, (snap, move, bot_state) in enumerate(recorded):
+        assert r[i].bot_state in (None, bot_state)
+    # lost after each new route, then back until the next one
+    assert known[:30] == sorted(known[:30])
+    assert not known[30] and known[59]
+
+
+def test_cut_short_and_empty(tmp_path):
+    path = str(tmp_path / 'match.replay')
+    recorded = play(path, turns=20)
+    with open(path, 'rb') as f:
+        data = f.read()
+    # a match still being written: the half record at the end is left out
+    cut = str(tmp_path / 'cut.replay')
+    with open(cut, 'wb') as f:
+        f.write(data[:-3])
+    r = Replay(cut)
+    assert len(r) == len(recorded) - 1
+    assert_turn(r[len(r) - 1], *recorded[len(r) - 1])
+    r.close()
+
+    for name, body in [('empty.replay', b''), ('header.replay', data[:replay.PREAMBLE.size + 4])]:
+        with open(str(tmp_path / name), 'wb') as f:
+            f.write(body)
+        with pytest.raises(ValueError):
+            Replay(str(tmp_path / name))
+    archive = Archive(str(tmp_path))
+    assert 'empty.replay' not in list(archive)
+    assert len(archive['match.replay']) == len(recorded)
+
+
+def test_writer_error_reaches_caller(tmp_path):
+    gameboard, s0, s1 = simulator.random_board(10, 10, seed=0)
+    match = simulator.Match(gameboard, None, None, s0, s1)
+    snap = Snapshot(gameboard, match.players[0], match.players[1])
+    writer = ReplayWriter(str(tmp_path / 'missing' / 'match.replay'), gameboard, snap)
+    writer.thread.join()
+    with pytest.raises(OSError):
+        writer.record(snap, Move.NONE)
+    # raised once, later turns are dropped quietly
+    writer.record(snap, Move.NONE)
+    writer.close()
+
+
+def test_bot_records_its_state_from_before_the_move(tmp_path):
+    # the writer thread works the state out after the move, it has to come out as it was before
+    from PlayerAI import PlayerAI
+    gameboard, s0, s1 = simulator.random_board(16, 16, turrets=8, power_ups=6, seed=3)
+    bot = PlayerAI(record=str(tmp_path))
+    before = []
+    decide_move = bot.decide_move
+
+    def decide_and_keep(*args):
+        before.append(bot.carried_state())
+        return decide_move(*args)
+
+    bot.decide_move = decide_and_keep
+    match = simulator.Match(gameboard, bot, PlayerAI(), s0, s1, max_turns=120)
+    for p in match.players:
+        p.hp = 10**6
+    match.play()
+    bot.close()
+    r = Replay(str(next(tmp_path.iterdir())))
+    assert len(r) == len(before)
+    assert any(state and state['route'] for state in before)
+    assert [r[i].bot_state for i in range(len(r))] == before
+    r.close()
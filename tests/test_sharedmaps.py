@@ -0,0 +1,105 @@
+import gc
+import json
+import multiprocessing
+import os
+import uuid
+import numpy as np
+import pytest
+
+pytest.importorskip('fcntl')
+
+from sharedmaps import SharedTables, segment_name
+
+
+class User:
+    ''' Stands in for a PlayerAI holding the views. '''
+
+
+def tables():
+    return {'wall_ray': np.arange(60, dtype=np.int32).reshape(4, 3, 5),
+            'walls': np.array([True, False, True, True])}
+
+
+def segment_exists(shared, key):
+    try:
+        shm = shared.open(segment_name(key))
+    except FileNotFoundError:
+        return False
+    shm.close()
+    return True
+
+
+def pids_path(tmp_path, key):
+    return str(tmp_path / (segment_name(key) + '.pids'))
+
+
+@pytest.fixture
+def key():
+    return uuid.uuid4().hex
+
+
+def test_publish_acquire_release(tmp_path, key):
+    shared = SharedTables(lock_dir=str(tmp_path))
+    first, second = User(), User()
+    assert shared.acquire(key, first) is None
+    views = shared.publish(key, tables(), first)
+    for name, table in tables().items():
+        assert np.array_equal(views[name], table)
+        assert not views[name].flags.writeable
+    again = shared.acquire(key, second)
+    assert np.array_equal(again['wall_ray'], tables()['wall_ray'])
+    with open(pids_path(tmp_path, key)) as f:
+        assert json.load(f) == [os.getpid()]
+
+    # the segment goes with the last user in the last process
+    del views, again, first
+    gc.collect()
+    assert segment_exists(shared, key)
+    del second
+    gc.collect()
+    assert not segment_exists(shared, key)
+    assert not os.path.exists(pids_path(tmp_path, key))
+
+
+def hold(lock_dir, key, attached, done):
+    shared = SharedTables(lock_dir=lock_dir)
+    user = User()
+    attached.put(shared.acquire(key, user) is not None)
+    done.wait(10)
+    shared.close()
+
+
+def test_other_process_keeps_segment(tmp_path, key):
+    context = multiprocessing.get_context('fork')
+    shared = SharedTables(lock_dir=str(tmp_path))
+    user = User()
+    shared.publish(key, tables(), user)
+    attached, done = context.Queue(), context.Event()
+    child = context.Process(target=hold, args=(str(tmp_path), key, attached, done))
+    child.start()
+    try:
+        assert attached.get(timeout=10)
+        shared.close()
+        assert segment_exists(shared, key)
+    finally:
+        done.set()
+        child.join(10)
+    assert not segment_exists(shared, key)
+    assert not os.path.exists(pids_path(tmp_path, key))
+
+
+def test_dead_pids_are_pruned(tmp_path, key):
+    # a worker that died without letting go doesn't keep the segment around
+    child = multiprocessing.get_context('fork').Process(target=os._exit, args=(0,))
+    child.start()
+    child.join()
+    with open(pids_path(tmp_path, key), 'w') as f:
+        json.dump([child.pid], f)
+    shared = SharedTables(lock_dir=str(tmp_path))
+    user = User()
+    shared.publish(key, tables(), user)
+    with open(pids_path(tmp_path, key)) as f:
+        assert json.load(f) == [os.getpid()]
+    shared.close()
+    assert not segment_exists(shared, key)
+    assert not os.path.exists(pids_path(tmp_path, key))
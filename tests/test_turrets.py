@@ -0,0 +1,63 @@
+import pytest
+
+pytest.importorskip('PythonClientAPI')
+
+from PythonClientAPI.libs.Game.Enums import Direction
+import simulator
+from PlayerAI import PlayerAI
+from snapshot import Snapshot
+from turrets import TurretTracker
+
+
+def open_board(turrets):
+    ''' 9x9 board without walls, turrets as (x, y, fire_time, cooldown_time). '''
+    gameboard = simulator.Gameboard(9, 9, [], turrets)
+    return gameboard, simulator.Player(0, 8, Direction.UP), simulator.Player(8, 0, Direction.DOWN)
+
+
+def test_tracker_reports_deaths():
+    gameboard, player, opponent = open_board([(1, 1, 1, 3), (4, 4, 1, 3), (7, 7, 1, 3)])
+    tracker = TurretTracker()
+    assert tracker.update(Snapshot(gameboard, player, opponent)) == []
+    assert tracker.live_num == 3
+    version = tracker.version
+
+    gameboard.turrets[1].is_dead = True
+    died = tracker.update(Snapshot(gameboard, player, opponent))
+    assert [(t.x, t.y) for t in died] == [(4, 4)]
+    assert tracker.live_num == 2
+    assert tracker.version > version
+
+    # no news is no bump, a bump is a bump
+    version = tracker.version
+    assert tracker.update(Snapshot(gameboard, player, opponent)) == []
+    assert tracker.version == version
+    tracker.bump()
+    assert tracker.version == version + 1
+
+
+def test_shared_square_outlives_one_turret():
+    # both turrets are slain from their corners, (3,3) is a corner of both
+    gameboard, player, opponent = open_board([(2, 4, 1, 2), (4, 2, 1, 2)])
+    first, second = gameboard.turrets
+    bot = PlayerAI(use_dist_table=False)
+    bot.get_move(gameboard, player, opponent)
+    assert set(bot.turret_slay_sq) == {(1, 3), (3, 3), (1, 5), (3, 5), (3, 1), (5, 1), (5, 3)}
+    assert [(t.x, t.y) for t in bot.turret_slay_sq[(3, 3)]] == [(2, 4), (4, 2)]
+    # like the plain dict the squares used to be, the last turret listed is the one to slay
+    assert bot.slay_target((3, 3)) is bot.snapshot.turrets[1]
+
+    second.is_dead = True
+    gameboard.current_turn += 1
+    bot.get_move(gameboard, player, opponent)
+    assert set(bot.turret_slay_sq) == {(1, 3), (3, 3), (1, 5), (3, 5)}
+    assert bot.slay_target((3, 3)).x == first.x and bot.slay_target((3, 3)).y == first.y
+    for x in range(9):
+        for y in range(9):
+            assert bot.bits.has(bot.slay_bits, x, y) == ((x, y) in bot.turret_slay_sq)
+
+    first.is_dead = True
+    gameboard.current_turn += 1
+    bot.get_move(gameboard, player, opponent)
+    assert bot.turret_slay_sq == {}
+    assert bot.slay_bits == 0
@@ -0,0 +1,209 @@
+'''
+Self-play tournaments between PlayerAI variants, for tuning the
+heuristics PlayerAI keeps as attributes (slay_sq_bonus, standoff_turns,
+min_slay_cooldown, adjacent_slay_cooldown, escape_rank, ...).
+
+A variant is a name plus attribute overrides.  Every pair of variants
+plays every seed twice, once from each start square, and the matches are
+spread over a process pool.  Results are folded into the report as they
+come in and can be streamed to a JSON lines file.  A match is fully
+determined by (seed, variant, variant), so any of them can be replayed
+on its own with --replay (add --profile to see where its turns went).
+
+    python tournament.py --variant bold:slay_sq_bonus=3 --variant calm:standoff_turns=1 --games 500
+    python tournament.py --variant bold:slay_sq_bonus=3 --replay 17 bold base
+'''
+import argparse
+import ast
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from benchmark import summarize
+from PlayerAI import PlayerAI
+import simulator
+
+BASE = 'base' # the variant with no overrides, always playing
+
+
+def parse_variant(text):
+    ''' "name:attr=value,attr=value" -> (name, {attr: value}), values are Python literals. '''
+    name, _, rest = text.partition(':')
+    overrides = {}
+    for item in filter(None, rest.split(',')):
+        attr, _, value = item.partition('=')
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            raise argparse.ArgumentTypeError('bad value in ' + item)
+        if not hasattr(PlayerAI(), attr):
+            raise argparse.ArgumentTypeError('PlayerAI has no attribute ' + attr)
+        overrides[attr] = value
+    return name, overrides
+
+
+def make_ai(overrides, options):
+    ai = PlayerAI(**options)
+    for attr, value in overrides.items():
+        setattr(ai, attr, value)
+    return ai
+
+
+class TimedAI:
+    ''' Passes get_move through to ai, keeping the time each call took. '''
+
+    def __init__(self, ai):
+        self.ai = ai
+        self.times = []
+
+    def get_move(self, gameboard, player, opponent):
+        start = time.perf_counter()
+        move = self.ai.get_move(gameboard, player, opponent)
+        self.times.append(time.perf_counter() - start)
+        return move
+
+    def close(self):
+        self.ai.close()
+
+
+def play(job):
+    '''
+    One match, job = (seed, name0, name1, variants, board, options).
+    Returns a JSON-able dict, latencies leave out turn 0 (map setup).
+    '''
+    seed, name0, name1, variants, board, options = job
+    gameboard, s0, s1 = simulator.random_board(board['size'], board['size'], turrets=board['turrets'],
+                                               power_ups=board['power_ups'], seed=seed)
+    ais = [TimedAI(make_ai(variants[name0], options)), TimedAI(make_ai(variants[name1], options))]
+    match = simulator.Match(gameboard, ais[0], ais[1], s0, s1, max_turns=board['turns'])
+    winner = match.play()
+    return dict(seed=seed, variants=[name0, name1], winner=winner, turns=gameboard.current_turn,
+                scores=[p.score for p in match.players], hp=[p.hp for p in match.players],
+                setup_ms=[1000 * ai.times[0] if ai.times else 0.0 for ai in ais],
+                latency=[summarize(ai.times[1:]) for ai in ais])
+
+
+def jobs(variants, games, first_seed, board, options):
+    ''' Every pair of variants on every seed, from both sides. '''
+    for seed in range(first_seed, first_seed + games):
+        for a, b in itertools.combinations(sorted(variants), 2):
+            yield (seed, a, b, variants, board, options)
+            yield (seed, b, a, variants, board, options)
+
+
+class Report:
+    ''' Running totals per variant and per pairing. '''
+
+    def __init__(self, variants):
+        self.names = sorted(variants)
+        self.record = {name: [0, 0, 0] for name in self.names} # wins, losses, draws
+        self.pairs = {}
+        self.p99 = {name: [] for name in self.names}
+        self.max_ms = {name: 0.0 for name in self.names}
+        self.matches = 0
+
+    def add(self, result):
+        self.matches += 1
+        for side, name in enumerate(result['variants']):
+            other = result['variants'][1 - side]
+            if result['winner'] is None:
+                outcome = 2
+            else:
+                outcome = 0 if result['winner'] == side else 1
+            self.record[name][outcome] += 1
+            self.pairs.setdefault((name, other), [0, 0, 0])[outcome] += 1
+            self.p99[name].append(result['latency'][side]['p99'])
+            self.max_ms[name] = max(self.max_ms[name], result['latency'][side]['max'])
+
+    def print(self, out=sys.stdout):
+        print('{} matches'.format(self.matches), file=out)
+        print('{:>12} {:>6} {:>6} {:>6} {:>8} {:>11} {:>8}'.format(
+            'variant', 'wins', 'losses', 'draws', 'win %', 'mean p99 ms', 'max ms'), file=out)
+        for name in sorted(self.names, key=lambda name: -win_rate(self.record[name])):
+            w, l, d = self.record[name]
+            p99 = self.p99[name]
+            print('{:>12} {:>6} {:>6} {:>6} {:>8.1f} {:>11.2f} {:>8.2f}'.format(
+                name, w, l, d, 100 * win_rate(self.record[name]),
+                sum(p99) / len(p99) if p99 else 0.0, self.max_ms[name]), file=out)
+        if len(self.names) > 2:
+            print('win % of row vs column', file=out)
+            print('{:>12} '.format('') + ' '.join('{:>8}'.format(name[:8]) for name in self.names), file=out)
+            for a in self.names:
+                cells = ['{:>8}'.format('-' if a == b else '{:.1f}'.format(100 * win_rate(self.pairs.get((a, b), (0, 0, 0)))))
+                         for b in self.names]
+                print('{:>12} '.format(a) + ' '.join(cells), file=out)
+
+
+def win_rate(record):
+    ''' Draws count half. '''
+    w, l, d = record
+    return (w + 0.5 * d) / (w + l + d) if w + l + d else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play PlayerAI variants against each other.')
+    parser.add_argument('--variant', type=parse_variant, action='append', default=[],
+                        help='name:attr=value,... (repeatable), plays against "base" and each other')
+    parser.add_argument('--games', type=int, default=100, help='seeds, each pair plays each seed twice')
+    parser.add_argument('--seed', type=int, default=0, help='first seed')
+    parser.add_argument('--size', type=int, default=20)
+    parser.add_argument('--turrets', type=int, default=6)
+    parser.add_argument('--power-ups', type=int, default=4)
+    parser.add_argument('--turns', type=int, default=200)
+    parser.add_argument('--budget-ms', type=float, help='deadline mode (matches stop being reproducible)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes, 1 plays in this one')
+    parser.add_argument('--shared-memory', action='store_true',
+                        help="workers share each map's tables through shared memory")
+    parser.add_argument('--jsonl', help='append every match result to this file as it finishes')
+    parser.add_argument('--replay', nargs=3, metavar=('SEED', 'VARIANT0', 'VARIANT1'),
+                        help='play just this match here and print it')
+    parser.add_argument('--profile', action='store_true', help='with --replay, print get_move timing too')
+    args = parser.parse_args()
+
+    variants = {BASE: {}}
+    variants.update(args.variant)
+    board = dict(size=args.size, turrets=args.turrets, power_ups=args.power_ups, turns=args.turns)
+    options = {} if args.budget_ms is None else dict(time_budget=args.budget_ms / 1000.0)
+    if args.shared_memory:
+        options['shared_memory'] = True
+
+    if args.replay:
+        seed, name0, name1 = args.replay
+        for name in (name0, name1):
+            if name not in variants:
+                parser.error('unknown variant ' + name)
+        if args.profile:
+            import instrument
+            instrument.enable()
+        print(json.dumps(play((int(seed), name0, name1, variants, board, options))))
+        return
+    if len(variants) < 2:
+        parser.error('give at least one --variant to play against base')
+
+    report = Report(variants)
+    out = open(args.jsonl, 'a') if args.jsonl else None
+    todo = jobs(variants, args.games, args.seed, board, options)
+    total = args.games * len(variants) * (len(variants) - 1)
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(args.workers) if args.workers > 1 else None
+    try:
+        results = pool.imap_unordered(play, todo, chunksize=4) if pool else map(play, todo)
+        for result in results:
+            report.add(result)
+            if out:
+                out.write(json.dumps(result) + '\n')
+            if report.matches % 100 == 0:
+                print('{}/{} matches, {:.0f} s'.format(report.matches, total, time.perf_counter() - start),
+                      file=sys.stderr)
+    finally:
+        if pool:
+            pool.terminate()
+        if out:
+            out.close()
+    report.print()
+
+
+if __name__ == '__main__':
+    main()
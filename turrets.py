@@ -0,0 +1,38 @@
+'''
+Turret bookkeeping across turns.  Turrets never move or come back to life,
+so anything derived from them only needs touching when one dies.
+'''
+import numpy as np
+
+
+class TurretTracker:
+    '''
+    Compares the turrets' death states against the previous turn.
+    version is bumped whenever the set of live turrets (or anything the
+    owner derives from it, see bump) changes, so caches built from turret
+    state can store the version they were built at and check it cheaply.
+    '''
+
+    def __init__(self):
+        self.alive = None # bool array in gameboard.turrets order, None until the first update
+        self.live_num = 0
+        self.version = 0
+
+    def update(self, snapshot):
+        ''' Returns the turrets (objects from the Snapshot) that died since the last update. '''
+        if self.alive is None:
+            self.alive = ~snapshot.turret_dead
+            self.live_num = int(self.alive.sum())
+            self.version += 1
+            return []
+
+        died = np.nonzero(snapshot.turret_dead & self.alive)[0]
+        if died.size:
+            self.alive[died] = False
+            self.live_num -= died.size
+            self.version += 1
+        return [snapshot.turrets[i] for i in died]
+
+    def bump(self):
+        ''' Mark derived turret state as changed without a death (e.g. giving up on a turret). '''
+        self.version += 1
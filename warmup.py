@@ -0,0 +1,47 @@
+'''
+Background building of per-map tables that are too slow for the first
+turn.  Each job runs in its own daemon thread (the heavy lifting is in
+NumPy, which lets go of the GIL, so get_move keeps running meanwhile) and
+its result waits in a queue until the caller picks it up with poll.
+
+Nothing is handed over behind the caller's back: a table only replaces
+the per-turn fallback when poll is called, at the start of a turn, so a
+turn never mixes the two.
+'''
+import queue
+import threading
+import instrument
+
+
+class WarmUp:
+    ''' Jobs in flight for one map, keyed by name. '''
+
+    def __init__(self):
+        self.done = queue.Queue()
+        self.pending = set()
+
+    def start(self, name, build, *args):
+        ''' Runs build(*args) in a daemon thread, poll returns its result under name. '''
+        self.pending.add(name)
+        threading.Thread(target=self.run, args=(name, build, args), name='warmup-' + name, daemon=True).start()
+
+    def run(self, name, build, args):
+        try:
+            result = build(*args)
+        except Exception as e:
+            # the caller carries on with what it uses until now
+            if instrument.DEBUG:
+                instrument.debug('warm up of', name, 'failed:', e)
+            result = None
+        self.done.put((name, result))
+
+    def poll(self):
+        ''' {name: result} of the jobs finished since the last poll. '''
+        ready = {}
+        while True:
+            try:
+                name, result = self.done.get_nowait()
+            except queue.Empty:
+                return ready
+            self.pending.discard(name)
+            ready[name] = result